@@ -36,4 +36,12 @@ celery_app.conf.beat_schedule = {
         'task': 'app.tasks.cleanup_expired_analysis',
         'schedule': 3600.0,  # 每小时执行一次
     },
+    'sweep-recommendation-rollups': {
+        'task': 'app.tasks.sweep_recommendation_rollups',
+        'schedule': 60.0,  # 每分钟执行一次
+    },
+    'rebuild-recommendation-rollups': {
+        'task': 'app.tasks.rebuild_recommendation_rollups',
+        'schedule': 21600.0,  # 每6小时执行一次
+    },
 }
\ No newline at end of file
@@ -0,0 +1,59 @@
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from .stage_metrics import observe_stage
+from .profiling import attach_thread
+
+logger = logging.getLogger(__name__)
+
+# 并发数据收集配置
+GATHER_CALL_TIMEOUT = float(os.getenv("GATHER_CALL_TIMEOUT", "8"))
+GATHER_MAX_WORKERS = int(os.getenv("GATHER_MAX_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=GATHER_MAX_WORKERS, thread_name_prefix="gather")
+
+def gather_calls(calls: Dict[Hashable, Callable[[], Any]],
+                 timeout: float = GATHER_CALL_TIMEOUT,
+                 stage_prefix: Optional[str] = None) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+    """并发执行一组调用，最多等待 timeout 秒
+
+    返回 (已完成调用的结果, 超时或失败的键)。超时的调用不会被取消，
+    只是不再等待其结果。stage_prefix 不为空时按 "前缀.阶段" 记录每个调用的耗时，
+    键为元组时取最后一个元素作为阶段名。
+    """
+    def timed(key, call):
+        start = time.perf_counter()
+        try:
+            with attach_thread():
+                return call()
+        finally:
+            if stage_prefix:
+                stage = key[-1] if isinstance(key, tuple) else key
+                observe_stage(f"{stage_prefix}.{stage}", time.perf_counter() - start)
+
+    # 每个调用复制一份当前上下文，线程中执行的查询仍计入本次请求的SQL统计
+    futures = {
+        key: _executor.submit(contextvars.copy_context().run, timed, key, call)
+        for key, call in calls.items()
+    }
+    done, not_done = wait(list(futures.values()), timeout=timeout)
+
+    results: Dict[Hashable, Any] = {}
+    failed: List[Hashable] = []
+    for key, future in futures.items():
+        if future not in done:
+            failed.append(key)
+            continue
+        error = future.exception()
+        if error is not None:
+            logger.error(f"并发调用失败 {key}: {error}")
+            failed.append(key)
+            continue
+        results[key] = future.result()
+
+    if not_done:
+        logger.warning(f"{len(not_done)} 个调用超过 {timeout}s 截止时间，返回部分结果")
+    return results, failed
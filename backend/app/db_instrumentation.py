@@ -0,0 +1,140 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 同一条语句（忽略参数）在一次请求/任务中执行达到该次数时视为 N+1 嫌疑
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+# 调试模式下在响应头中返回查询统计
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+# 查询数超过该值时记录告警日志，0 表示不检查
+QUERY_COUNT_WARN = int(os.getenv("QUERY_COUNT_WARN", "50"))
+
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"IN \((?:[^()]*)\)", re.IGNORECASE)
+
+class QueryBudgetExceeded(AssertionError):
+    """查询次数超出预算"""
+
+class QueryStats:
+    """一次请求或任务中的SQL统计"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float):
+        # gather_calls 的线程池会并发写入同一个统计对象
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.statements[normalize_statement(statement)] += 1
+
+    def n_plus_one(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Dict[str, Any]]:
+        """重复执行次数达到阈值的语句，按次数倒序"""
+        return [
+            {"statement": statement, "count": count}
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "queries": self.count,
+            "db_ms": round(self.seconds * 1000, 1),
+            "n_plus_one": self.n_plus_one(),
+        }
+
+def normalize_statement(statement: str) -> str:
+    """合并空白并折叠 IN 列表，使参数不同的同一条语句归为一类"""
+    return _IN_LIST.sub("IN (...)", _WHITESPACE.sub(" ", statement).strip())
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("db_query_stats", default=None)
+
+def current_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    started = conn.info.get("query_started")
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    stats.record(statement, elapsed)
+
+def instrument_engine(engine):
+    """在引擎上注册查询计数事件（重复调用只注册一次）"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def report(stats: QueryStats):
+    """记录统计：有 N+1 嫌疑或查询过多时告警，否则调试级别"""
+    suspects = stats.n_plus_one()
+    if suspects:
+        logger.warning(
+            f"{stats.label} 疑似N+1查询: 共{stats.count}次查询 {stats.seconds * 1000:.1f}ms，"
+            f"重复语句: {[(s['count'], s['statement'][:200]) for s in suspects[:3]]}"
+        )
+    elif QUERY_COUNT_WARN and stats.count > QUERY_COUNT_WARN:
+        logger.warning(f"{stats.label} 查询次数过多: {stats.count}次 {stats.seconds * 1000:.1f}ms")
+    else:
+        logger.debug(f"{stats.label} 查询统计: {stats.count}次 {stats.seconds * 1000:.1f}ms")
+
+def start_tracking(label: str) -> Token:
+    """开始统计，返回的 token 交给 stop_tracking；用于开始和结束分处两个回调的场景（如 Celery 信号）"""
+    return _current.set(QueryStats(label))
+
+def stop_tracking(token: Token, log: bool = True) -> Optional[QueryStats]:
+    stats = _current.get()
+    _current.reset(token)
+    if log and stats is not None:
+        report(stats)
+    return stats
+
+@contextmanager
+def track_queries(label: str, log: bool = True) -> Iterator[QueryStats]:
+    """统计代码块内（含复制了上下文的线程）执行的SQL"""
+    token = start_tracking(label)
+    stats = _current.get()
+    try:
+        yield stats
+    finally:
+        stop_tracking(token, log=log)
+
+@contextmanager
+def query_budget(max_queries: int, label: str = "query_budget") -> Iterator[QueryStats]:
+    """测试用：代码块内查询次数超过 max_queries 时抛出 QueryBudgetExceeded
+
+        with query_budget(3):
+            client.get("/api/v1/recommendations/")
+    """
+    with track_queries(label, log=False) as stats:
+        yield stats
+    if stats.count > max_queries:
+        details = "\n".join(f"  {count}x {statement[:200]}" for statement, count in stats.statements.most_common(5))
+        raise QueryBudgetExceeded(f"{label}: 执行了{stats.count}次查询，预算{max_queries}次\n{details}")
+
+def response_headers(stats: QueryStats) -> Dict[str, str]:
+    """调试模式下附加到响应的查询统计头"""
+    return {
+        "X-DB-Queries": str(stats.count),
+        "X-DB-Time-Ms": f"{stats.seconds * 1000:.1f}",
+        "X-DB-N-Plus-One": str(len(stats.n_plus_one())),
+    }
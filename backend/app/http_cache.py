@@ -0,0 +1,210 @@
+"""读多写少接口的HTTP缓存：ETag + 条件请求 + Redis 响应体缓存
+
+ETag 由数据版本（最新入库K线日期、推荐表的最近写入）和请求参数计算，不需要先生成响应体：
+- 请求带 If-None-Match 且与当前 ETag 相同时直接返回 304；
+- 否则按 ETag 在 Redis（不可用时为本地LRU）中查找编码好的响应体；
+- 都未命中才执行接口逻辑，编码后写入缓存。
+
+行情类接口的数据来自 yfinance，开盘期间按 HTTP_CACHE_MARKET_MAX_AGE 分段刷新，
+收盘后到下一次开盘前保持不变；Cache-Control 的 max-age 按交易时段给出。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Tuple
+from zoneinfo import ZoneInfo
+import redis
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .redis_client import get_redis, mark_redis_unavailable
+
+logger = logging.getLogger(__name__)
+
+# 是否启用接口缓存
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "true").lower() == "true"
+# 开盘期间行情类接口的 max-age（秒），同时是ETag的刷新间隔
+HTTP_CACHE_MARKET_MAX_AGE = int(os.getenv("HTTP_CACHE_MARKET_MAX_AGE", "30"))
+# 收盘后 max-age 的上限（秒），实际取到下一次开盘的剩余时间和该值中的较小者
+HTTP_CACHE_CLOSED_MAX_AGE = int(os.getenv("HTTP_CACHE_CLOSED_MAX_AGE", "3600"))
+# 推荐类接口的 max-age（秒）
+HTTP_CACHE_RECOMMENDATION_MAX_AGE = int(os.getenv("HTTP_CACHE_RECOMMENDATION_MAX_AGE", "60"))
+# Redis 中响应体的最长保留时间（秒）和本地回退缓存的条数
+HTTP_CACHE_BODY_TTL = int(os.getenv("HTTP_CACHE_BODY_TTL", "21600"))
+HTTP_CACHE_LOCAL_SIZE = int(os.getenv("HTTP_CACHE_LOCAL_SIZE", "256"))
+
+BODY_KEY_PREFIX = "http:body:"
+
+# 交易所时区和常规交易时段，按代码后缀匹配，默认美股
+MARKET_SESSIONS = {
+    ".SS": ("Asia/Shanghai", (9, 30), (15, 0)),
+    ".SZ": ("Asia/Shanghai", (9, 30), (15, 0)),
+    ".HK": ("Asia/Hong_Kong", (9, 30), (16, 0)),
+    ".T": ("Asia/Tokyo", (9, 0), (15, 0)),
+}
+DEFAULT_SESSION = ("America/New_York", (9, 30), (16, 0))
+
+def _session_for(symbol: Optional[str]):
+    for suffix, session in MARKET_SESSIONS.items():
+        if symbol and symbol.upper().endswith(suffix):
+            return session
+    return DEFAULT_SESSION
+
+def market_state(symbol: Optional[str] = None, now: Optional[datetime] = None) -> Tuple[bool, int, str]:
+    """返回 (是否开盘, 距离开/收盘切换的秒数, 当前时段标识)
+
+    开盘期间时段标识按 HTTP_CACHE_MARKET_MAX_AGE 分段；收盘后为最近一次收盘的日期，
+    直到下一次开盘都不变。不考虑节假日，节假日按普通收盘处理。
+    """
+    zone_name, (open_h, open_m), (close_h, close_m) = _session_for(symbol)
+    zone = ZoneInfo(zone_name)
+    now = now.astimezone(zone) if now else datetime.now(zone)
+    open_at = now.replace(hour=open_h, minute=open_m, second=0, microsecond=0)
+    close_at = now.replace(hour=close_h, minute=close_m, second=0, microsecond=0)
+
+    if now.weekday() < 5 and open_at <= now < close_at:
+        step = max(HTTP_CACHE_MARKET_MAX_AGE, 1)
+        return True, int((close_at - now).total_seconds()), f"open:{int(now.timestamp()) // step}"
+
+    # 最近一次收盘所在的交易日
+    last_close = close_at if now >= close_at else close_at - timedelta(days=1)
+    while last_close.weekday() >= 5:
+        last_close -= timedelta(days=1)
+    next_open = open_at if now < open_at else open_at + timedelta(days=1)
+    while next_open.weekday() >= 5:
+        next_open += timedelta(days=1)
+    return False, int((next_open - now).total_seconds()), f"closed:{last_close.date().isoformat()}"
+
+def market_cache_policy(symbol: Optional[str] = None) -> Tuple[int, int]:
+    """行情类接口的 (max-age, 响应体保留秒数)
+
+    开盘期间 ETag 每 HTTP_CACHE_MARKET_MAX_AGE 秒变化一次，旧响应体很快失效，只保留一个周期；
+    收盘后到下一次开盘前内容不变，可以长时间缓存。
+    """
+    is_open, remaining, _ = market_state(symbol)
+    if is_open:
+        max_age = min(HTTP_CACHE_MARKET_MAX_AGE, max(remaining, 1))
+        return max_age, max_age
+    return max(min(HTTP_CACHE_CLOSED_MAX_AGE, remaining), 1), min(HTTP_CACHE_BODY_TTL, max(remaining, 1))
+
+def price_version(db: Session, symbol: str) -> str:
+    """行情数据版本：最新入库K线日期 + 交易时段标识"""
+    from .services.price_store import get_price_store
+    last_bar = get_price_store(db).latest_date(symbol)
+    _, _, bucket = market_state(symbol)
+    return f"{last_bar.isoformat() if last_bar else '-'}:{bucket}"
+
+def recommendation_version(db: Session) -> str:
+    """推荐数据版本：最近写入时间、行数和最早的未过期时间（有推荐过期时版本随之变化）"""
+    from .models import StockRecommendation
+    latest, count = db.query(
+        func.max(StockRecommendation.created_at), func.count(StockRecommendation.id)
+    ).one()
+    next_expiry = db.query(func.min(StockRecommendation.expires_at)).filter(
+        StockRecommendation.expires_at > datetime.now()
+    ).scalar()
+    return f"{latest.isoformat() if latest else '-'}:{count}:{next_expiry.isoformat() if next_expiry else '-'}"
+
+def make_etag(key: str, version: str) -> str:
+    digest = hashlib.blake2b(f"{key}|{version}".encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀（经过压缩的代理可能把强 ETag 改成弱 ETag）
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+class BodyCache:
+    """按 ETag 缓存编码好的响应体，Redis 不可用时使用本地LRU"""
+
+    def __init__(self, local_size: int = HTTP_CACHE_LOCAL_SIZE):
+        self.local_size = local_size
+        self._local: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag: str) -> Optional[bytes]:
+        body = None
+        client = get_redis()
+        if client is not None:
+            try:
+                # 共享客户端按文本解码，响应体以文本存取
+                cached = client.get(BODY_KEY_PREFIX + etag)
+                body = cached.encode("utf-8") if cached is not None else None
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+        if body is None:
+            with self._lock:
+                entry = self._local.get(etag)
+                if entry and entry[0] > time.time():
+                    self._local.move_to_end(etag)
+                    body = entry[1]
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def put(self, etag: str, body: bytes, ttl: int):
+        with self._lock:
+            self._local[etag] = (time.time() + ttl, body)
+            self._local.move_to_end(etag)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+        client = get_redis()
+        if client is not None:
+            try:
+                client.setex(BODY_KEY_PREFIX + etag, ttl, body.decode("utf-8"))
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0,
+            "local_entries": len(self._local),
+        }
+
+body_cache = BodyCache()
+
+def _headers(etag: str, max_age: int) -> dict:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}, must-revalidate"}
+
+def cached_response(request: Request, key: str, version: str, build: Callable[[], Any],
+                    max_age: int, body_ttl: Optional[int] = None) -> Response:
+    """按数据版本返回 304、缓存的响应体或新生成的响应
+
+    key 需包含影响响应内容的所有请求参数；build 返回可JSON编码的响应对象，抛出异常时不缓存。
+    """
+    if not HTTP_CACHE_ENABLED:
+        return Response(
+            content=json.dumps(jsonable_encoder(build()), ensure_ascii=False),
+            media_type="application/json"
+        )
+    etag = make_etag(key, version)
+    headers = _headers(etag, max_age)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = body_cache.get(etag)
+    if body is None:
+        body = json.dumps(jsonable_encoder(build()), ensure_ascii=False).encode("utf-8")
+        body_cache.put(etag, body, max(body_ttl or HTTP_CACHE_BODY_TTL, max_age))
+        headers["X-Cache"] = "MISS"
+    else:
+        headers["X-Cache"] = "HIT"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,208 @@
+import os
+import time
+import random
+import logging
+import threading
+import importlib.util
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .lazy_imports import lazy_import
+
+logger = logging.getLogger(__name__)
+
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+curl_requests = lazy_import("curl_cffi.requests")
+
+# 出站HTTP连接池配置（OpenAI兼容接口共用一个 httpx 客户端）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+# 服务端支持时使用HTTP/2（需要安装 h2）
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+# 失败重试次数和指数退避参数（秒），退避时间取 [0, min(上限, 基数*2^n)] 内的随机值
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+# yfinance 会话模拟的浏览器指纹（curl_cffi impersonate）
+YF_IMPERSONATE = os.getenv("YF_IMPERSONATE", "chrome")
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_http_client = None
+_openai_clients: Dict[Tuple[str, str], Any] = {}
+_yf_local = threading.local()
+_yf_sessions_created = 0
+
+# 按主机统计的请求、错误和重试次数
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"requests": 0, "errors": 0, "retries": 0})
+
+def _count(host: str, key: str):
+    with _lock:
+        _counters[host][key] += 1
+
+def _check_pid():
+    """fork 之后丢弃父进程的连接，子进程重新建立"""
+    global _pid, _http_client, _yf_local, _yf_sessions_created
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _http_client = None
+        _openai_clients.clear()
+        _yf_local = threading.local()
+        _yf_sessions_created = 0
+        _counters.clear()
+
+def _http2_available() -> bool:
+    return HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+def _on_request(request):
+    _count(request.url.host, "requests")
+
+def _on_response(response):
+    if response.status_code >= 500 or response.status_code == 429:
+        _count(response.request.url.host, "errors")
+
+def get_http_client():
+    """进程内共享的 httpx 客户端：按主机复用长连接，支持时启用HTTP/2"""
+    global _http_client
+    _check_pid()
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    http2=_http2_available(),
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                    event_hooks={"request": [_on_request], "response": [_on_response]}
+                )
+    return _http_client
+
+def get_openai_client(base_url: str, api_key: Optional[str] = None):
+    """进程内共享的 OpenAI 客户端，使用共享连接池，重试由 SDK 按带抖动的指数退避处理"""
+    _check_pid()
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (base_url, api_key or "")
+    client = _openai_clients.get(key)
+    if client is None:
+        http_client = get_http_client()
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client,
+                    max_retries=HTTP_RETRIES
+                )
+                _openai_clients[key] = client
+    return client
+
+def get_yf_session():
+    """当前线程的 yfinance 会话
+
+    yfinance 需要 curl_cffi 会话，会话内部复用到 Yahoo 的连接但不保证线程安全，
+    因此每个线程一个，随线程复用（探测线程池、gather 线程池、请求线程）。
+    """
+    global _yf_sessions_created
+    _check_pid()
+    session = getattr(_yf_local, "session", None)
+    if session is None:
+        session = curl_requests.Session(impersonate=YF_IMPERSONATE, timeout=HTTP_READ_TIMEOUT)
+        _yf_local.session = session
+        with _lock:
+            _yf_sessions_created += 1
+    return session
+
+def backoff_delay(attempt: int, base: float = HTTP_BACKOFF_BASE, cap: float = HTTP_BACKOFF_MAX) -> float:
+    """第 attempt 次重试前的等待时间（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# 视为临时性错误的异常类名：curl_cffi / httpx 的连接、超时和连接中断错误（含子类）
+TRANSIENT_ERROR_NAMES = {
+    "ConnectionError", "ConnectError", "DNSError", "NetworkError", "ReadError", "WriteError",
+    "RemoteProtocolError", "Timeout", "TimeoutException", "ConnectTimeout", "ReadTimeout",
+    "WriteTimeout", "PoolTimeout",
+}
+# 视为临时性错误的 curl 错误码：无法解析/连接、超时、空响应、收发失败、HTTP/2 流错误
+CURL_TRANSIENT_CODES = {6, 7, 16, 18, 28, 52, 55, 56, 92}
+
+def _is_transient(error: Exception) -> bool:
+    """连接错误、超时、限流（429）和服务端错误（5xx）视为可重试，
+    其他错误（如代码不存在、其他4xx、无效URL）直接抛出"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    if "RateLimit" in name:
+        return True
+    module = type(error).__module__ or ""
+    if module.startswith(("curl_cffi", "httpx")):
+        if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__):
+            return True
+        return getattr(error, "code", None) in CURL_TRANSIENT_CODES
+    return "Timeout" in name
+
+def call_with_retry(func: Callable, *args, host: str = "unknown", retries: int = HTTP_RETRIES,
+                    retry_if: Callable[[Exception], bool] = _is_transient, **kwargs):
+    """调用 func，遇到临时性错误时按带抖动的指数退避重试"""
+    for attempt in range(retries + 1):
+        _count(host, "requests")
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            _count(host, "errors")
+            if attempt >= retries or not retry_if(e):
+                raise
+            delay = backoff_delay(attempt)
+            _count(host, "retries")
+            logger.warning(f"{host} 调用失败，{delay:.2f}秒后第{attempt + 1}次重试: {e}")
+            time.sleep(delay)
+
+def _pool_connections() -> Dict[str, Dict[str, int]]:
+    """共享 httpx 客户端连接池中各主机的连接状态"""
+    hosts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"connections": 0, "idle": 0, "http2": 0})
+    if _http_client is None:
+        return {}
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    try:
+        for connection in list(getattr(pool, "connections", [])):
+            origin = getattr(connection, "_origin", None)
+            host = origin.host.decode() if origin is not None else "unknown"
+            hosts[host]["connections"] += 1
+            if connection.is_idle():
+                hosts[host]["idle"] += 1
+            if "HTTP/2" in connection.info():
+                hosts[host]["http2"] += 1
+    except Exception as e:
+        logger.warning(f"读取连接池状态失败: {e}")
+    return dict(hosts)
+
+def transport_stats() -> Dict[str, Any]:
+    """连接池配置、各主机连接数和请求/错误/重试计数，用于按 worker 并发度调整连接池大小"""
+    with _lock:
+        counters = {host: dict(values) for host, values in _counters.items()}
+        yf_sessions = _yf_sessions_created
+    return {
+        "pid": os.getpid(),
+        "config": {
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTP_MAX_KEEPALIVE,
+            "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+            "connect_timeout": HTTP_CONNECT_TIMEOUT,
+            "read_timeout": HTTP_READ_TIMEOUT,
+            "http2": _http2_available(),
+            "retries": HTTP_RETRIES,
+        },
+        "pool": _pool_connections(),
+        "yfinance_sessions_created": yf_sessions,
+        "requests": counters,
+    }
@@ -0,0 +1,71 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 启动后在后台线程预热的重量级模块，设为空字符串关闭预热
+IMPORT_WARMUP_MODULES = [
+    name.strip() for name in os.getenv("IMPORT_WARMUP_MODULES", "pandas,numpy,yfinance,openai").split(",")
+    if name.strip()
+]
+
+class LazyModule:
+    """首次访问属性时才真正导入的模块代理
+
+    pandas/numpy/yfinance/openai 单独导入就要几百毫秒，放到第一次使用时加载，
+    API 和 Celery worker 启动时不再为它们付出导入成本。
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    """返回延迟导入的模块代理"""
+    return LazyModule(name)
+
+def warm_up(modules: Iterable[str] = None) -> Dict[str, float]:
+    """依次导入模块，返回每个模块的耗时（毫秒）"""
+    timings = {}
+    for name in IMPORT_WARMUP_MODULES if modules is None else modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            logger.warning(f"预热导入 {name} 失败: {e}")
+    return timings
+
+def warm_up_in_background(modules: Iterable[str] = None) -> threading.Thread:
+    """在守护线程中预热，服务先开始接收请求"""
+    def run():
+        timings = warm_up(modules)
+        if timings:
+            logger.info(f"后台预热导入完成: {timings}")
+
+    thread = threading.Thread(target=run, name="import-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,16 +1,20 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import logging
+import os
+import time
 
-from .database import get_db, engine
-from .models import Base
-from .routers import stocks, analysis, tasks, recommendations
-from .celery_app import celery_app
+from .database import get_db
+from .routers import stocks, analysis, tasks, recommendations, admin, quotes
+from .lazy_imports import warm_up_in_background
+from . import metrics
+from . import db_instrumentation
+from . import profiling
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 数据库结构由 python -m app.migrate 维护；本地开发时可设置 AUTO_MIGRATE=true 在启动时执行
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -29,18 +33,54 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 列表接口的下一页游标放在响应头里
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        # 同步路由在线程池中执行时会复制当前上下文，查询统计可以跟随过去
+        with db_instrumentation.track_queries(f"{request.method} {request.url.path}") as query_stats:
+            profile = profiling.start_profile("request", f"{request.method} {request.url.path}",
+                                              profiling.PROFILE_SLOW_REQUEST_MS)
+            try:
+                response = await call_next(request)
+            finally:
+                profiling.finish_profile(profile, {"sql": query_stats.summary()})
+        status = response.status_code
+        if db_instrumentation.DEBUG:
+            response.headers.update(db_instrumentation.response_headers(query_stats))
+        return response
+    finally:
+        metrics.observe_request(request.method, metrics.route_template(request), status, time.perf_counter() - started)
+
 # 注册路由
 app.include_router(stocks.router, prefix="/api/v1/stocks", tags=["stocks"])
 app.include_router(analysis.router, prefix="/api/v1/analysis", tags=["analysis"])
 app.include_router(tasks.router, prefix="/api/v1/tasks", tags=["tasks"])
 app.include_router(recommendations.router, prefix="/api/v1/recommendations", tags=["recommendations"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
+app.include_router(quotes.router, prefix="/api/v1/quotes", tags=["quotes"])
+
+@app.on_event("startup")
+async def on_startup():
+    if AUTO_MIGRATE:
+        from .migrate import run_migrations
+        run_migrations()
+    # 重量级依赖延迟到首次使用时导入，启动后在后台线程提前加载
+    warm_up_in_background()
 
 @app.get("/")
 async def root():
     return {"message": "股票分析系统 API", "version": "1.0.0"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(content=metrics.render_metrics(), media_type=metrics.CONTENT_TYPE_LATEST)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "stock-analysis-api"}
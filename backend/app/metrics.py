@@ -0,0 +1,241 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+from .profiling import record_phase
+
+logger = logging.getLogger(__name__)
+
+# 多进程模式（uvicorn 多 worker、Celery prefork）需要在进程启动前设置该目录
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Celery worker 指标导出端口，设为0关闭
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9808"))
+# 统计积压长度的 Celery 队列（Redis broker 中队列即同名列表）
+CELERY_METRICS_QUEUES = [q.strip() for q in os.getenv("CELERY_METRICS_QUEUES", "celery").split(",") if q.strip()]
+
+# 作为 yfinance 指标标签的股票代码：只有 stocks 表中的代码单独计数，其余归为 other，
+# 单个进程最多使用 METRICS_MAX_SYMBOL_LABELS 个代码标签；已知代码集合每 METRICS_SYMBOL_REFRESH 秒重新加载
+METRICS_MAX_SYMBOL_LABELS = int(os.getenv("METRICS_MAX_SYMBOL_LABELS", "500"))
+METRICS_SYMBOL_REFRESH = float(os.getenv("METRICS_SYMBOL_REFRESH", "300"))
+
+OTHER_SYMBOL = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "API请求耗时", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+
+# 耗时直方图不带股票代码以控制序列数，调用/错误计数按股票代码区分（未入库的代码归为 other）
+YFINANCE_CALL_DURATION = Histogram(
+    "yfinance_call_duration_seconds", "yfinance调用耗时", ["operation"], buckets=LATENCY_BUCKETS
+)
+YFINANCE_CALLS = Counter("yfinance_calls_total", "yfinance调用次数", ["operation", "symbol"])
+YFINANCE_ERRORS = Counter("yfinance_errors_total", "yfinance调用失败次数", ["operation", "symbol"])
+
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "LLM调用耗时", ["analysis_type", "mode"], buckets=LLM_BUCKETS
+)
+LLM_CALLS = Counter("llm_calls_total", "LLM调用次数", ["analysis_type", "mode"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM调用失败次数", ["analysis_type", "mode"])
+LLM_TOKENS = Counter("llm_tokens_total", "LLM token用量", ["analysis_type", "kind"])
+
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Celery任务耗时", ["task", "state"], buckets=TASK_BUCKETS
+)
+
+class SymbolLabels:
+    """把股票代码映射为指标标签，避免任意输入的代码产生无限多的时间序列
+
+    已知代码集合由后台线程加载后整体替换，调用方不等待数据库；新线程不继承请求的上下文，
+    这次查询不会计入请求的SQL统计和采样。首次加载完成前所有代码都归为 other。
+    """
+
+    def __init__(self, limit: int = METRICS_MAX_SYMBOL_LABELS, refresh: float = METRICS_SYMBOL_REFRESH):
+        self.limit = limit
+        self.refresh = refresh
+        self._known: frozenset = frozenset()
+        self._loaded_at = 0.0
+        self._loading = False
+        self._used = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from .database import SessionLocal
+        from .models import Stock
+        session = SessionLocal()
+        try:
+            self._known = frozenset(symbol for (symbol,) in session.query(Stock.symbol))
+        except Exception as e:
+            logger.warning(f"加载指标用的股票代码失败: {e}")
+        finally:
+            session.close()
+            # 失败时同样等到下一个周期再加载，避免每次调用都查询数据库
+            self._loaded_at = time.time()
+            self._loading = False
+
+    def _maybe_reload(self):
+        if self._loading or time.time() - self._loaded_at <= self.refresh:
+            return
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name="metrics-symbols", daemon=True).start()
+
+    def label(self, symbol: str) -> str:
+        if not symbol or symbol == "-":
+            return symbol or "-"
+        self._maybe_reload()
+        if symbol not in self._known:
+            return OTHER_SYMBOL
+        with self._lock:
+            if symbol not in self._used:
+                if len(self._used) >= self.limit:
+                    return OTHER_SYMBOL
+                self._used.add(symbol)
+            return symbol
+
+symbol_labels = SymbolLabels()
+
+@contextmanager
+def observe_yfinance(operation: str, symbol: str) -> Iterator[None]:
+    """记录一次 yfinance 调用的耗时和成败"""
+    started = time.perf_counter()
+    label = symbol_labels.label(symbol)
+    YFINANCE_CALLS.labels(operation, label).inc()
+    try:
+        yield
+    except Exception:
+        YFINANCE_ERRORS.labels(operation, label).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        YFINANCE_CALL_DURATION.labels(operation).observe(elapsed)
+        record_phase(f"yfinance.{operation}", elapsed)
+
+@contextmanager
+def observe_llm(analysis_type: str, mode: str = "single") -> Iterator[None]:
+    """记录一次LLM调用的耗时和成败，mode 为 single/batch/stream"""
+    started = time.perf_counter()
+    LLM_CALLS.labels(analysis_type, mode).inc()
+    try:
+        yield
+    except Exception:
+        LLM_ERRORS.labels(analysis_type, mode).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        LLM_CALL_DURATION.labels(analysis_type, mode).observe(elapsed)
+        record_phase(f"llm.{analysis_type}.{mode}", elapsed)
+
+def record_llm_tokens(analysis_type: str, usage):
+    """累计一次响应的 token 用量"""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(analysis_type, "prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(analysis_type, "completion").inc(usage.completion_tokens or 0)
+
+class RuntimeCollector:
+    """采集时读取的瞬时值：数据库连接池和 Celery 队列积压"""
+
+    def collect(self):
+        from .database import engine
+        pool = engine.pool
+        gauge = GaugeMetricFamily("db_pool_connections", "数据库连接池连接数", labels=["state"])
+        for state, attr in (("size", "size"), ("checked_in", "checkedin"),
+                            ("checked_out", "checkedout"), ("overflow", "overflow")):
+            reader = getattr(pool, attr, None)
+            if reader is not None:
+                try:
+                    gauge.add_metric([state], reader())
+                except Exception:
+                    continue
+        yield gauge
+
+        from .redis_client import get_redis, mark_redis_unavailable
+        depth = GaugeMetricFamily("celery_queue_length", "Celery队列中等待的任务数", labels=["queue"])
+        client = get_redis()
+        if client is not None:
+            try:
+                for queue in CELERY_METRICS_QUEUES:
+                    depth.add_metric([queue], client.llen(queue))
+            except Exception as e:
+                mark_redis_unavailable(e)
+        yield depth
+
+_runtime_collector = RuntimeCollector()
+
+def _registry() -> CollectorRegistry:
+    """多进程模式下汇总各进程写入的指标文件，否则使用默认注册表"""
+    from prometheus_client import REGISTRY
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def render_metrics() -> bytes:
+    """生成 /metrics 的响应内容（含连接池和队列积压）"""
+    registry = _registry()
+    output = generate_latest(registry)
+    runtime = CollectorRegistry()
+    runtime.register(_runtime_collector)
+    return output + generate_latest(runtime)
+
+def route_template(request) -> str:
+    """取匹配到的路由模板（如 /api/v1/stocks/{symbol}），未匹配时归为 unmatched，避免路径参数撑爆序列数"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUEST_DURATION.labels(method, route, str(status)).observe(seconds)
+
+def prepare_multiproc_dir():
+    """清空多进程指标目录，避免读到上次运行遗留的数据（只在主进程启动时调用）"""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+def mark_process_dead(pid: Optional[int] = None):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+# Celery 任务开始时间，按任务ID记录
+_task_started: Dict[str, float] = {}
+
+def task_started(task_id: str):
+    _task_started[task_id] = time.perf_counter()
+
+def task_finished(task_id: str, task_name: str, state: str):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_DURATION.labels(task_name, state or "UNKNOWN").observe(time.perf_counter() - started)
+
+def start_worker_exporter():
+    """在 Celery 主进程中启动指标导出端口
+
+    prefork 子进程的指标需要 PROMETHEUS_MULTIPROC_DIR；未设置时只能看到主进程自身的指标。
+    """
+    if not WORKER_METRICS_PORT:
+        return
+    if not PROMETHEUS_MULTIPROC_DIR:
+        logger.warning("未设置 PROMETHEUS_MULTIPROC_DIR，worker 子进程的指标不会被导出")
+    prepare_multiproc_dir()
+    registry = _registry()
+    registry.register(_runtime_collector)
+    start_http_server(WORKER_METRICS_PORT, registry=registry)
+    logger.info(f"Celery 指标导出端口: {WORKER_METRICS_PORT}")
+
@@ -0,0 +1,45 @@
+"""数据库结构迁移
+
+建表、搜索索引和分区表的 DDL 统一在这里执行，API 和 Celery 进程启动时不再访问数据库做迁移。
+部署时在启动服务前运行一次：
+
+    python -m app.migrate
+"""
+import logging
+import sys
+import time
+
+from .database import engine
+from .models import Base
+from .services.stock_search_service import ensure_search_indexes
+from .services.analysis_store import ensure_analysis_storage
+from .services.price_store import ensure_price_storage
+from .pagination import ensure_listing_indexes
+from .services.recommendation_rollup import ensure_recommendation_rollups
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_STEPS = [
+    ("create_tables", lambda: Base.metadata.create_all(bind=engine)),
+    ("search_indexes", lambda: ensure_search_indexes(engine)),
+    ("analysis_storage", lambda: ensure_analysis_storage(engine)),
+    ("price_storage", lambda: ensure_price_storage(engine)),
+    ("listing_indexes", lambda: ensure_listing_indexes(engine)),
+    ("recommendation_rollups", lambda: ensure_recommendation_rollups(engine)),
+]
+
+def run_migrations() -> bool:
+    """按顺序执行所有迁移步骤，建表失败时返回 False"""
+    for name, step in MIGRATION_STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"迁移步骤 {name} 失败: {e}")
+            return False
+        logger.info(f"迁移步骤 {name} 完成，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+    return True
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(0 if run_migrations() else 1)
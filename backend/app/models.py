@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON, Boolean, Date, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Text, JSON, Boolean, Date, Numeric, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -37,10 +37,32 @@ class StockPrice(Base):
     
     stock = relationship("Stock", back_populates="prices")
 
+class StockPriceBar(Base):
+    """紧凑的日K线存储（PRICE_STORAGE=compact）
+    
+    主键 (stock_id, date)，价格为 float8、成交量为 bigint，没有代理主键和 created_at。
+    PostgreSQL 上由 migrations/0002 改建为按年分区的表，并带 date 上的 BRIN 索引。
+    """
+    __tablename__ = "stock_price_bars"
+    
+    stock_id = Column(Integer, ForeignKey("stocks.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    open_price = Column(Float)
+    high_price = Column(Float)
+    low_price = Column(Float)
+    close_price = Column(Float)
+    adj_close = Column(Float)
+    volume = Column(BigInteger)
+
 class AIAnalysis(Base):
+    """AI分析结果（只追加）
+    
+    PostgreSQL 上由 migrations/0001 改建为按 created_at 按天分区的表，
+    主键为 (id, created_at)；过期数据通过删除整个分区清理。
+    """
     __tablename__ = "ai_analyses"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True)
     stock_id = Column(Integer, ForeignKey("stocks.id"))
     analysis_type = Column(String(50), index=True)
     analysis_content = Column(JSON)
@@ -52,6 +74,17 @@ class AIAnalysis(Base):
     
     stock = relationship("Stock", back_populates="analyses")
 
+class AIAnalysisLatest(Base):
+    """每只股票每种分析类型最新结果的指针"""
+    __tablename__ = "ai_analysis_latest"
+    
+    stock_id = Column(Integer, ForeignKey("stocks.id"), primary_key=True)
+    analysis_type = Column(String(50), primary_key=True)
+    analysis_id = Column(BigInteger, nullable=False)
+    analysis_created_at = Column(DateTime, nullable=False, index=True)
+    valid_until = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
 class StockRecommendation(Base):
     __tablename__ = "stock_recommendations"
     
@@ -69,6 +102,25 @@ class StockRecommendation(Base):
     
     stock = relationship("Stock", back_populates="recommendations")
 
+    # 过期清扫按 expires_at 区间扫描
+    __table_args__ = (
+        Index("ix_stock_recommendations_expires_at", "expires_at"),
+    )
+
+class RecommendationRollup(Base):
+    """未过期推荐的汇总：按行业、风险等级、推荐类型分别记录条数和评分之和
+
+    由推荐写入和过期清扫增量维护，见 services/recommendation_rollup.py。
+    dimension 为 "_meta" 的行不是汇总数据，用 updated_at 记录清扫/重建进度。
+    """
+    __tablename__ = "recommendation_rollups"
+    
+    dimension = Column(String(30), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
+
 class AnalysisTask(Base):
     __tablename__ = "analysis_tasks"
     
@@ -84,6 +136,12 @@ class AnalysisTask(Base):
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
 
+    # 任务列表按 (created_at, id) 倒序游标分页，可选按状态过滤
+    __table_args__ = (
+        Index("ix_analysis_tasks_created_at_id", "created_at", "id"),
+        Index("ix_analysis_tasks_status_created_at_id", "status", "created_at", "id"),
+    )
+
 class UserQuery(Base):
     __tablename__ = "user_queries"
     
@@ -0,0 +1,113 @@
+"""列表接口的游标（keyset）分页和低成本总数
+
+游标是上一页最后一行排序键的编码，下一页用 WHERE (排序键) > 游标 定位，
+每页的代价与页码无关。总数在 PostgreSQL 上表较大时使用 pg_class.reltuples 估算，
+其余情况精确计数并在进程内缓存一小段时间，增删数据时可以主动失效。
+"""
+import os
+import json
+import time
+import base64
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import literal, text, tuple_
+from sqlalchemy.orm import Query, Session
+
+# 表的估算行数超过该值时直接返回估算值，不再精确计数
+PAGINATION_EXACT_COUNT_LIMIT = int(os.getenv("PAGINATION_EXACT_COUNT_LIMIT", "10000"))
+# 精确总数在进程内的缓存时间（秒）
+PAGINATION_COUNT_TTL = float(os.getenv("PAGINATION_COUNT_TTL", "30"))
+# 单页最大条数
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "500"))
+
+class InvalidCursor(ValueError):
+    """游标无法解析或与排序键不匹配"""
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> List[Any]:
+    """解析游标，按排序列的类型还原取值"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise InvalidCursor(f"无效的分页游标: {cursor}") from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(f"无效的分页游标: {cursor}")
+    decoded = []
+    for column, value in zip(columns, values):
+        python_type = getattr(column.type, "python_type", None)
+        if python_type is datetime and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        decoded.append(value)
+    return decoded
+
+def _after(columns: Sequence[Any], values: Sequence[Any], descending: bool):
+    """(c1, c2, ...) 严格位于游标之后的条件；多列时用行值比较，PostgreSQL 可以直接走复合索引"""
+    if len(columns) == 1:
+        return columns[0] < values[0] if descending else columns[0] > values[0]
+    row = tuple_(*columns)
+    bound = tuple_(*[literal(v, column.type) for column, v in zip(columns, values)])
+    return row < bound if descending else row > bound
+
+def keyset_page(query: Query, columns: Sequence[Any], limit: int, cursor: Optional[str] = None,
+                descending: bool = False) -> Tuple[List[Any], Optional[str]]:
+    """按 columns 排序取一页，返回 (本页行, 下一页游标)；没有下一页时游标为 None
+
+    columns 的最后一列必须唯一（通常是主键），保证排序稳定。
+    """
+    limit = max(1, min(limit, PAGINATION_MAX_LIMIT))
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns), descending))
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([_row_value(last, column) for column in columns])
+
+def _row_value(row: Any, column: Any) -> Any:
+    # 行可能是ORM实体，也可能是只查询了部分列的 Row
+    if hasattr(row, "_mapping"):
+        return row._mapping[column]
+    return getattr(row, column.key)
+
+_count_cache: Dict[str, Tuple[float, int]] = {}
+_count_lock = threading.Lock()
+
+def invalidate_count(table: str):
+    """表中增删行之后调用，让下一次请求重新计数"""
+    with _count_lock:
+        _count_cache.pop(table, None)
+
+def table_count(db: Session, model) -> Tuple[int, bool]:
+    """返回 (总行数, 是否为估算值)"""
+    table = model.__tablename__
+    if db.get_bind().dialect.name == "postgresql":
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+        ).scalar()
+        # reltuples 为 -1 表示从未 ANALYZE 过
+        if estimate is not None and estimate > PAGINATION_EXACT_COUNT_LIMIT:
+            return int(estimate), True
+
+    now = time.time()
+    with _count_lock:
+        cached = _count_cache.get(table)
+    if cached and cached[0] > now:
+        return cached[1], False
+    total = db.query(model).count()
+    with _count_lock:
+        _count_cache[table] = (now + PAGINATION_COUNT_TTL, total)
+    return total, False
+
+def ensure_listing_indexes(engine):
+    """为已存在的表补建分页用的索引（create_all 不会给已有的表加索引）"""
+    from .models import AnalysisTask
+    for index in AnalysisTask.__table__.indexes:
+        if index.name and index.name.startswith("ix_analysis_tasks_") and "created_at" in index.columns:
+            index.create(bind=engine, checkfirst=True)
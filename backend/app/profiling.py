@@ -0,0 +1,297 @@
+"""慢请求/慢任务采样分析
+
+开启后（PROFILING_ENABLED=true）每个请求和 Celery 任务都登记为一个采样会话，
+后台线程每隔 PROFILE_SAMPLE_INTERVAL_MS 用 sys._current_frames() 抓取会话所在线程的调用栈；
+结束时耗时超过阈值的会话连同各阶段耗时（stage_timer、yfinance、LLM、SQL）写入本地存储，
+未超过阈值的直接丢弃。存储只保留最近 PROFILE_STORE_SIZE 条，通过 /api/v1/admin/profiles 查看。
+
+采样按线程归属：会话所在线程，加上 gather_calls 中替它执行调用的线程池线程。
+async 路由在事件循环线程上运行，并发的其他请求挂起时不会出现在栈里，
+但在同一线程上执行的同步代码会计入当时所有活跃会话。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 是否开启采样分析（有额外开销，默认关闭）
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# 请求/任务耗时超过该值（毫秒）时保存采样结果
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "2000"))
+PROFILE_SLOW_TASK_MS = float(os.getenv("PROFILE_SLOW_TASK_MS", "30000"))
+# 采样间隔（毫秒）和单个调用栈保留的最大深度
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))
+# 最多保留的采样结果条数；设置目录后结果写成文件，API 和 worker 共用同一目录时可以在一处查看
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "50"))
+PROFILE_STORE_DIR = os.getenv("PROFILE_STORE_DIR", "")
+
+class ProfileSession:
+    """一次请求或任务的采样数据"""
+
+    def __init__(self, kind: str, name: str, threshold_ms: float):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.name = name
+        self.threshold_ms = threshold_ms
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.threads = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase: str, seconds: float):
+        with self._lock:
+            entry = self.phases.setdefault(phase, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += seconds * 1000
+
+    def attach(self, ident: int) -> bool:
+        with self._lock:
+            if ident in self.threads:
+                return False
+            self.threads.add(ident)
+            return True
+
+    def detach(self, ident: int):
+        with self._lock:
+            self.threads.discard(ident)
+
+    def thread_idents(self) -> List[int]:
+        with self._lock:
+            return list(self.threads)
+
+    def add_sample(self, stack: str):
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def report(self, duration_ms: float, extra: Dict[str, Any]) -> Dict[str, Any]:
+        """整理成保存的格式：阶段耗时、自身耗时最多的函数和折叠调用栈"""
+        with self._lock:
+            stacks = self.stacks.most_common()
+            phases = {
+                phase: {"count": entry["count"], "total_ms": round(entry["total_ms"], 1)}
+                for phase, entry in sorted(self.phases.items(), key=lambda item: -item[1]["total_ms"])
+            }
+        self_time: Counter = Counter()
+        for stack, count in stacks:
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        interval = PROFILE_SAMPLE_INTERVAL_MS
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "pid": os.getpid(),
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "threshold_ms": self.threshold_ms,
+            "sample_interval_ms": interval,
+            "samples": self.samples,
+            "phases": phases,
+            **extra,
+            "top_functions": [
+                {"frame": frame, "samples": count, "approx_ms": round(count * interval, 1)}
+                for frame, count in self_time.most_common(20)
+            ],
+            # 折叠格式（"外层;内层 次数"），可直接交给 flamegraph.pl / speedscope
+            "stacks": [{"stack": stack, "samples": count} for stack, count in stacks],
+        }
+
+_current: ContextVar[Optional[ProfileSession]] = ContextVar("profile_session", default=None)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class Sampler:
+    """后台采样线程，只在有活跃会话时工作"""
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.sessions: Dict[str, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    def _ensure_thread(self):
+        # fork 出的子进程里没有父进程的采样线程
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self._thread.start()
+
+    def register(self, session: ProfileSession):
+        with self._lock:
+            self.sessions[session.id] = session
+            self._ensure_thread()
+            self._wake.set()
+
+    def unregister(self, session: ProfileSession):
+        with self._lock:
+            self.sessions.pop(session.id, None)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                sessions = list(self.sessions.values())
+                if not sessions:
+                    self._wake.clear()
+            if not sessions:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            collapsed: Dict[int, str] = {}
+            for session in sessions:
+                for ident in session.thread_idents():
+                    if ident == own or ident not in frames:
+                        continue
+                    if ident not in collapsed:
+                        collapsed[ident] = _collapse(frames[ident])
+                    session.add_sample(collapsed[ident])
+            del frames
+            time.sleep(self.interval)
+
+class ProfileStore:
+    """最近的采样结果：内存中的有界队列，设置目录时写成文件并按数量清理"""
+
+    def __init__(self, size: int = PROFILE_STORE_SIZE, directory: str = PROFILE_STORE_DIR):
+        self.size = size
+        self.directory = Path(directory) if directory else None
+        self._memory: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def save(self, report: Dict[str, Any]):
+        if self.directory is None:
+            with self._lock:
+                self._memory.append(report)
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = f"{report['started_at'].replace(':', '')}_{report['id']}.json"
+            (self.directory / name).write_text(json.dumps(report, ensure_ascii=False), encoding="utf-8")
+            for stale in sorted(self.directory.glob("*.json"))[:-self.size]:
+                stale.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"保存采样结果失败: {e}")
+
+    def _load_all(self) -> List[Dict[str, Any]]:
+        if self.directory is None:
+            with self._lock:
+                return list(self._memory)
+        reports = []
+        for path in sorted(self.directory.glob("*.json")) if self.directory.exists() else []:
+            try:
+                reports.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return reports
+
+    def list(self, kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """按时间倒序的摘要（不含调用栈）"""
+        reports = [r for r in self._load_all() if not kind or r["kind"] == kind]
+        reports.sort(key=lambda r: r["started_at"], reverse=True)
+        return [
+            {
+                **{key: r[key] for key in ("id", "kind", "name", "pid", "started_at", "duration_ms", "samples")},
+                "top_phase": next(iter(r["phases"]), None),
+                "top_function": r["top_functions"][0]["frame"] if r["top_functions"] else None,
+            }
+            for r in reports[:limit]
+        ]
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for report in self._load_all():
+            if report["id"] == profile_id:
+                return report
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.directory is not None and self.directory.exists():
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+sampler = Sampler()
+profile_store = ProfileStore()
+
+def start_profile(kind: str, name: str, threshold_ms: float):
+    """开始一个采样会话，返回交给 finish_profile 的 (会话, token)；未开启时返回 None"""
+    if not PROFILING_ENABLED:
+        return None
+    session = ProfileSession(kind, name, threshold_ms)
+    token = _current.set(session)
+    sampler.register(session)
+    return session, token
+
+def finish_profile(handle, extra: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """结束采样会话，超过阈值时保存并返回结果"""
+    if handle is None:
+        return None
+    session, token = handle
+    sampler.unregister(session)
+    try:
+        _current.reset(token)
+    except ValueError:
+        # 开始和结束不在同一上下文（Celery 信号在不同上下文触发时）
+        pass
+    duration_ms = (time.perf_counter() - session.started) * 1000
+    if duration_ms < session.threshold_ms:
+        return None
+    report = session.report(duration_ms, extra or {})
+    profile_store.save(report)
+    phases = ", ".join(f"{p} {v['total_ms']:.0f}ms" for p, v in list(report["phases"].items())[:5])
+    logger.warning(f"慢{session.kind} {session.name}: {duration_ms:.0f}ms，采样 {report['id']}，阶段: {phases}")
+    return report
+
+@contextmanager
+def profile(kind: str, name: str, threshold_ms: float) -> Iterator[Optional[ProfileSession]]:
+    handle = start_profile(kind, name, threshold_ms)
+    try:
+        yield handle[0] if handle else None
+    finally:
+        finish_profile(handle)
+
+def record_phase(phase: str, seconds: float):
+    """把一个阶段的耗时计入当前会话（没有会话时不做任何事）"""
+    session = _current.get()
+    if session is not None:
+        session.add_phase(phase, seconds)
+
+@contextmanager
+def attach_thread() -> Iterator[None]:
+    """让当前线程在代码块执行期间也计入所属会话的采样（用于线程池中复制了上下文的调用）"""
+    session = _current.get()
+    if session is None:
+        yield
+        return
+    ident = threading.get_ident()
+    added = session.attach(ident)
+    try:
+        yield
+    finally:
+        if added:
+            session.detach(ident)
@@ -0,0 +1,41 @@
+import redis
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Redis连接配置
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+# Redis不可用后的熔断时间（秒），避免每次调用都等待连接超时
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "30"))
+
+_redis_client = None
+_unavailable_until = 0.0
+
+def get_redis():
+    """获取共享的Redis客户端，Redis熔断期间返回None"""
+    global _redis_client
+    if time.time() < _unavailable_until:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            decode_responses=True
+        )
+    return _redis_client
+
+def mark_redis_unavailable(error: Exception):
+    """记录Redis调用失败，在熔断时间内跳过Redis"""
+    global _unavailable_until
+    _unavailable_until = time.time() + REDIS_RETRY_AFTER
+    logger.warning(f"Redis不可用，{REDIS_RETRY_AFTER:.0f}秒内使用本地缓存: {error}")
+
+def reset_redis():
+    """丢弃当前客户端和熔断状态；fork 出的子进程不能沿用父进程的连接"""
+    global _redis_client, _unavailable_until
+    _redis_client = None
+    _unavailable_until = 0.0
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+import logging
+from .. import schemas
+from ..http_transport import transport_stats
+from ..profiling import PROFILING_ENABLED, profile_store
+from ..http_cache import body_cache
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+@router.get("/http-pool", response_model=schemas.BaseResponse)
+async def get_http_pool_stats():
+    """获取本进程出站HTTP连接池状态和各主机的请求/错误/重试计数"""
+    return schemas.BaseResponse(data=transport_stats())
+
+@router.get("/http-cache", response_model=schemas.BaseResponse)
+async def get_http_cache_stats():
+    """获取本进程接口响应体缓存的命中情况"""
+    return schemas.BaseResponse(data=body_cache.stats())
+
+@router.get("/profiles", response_model=schemas.BaseResponse)
+async def list_profiles(kind: Optional[str] = None, limit: int = 50):
+    """列出最近保存的慢请求/慢任务采样（kind 为 request 或 task）"""
+    return schemas.BaseResponse(data={
+        "enabled": PROFILING_ENABLED,
+        "profiles": profile_store.list(kind=kind, limit=limit)
+    })
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json"):
+    """获取一条采样详情；format=collapsed 返回折叠调用栈文本，可直接导入 speedscope 或 flamegraph.pl"""
+    report = profile_store.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="采样记录不存在")
+    if format == "collapsed":
+        return PlainTextResponse("\n".join(f"{s['stack']} {s['samples']}" for s in report["stacks"]) + "\n")
+    return schemas.BaseResponse(data=report)
+
+@router.delete("/profiles", response_model=schemas.BaseResponse)
+async def clear_profiles():
+    """清空已保存的采样"""
+    profile_store.clear()
+    return schemas.BaseResponse(message="已清空采样记录")
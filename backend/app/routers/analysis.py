@@ -1,18 +1,107 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
-from ..database import get_db
+from ..database import get_db, SessionLocal
 from .. import schemas
 from ..services.ai_service import AIAnalysisService
 from ..services.stock_service import StockDataService
-from ..models import Stock, AIAnalysis, UserQuery
+from ..services.symbol_extractor import get_symbol_extractor
+from ..services.context_builder import ContextBuilder, dumps_compact
+from ..services.comparison_service import ComparisonService, COMPARE_PERIOD
+from ..models import Stock, UserQuery
+from ..services.analysis_store import AnalysisStore
+from ..concurrency import gather_calls
+from ..stage_metrics import stage_timer, observe_stage, stage_snapshot
 from datetime import datetime
+import json
+import time
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def gather_query_context(message: str, db: Session, stock_service: StockDataService) -> Dict[str, Any]:
+    """根据用户消息收集问答所需的股票数据
+    
+    各股票的基本信息和K线数据并发获取，超过截止时间的调用被跳过，
+    返回部分上下文。
+    """
+    with stage_timer("chat.gather"):
+        # 分析查询内容，提取词典中存在的股票代码
+        with stage_timer("chat.extract_symbols"):
+            symbols = extract_stock_symbols(message, db)[:3]  # 限制最多3只股票
+        
+        # 收集相关数据
+        context_data = {}
+        
+        if symbols:
+            calls = {}
+            for symbol in symbols:
+                calls[(symbol, "stock_info")] = lambda s=symbol: stock_service.get_stock_info(s)
+                calls[(symbol, "chart_data")] = lambda s=symbol: stock_service.get_chart_data(s, "3mo")
+            results, failed = gather_calls(calls, stage_prefix="chat")
+            
+            # 获取最新分析结果（一次查询覆盖所有股票）
+            with stage_timer("chat.analyses"):
+                analyses_by_symbol = get_recent_analyses(db, symbols)
+            
+            for symbol in symbols:
+                # 没有基本信息的股票不加入上下文
+                stock_info = results.get((symbol, "stock_info"))
+                if not stock_info:
+                    continue
+                context_data[symbol] = {
+                    "stock_info": stock_info,
+                    "chart_data": results.get((symbol, "chart_data")) or {},
+                    "analyses": analyses_by_symbol.get(symbol, [])
+                }
+                unavailable = [stage for s, stage in failed if s == symbol]
+                if unavailable:
+                    context_data[symbol]["unavailable"] = unavailable
+        
+        # 如果没有找到具体股票，提供市场概览
+        if not context_data:
+            context_data = get_market_overview(db)
+    
+    return context_data
+
+def get_recent_analyses(db: Session, symbols: List[str], per_symbol: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """批量获取多只股票各类型的最新分析结果"""
+    rows = AnalysisStore(db).latest_for_symbols(symbols)
+    
+    analyses: Dict[str, List[Dict[str, Any]]] = {}
+    for a, symbol in rows:
+        items = analyses.setdefault(symbol, [])
+        if len(items) < per_symbol:
+            items.append({
+                "type": a.analysis_type,
+                "content": a.analysis_content,
+                "created_at": a.created_at.isoformat()
+            })
+    return analyses
+
+def build_query_response(ai_response: Dict[str, Any]) -> schemas.UserQueryResponse:
+    """把AI回答转换为查询响应结构"""
+    return schemas.UserQueryResponse(
+        analysis=ai_response.get("analysis", {}),
+        chart_data=ai_response.get("chart_suggestions", {}),
+        recommendations=ai_response.get("recommendations", []),
+        reference_urls=ai_response.get("references", [])
+    )
+
+def save_user_query(db: Session, session_id: str, message: str, response_data: schemas.UserQueryResponse):
+    """保存查询历史"""
+    user_query = UserQuery(
+        session_id=session_id,
+        query_message=message,
+        response_data=response_data.dict(),
+        query_type="general"
+    )
+    db.add(user_query)
+    db.commit()
+
 @router.post("/query", response_model=schemas.BaseResponse)
 async def handle_user_query(
     request: schemas.UserQueryRequest,
@@ -26,72 +115,29 @@ async def handle_user_query(
         # 生成会话ID
         session_id = request.session_id or str(uuid.uuid4())
         
-        # 分析查询内容，提取可能的股票代码
-        query_text = request.message.upper()
-        potential_symbols = extract_stock_symbols(query_text)
+        context_data = gather_query_context(request.message, db, stock_service)
         
-        # 收集相关数据
-        context_data = {}
-        
-        if potential_symbols:
-            for symbol in potential_symbols[:3]:  # 限制最多3只股票
-                # 获取股票基本信息
-                stock_info = stock_service.get_stock_info(symbol)
-                if stock_info:
-                    context_data[symbol] = {
-                        "stock_info": stock_info,
-                        "chart_data": stock_service.get_chart_data(symbol, "3mo")
-                    }
-                    
-                    # 获取最新分析结果
-                    stock = db.query(Stock).filter(Stock.symbol == symbol).first()
-                    if stock:
-                        recent_analyses = db.query(AIAnalysis).filter(
-                            AIAnalysis.stock_id == stock.id
-                        ).order_by(AIAnalysis.created_at.desc()).limit(5).all()
-                        
-                        context_data[symbol]["analyses"] = [
-                            {
-                                "type": a.analysis_type,
-                                "content": a.analysis_content,
-                                "created_at": a.created_at.isoformat()
-                            }
-                            for a in recent_analyses
-                        ]
-        
-        # 如果没有找到具体股票，提供市场概览
-        if not context_data:
-            context_data = await get_market_overview(db)
+        # 压缩上下文到token预算内
+        compact_context, context_stats = ContextBuilder().build(context_data)
+        logger.info(f"问答上下文token: {context_stats}")
         
         # 使用AI回答用户问题
-        ai_response = ai_service.answer_user_query(request.message, context_data)
+        with stage_timer("chat.llm"):
+            ai_response = ai_service.answer_user_query(request.message, compact_context)
 
-        logger.info(f"build response: {ai_response}")
-        
-        # 构建响应数据
-        response_data = schemas.UserQueryResponse(
-            analysis=ai_response.get("analysis", {}),
-            chart_data=ai_response.get("chart_suggestions", {}),
-            recommendations=ai_response.get("recommendations", []),
-            reference_urls=ai_response.get("references", [])
-        )
+        logger.debug(f"问答响应: {ai_response}")
         
-        # 保存查询历史
-        user_query = UserQuery(
-            session_id=session_id,
-            query_message=request.message,
-            response_data=response_data.dict(),
-            query_type="general"
-        )
-        db.add(user_query)
-        db.commit()
+        # 构建响应数据并保存查询历史
+        response_data = build_query_response(ai_response)
+        save_user_query(db, session_id, request.message, response_data)
         
         return schemas.BaseResponse(
             data={
                 "session_id": session_id,
                 "answer": ai_response.get("answer", ""),
                 "response": response_data.dict(),
-                "context_symbols": list(context_data.keys())
+                "context_symbols": list(context_data.keys()),
+                "context_stats": context_stats
             }
         )
         
@@ -99,6 +145,79 @@ async def handle_user_query(
         logger.error(f"处理用户查询失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data: Any) -> str:
+    """编码一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@router.post("/query/stream")
+async def stream_user_query(request: schemas.UserQueryRequest):
+    """流式处理用户查询（Server-Sent Events）
+    
+    事件顺序：meta（会话ID）→ context（上下文股票与token统计）→ answer（回答文本片段，多次）→
+    analysis / recommendations / chart_suggestions / references（字段完整后各一次）→
+    done（完整响应，已保存查询历史）；出错时发送 error。
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    def event_stream():
+        # 流式响应在依赖清理之后仍在运行，这里使用独立的数据库会话
+        db = SessionLocal()
+        try:
+            yield _sse("meta", {"session_id": session_id})
+            
+            ai_service = AIAnalysisService()
+            stock_service = StockDataService()
+            
+            context_data = gather_query_context(request.message, db, stock_service)
+            compact_context, context_stats = ContextBuilder().build(context_data)
+            logger.info(f"问答上下文token: {context_stats}")
+            
+            yield _sse("context", {
+                "context_symbols": list(context_data.keys()),
+                "context_stats": context_stats
+            })
+            
+            ai_response = {}
+            llm_started = time.perf_counter()
+            first_token = True
+            for event, value in ai_service.stream_user_query(request.message, compact_context):
+                if event == "result":
+                    ai_response = value
+                    continue
+                if first_token:
+                    observe_stage("chat.first_token", time.perf_counter() - llm_started)
+                    first_token = False
+                yield _sse(event, {"value": value})
+            observe_stage("chat.llm_stream", time.perf_counter() - llm_started)
+            
+            if "error" in ai_response:
+                yield _sse("error", {"detail": ai_response["error"]})
+                return
+            
+            response_data = build_query_response(ai_response)
+            save_user_query(db, session_id, request.message, response_data)
+            
+            yield _sse("done", {
+                "session_id": session_id,
+                "answer": ai_response.get("answer", ""),
+                "response": response_data.dict(),
+                "context_symbols": list(context_data.keys()),
+                "context_stats": context_stats
+            })
+            
+        except Exception as e:
+            logger.error(f"流式处理用户查询失败: {e}")
+            db.rollback()
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history/{session_id}", response_model=schemas.BaseResponse)
 async def get_query_history(
     session_id: str,
@@ -139,30 +258,62 @@ async def compare_stocks(
         stock_service = StockDataService()
         ai_service = AIAnalysisService()
         
-        comparison_data = {}
+        comparison_service = ComparisonService()
+        symbols = [symbol.upper() for symbol in symbols]
         
+        # 并发获取各股票信息和历史价格（含基准指数），超过截止时间的股票不参与比较
+        calls = {}
         for symbol in symbols:
-            symbol = symbol.upper()
-            
-            # 获取股票数据
-            stock_info = stock_service.get_stock_info(symbol)
-            chart_data = stock_service.get_chart_data(symbol, "6m")
-            
-            if stock_info and chart_data:
-                comparison_data[symbol] = {
-                    "basic_info": stock_info,
-                    "technical_indicators": chart_data.get("indicators", {}),
-                    "performance": calculate_performance_metrics(chart_data)
-                }
+            calls[(symbol, "stock_info")] = lambda s=symbol: stock_service.get_stock_info(s)
+        for symbol in dict.fromkeys(symbols + [comparison_service.benchmark]):
+            calls[(symbol, "history")] = lambda s=symbol: stock_service.get_historical_data(s, COMPARE_PERIOD)
+        with stage_timer("compare.gather"):
+            results, failed = gather_calls(calls, stage_prefix="compare")
+        
+        histories = {}
+        for symbol in dict.fromkeys(symbols + [comparison_service.benchmark]):
+            history = results.get((symbol, "history"))
+            if history is not None and not history.empty:
+                if symbol in symbols and not results.get((symbol, "stock_info")):
+                    continue
+                histories[symbol] = history
+        
+        # 在对齐的价格面板上一次性计算比较指标
+        with stage_timer("compare.metrics"):
+            comparison = comparison_service.compare(histories)
+        
+        comparison_data = {}
+        for symbol in symbols:
+            if symbol not in histories or symbol not in comparison.get("metrics", {}):
+                continue
+            comparison_data[symbol] = {
+                "basic_info": results[(symbol, "stock_info")],
+                "technical_indicators": stock_service.calculate_technical_indicators(histories[symbol].copy()),
+                "performance": comparison["metrics"][symbol]
+            }
         
         if not comparison_data:
             raise HTTPException(status_code=404, detail="无法获取股票数据")
         
+        # 提示词只携带关键基本面字段和指标矩阵，不再包含原始K线
+        prompt_data = {
+            "stocks": {
+                symbol: {
+                    key: data["basic_info"].get(key)
+                    for key in ("name", "sector", "market_cap", "pe_ratio", "dividend_yield")
+                    if data["basic_info"].get(key) is not None
+                }
+                for symbol, data in comparison_data.items()
+            },
+            "comparison": ComparisonService.prompt_summary(comparison)
+        }
+        
         # 使用AI进行比较分析
         comparison_prompt = f"""
-请比较以下股票的投资价值：
+请比较以下股票的投资价值。comparison 中包含区间收益、波动率、最大回撤、相对基准的Beta和相对强弱（百分比），
+以及相关系数矩阵和回撤重叠矩阵（两只股票同时处于回撤中的交易日占比）：
 
-{json.dumps(comparison_data, indent=2, ensure_ascii=False)}
+{dumps_compact(prompt_data)}
 
 请提供：
 1. 各股票的优缺点分析
@@ -173,14 +324,15 @@ async def compare_stocks(
 请以JSON格式返回比较结果。
 """
         
-        ai_response = ai_service.client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "你是专业的股票分析师，请提供客观的比较分析。"},
-                {"role": "user", "content": comparison_prompt}
-            ],
-            temperature=0.3
-        )
+        with stage_timer("compare.llm"):
+            ai_response = ai_service.client.chat.completions.create(
+                model=ai_service.model,
+                messages=[
+                    {"role": "system", "content": "你是专业的股票分析师，请提供客观的比较分析。"},
+                    {"role": "user", "content": comparison_prompt}
+                ],
+                temperature=0.3
+            )
         
         try:
             comparison_result = json.loads(ai_response.choices[0].message.content)
@@ -191,6 +343,7 @@ async def compare_stocks(
             data={
                 "symbols": symbols,
                 "comparison_data": comparison_data,
+                "comparison": comparison,
                 "ai_analysis": comparison_result,
                 "generated_at": datetime.now().isoformat()
             }
@@ -200,35 +353,28 @@ async def compare_stocks(
         logger.error(f"股票比较失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def extract_stock_symbols(text: str) -> List[str]:
-    """从文本中提取股票代码"""
-    import re
-    
-    # 常见股票代码模式
-    patterns = [
-        r'\b[A-Z]{1,5}\b',  # 美股代码
-        r'\b\d{6}\b',       # A股代码
-        r'\b[A-Z]{2,4}\d{1,3}\b'  # 港股代码
-    ]
-    
-    symbols = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        symbols.extend(matches)
-    
-    # 过滤常见非股票代码的词汇
-    exclude_words = {'THE', 'AND', 'FOR', 'ARE', 'BUT', 'NOT', 'YOU', 'ALL', 'CAN', 'HER', 'WAS', 'ONE', 'OUR', 'HAD', 'BY'}
-    symbols = [s for s in symbols if s not in exclude_words]
-    
-    return list(set(symbols))  # 去重
+@router.get("/latency", response_model=schemas.BaseResponse)
+async def get_latency_stats(prefix: str = ""):
+    """获取问答和比较各阶段的延迟直方图"""
+    return schemas.BaseResponse(data=stage_snapshot(prefix))
+
+def extract_stock_symbols(text: str, db: Session, limit: int = 3) -> List[str]:
+    """从文本中提取股票代码
+
+    通过基于股票代码和中英文名称词典的 Aho-Corasick 自动机匹配，
+    只返回真实存在的代码，按出现频次排序。
+    """
+    try:
+        return get_symbol_extractor(db).extract(text, limit=limit)
+    except Exception as e:
+        logger.error(f"提取股票代码失败: {e}")
+        return []
 
-async def get_market_overview(db: Session) -> Dict[str, Any]:
+def get_market_overview(db: Session) -> Dict[str, Any]:
     """获取市场概览数据"""
     try:
         # 获取最近分析的股票
-        recent_stocks = db.query(Stock).join(AIAnalysis).order_by(
-            AIAnalysis.created_at.desc()
-        ).limit(10).all()
+        recent_stocks = AnalysisStore(db).recently_analyzed_stocks(limit=10)
         
         market_data = {}
         for stock in recent_stocks:
@@ -243,41 +389,3 @@ async def get_market_overview(db: Session) -> Dict[str, Any]:
     except Exception as e:
         logger.error(f"获取市场概览失败: {e}")
         return {}
-
-def calculate_performance_metrics(chart_data: Dict[str, Any]) -> Dict[str, Any]:
-    """计算股票表现指标"""
-    try:
-        data = chart_data.get("data", [])
-        if len(data) < 2:
-            return {}
-        
-        # 计算收益率
-        first_price = data[0]["close"]
-        last_price = data[-1]["close"]
-        total_return = (last_price - first_price) / first_price * 100
-        
-        # 计算波动率
-        prices = [d["close"] for d in data]
-        returns = [(prices[i] - prices[i-1]) / prices[i-1] for i in range(1, len(prices))]
-        volatility = np.std(returns) * np.sqrt(252) * 100  # 年化波动率
-        
-        # 计算最大回撤
-        peak = prices[0]
-        max_drawdown = 0
-        for price in prices:
-            if price > peak:
-                peak = price
-            drawdown = (peak - price) / peak
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
-        
-        return {
-            "total_return": round(total_return, 2),
-            "volatility": round(volatility, 2),
-            "max_drawdown": round(max_drawdown * 100, 2),
-            "sharpe_ratio": round(total_return / volatility if volatility > 0 else 0, 2)
-        }
-        
-    except Exception as e:
-        logger.error(f"计算表现指标失败: {e}")
-        return {}
\ No newline at end of file
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import logging
+from .. import schemas
+from ..services.quote_hub import quote_hub
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+@router.websocket("/ws")
+async def quotes_websocket(websocket: WebSocket):
+    """实时报价推送
+
+    客户端发送 {"action": "subscribe" | "unsubscribe", "symbols": [...]}；
+    服务端推送 {"type": "quotes", "data": {代码: 报价}}，只包含有变化的股票。
+    """
+    await websocket.accept()
+    connection = quote_hub.connect(websocket)
+    try:
+        while not connection.closed:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                connection.reply({"type": "error", "message": "消息不是有效的JSON"})
+                continue
+            # 推送超时被服务端断开的连接不再处理后续消息
+            if connection.closed:
+                break
+            action = message.get("action") if isinstance(message, dict) else None
+            symbols = message.get("symbols") if isinstance(message, dict) else None
+            if not isinstance(symbols, list) or not all(isinstance(s, str) for s in symbols):
+                connection.reply({"type": "error", "message": "symbols 必须是股票代码列表"})
+                continue
+            if action == "subscribe":
+                added = quote_hub.subscribe(connection, symbols)
+                connection.reply({"type": "subscribed", "symbols": added})
+            elif action == "unsubscribe":
+                quote_hub.unsubscribe(connection, symbols)
+                connection.reply({"type": "unsubscribed", "symbols": [s.strip().upper() for s in symbols]})
+            else:
+                connection.reply({"type": "error", "message": f"不支持的操作: {action}"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"报价连接异常: {e}")
+    finally:
+        quote_hub.disconnect(connection)
+
+@router.get("/", response_model=schemas.BaseResponse)
+async def get_quotes(symbols: str):
+    """获取已知的最新报价（逗号分隔的股票代码），只返回正在被订阅的股票，不触发行情请求"""
+    return schemas.BaseResponse(data=quote_hub.snapshot(symbols.split(",")))
+
+@router.get("/stats", response_model=schemas.BaseResponse)
+async def get_quote_stats():
+    """获取本进程的报价连接数、订阅股票数和行情源调用次数"""
+    return schemas.BaseResponse(data=quote_hub.stats())
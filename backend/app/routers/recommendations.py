@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from sqlalchemy import func
 from datetime import datetime
 from ..database import get_db
 from .. import schemas
 from ..services.recommendation_service import RecommendationService
-from ..models import StockRecommendation, Stock
+from ..services.recommendation_rollup import RecommendationRollupStore
+from ..http_cache import HTTP_CACHE_RECOMMENDATION_MAX_AGE, cached_response, recommendation_version
+from ..models import AnalysisTask
+from ..tasks import regenerate_recommendations
+import uuid
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,6 +17,7 @@ router = APIRouter()
 
 @router.get("/", response_model=schemas.BaseResponse)
 async def get_recommendations(
+    request: Request,
     min_score: float = 0.6,
     risk_levels: Optional[str] = None,
     limit: int = 20,
@@ -21,29 +25,35 @@ async def get_recommendations(
 ):
     """获取股票推荐列表"""
     try:
-        recommendation_service = RecommendationService()
-        
-        # 解析风险等级参数
-        risk_level_list = None
-        if risk_levels:
-            risk_level_list = [level.strip() for level in risk_levels.split(",")]
-        
-        recommendations = recommendation_service.get_recommendations_by_criteria(
-            min_score=min_score,
-            risk_levels=risk_level_list,
-            limit=limit
-        )
+        def build():
+            recommendation_service = RecommendationService()
+            
+            # 解析风险等级参数
+            risk_level_list = None
+            if risk_levels:
+                risk_level_list = [level.strip() for level in risk_levels.split(",")]
+            
+            recommendations = recommendation_service.get_recommendations_by_criteria(
+                min_score=min_score,
+                risk_levels=risk_level_list,
+                limit=limit
+            )
+            
+            return schemas.BaseResponse(
+                data={
+                    "recommendations": recommendations,
+                    "criteria": {
+                        "min_score": min_score,
+                        "risk_levels": risk_level_list,
+                        "limit": limit
+                    },
+                    "total_count": len(recommendations)
+                }
+            )
         
-        return schemas.BaseResponse(
-            data={
-                "recommendations": recommendations,
-                "criteria": {
-                    "min_score": min_score,
-                    "risk_levels": risk_level_list,
-                    "limit": limit
-                },
-                "total_count": len(recommendations)
-            }
+        return cached_response(
+            request, f"recommendations:{min_score}:{risk_levels}:{limit}", recommendation_version(db), build,
+            max_age=HTTP_CACHE_RECOMMENDATION_MAX_AGE
         )
         
     except Exception as e:
@@ -115,85 +125,127 @@ async def generate_recommendation(symbol: str, db: Session = Depends(get_db)):
         logger.error(f"生成推荐失败 {symbol}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/sectors/analysis", response_model=schemas.BaseResponse)
-async def get_sector_analysis(db: Session = Depends(get_db)):
-    """获取行业板块分析"""
+@router.post("/regenerate", response_model=schemas.BaseResponse)
+async def regenerate_all_recommendations(
+    request: schemas.RecommendationRegenerateRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """批量重新生成推荐（全部股票或按条件筛选），进度通过 /tasks/{task_id} 查询"""
     try:
-        # 按行业统计推荐情况
-        sector_stats = db.query(
-            Stock.sector,
-            func.count(StockRecommendation.id).label('recommendation_count'),
-            func.avg(StockRecommendation.score).label('avg_score')
-        ).join(StockRecommendation).filter(
-            StockRecommendation.expires_at > datetime.now()
-        ).group_by(Stock.sector).all()
-        
-        sector_analysis = []
-        for sector, count, avg_score in sector_stats:
-            if sector:  # 过滤空值
-                sector_analysis.append({
-                    "sector": sector,
-                    "recommendation_count": count,
-                    "average_score": round(float(avg_score), 3) if avg_score else 0,
-                    "performance_rating": get_sector_rating(float(avg_score) if avg_score else 0)
-                })
-        
-        # 按平均评分排序
-        sector_analysis.sort(key=lambda x: x["average_score"], reverse=True)
+        task_id = str(uuid.uuid4())
+        task = AnalysisTask(
+            task_id=task_id,
+            task_type="regenerate_recommendations",
+            symbols=request.symbols or [],
+            status="pending"
+        )
+        
+        db.add(task)
+        db.commit()
+        
+        background_tasks.add_task(
+            regenerate_recommendations.delay,
+            task_id,
+            request.symbols,
+            request.sector,
+            request.exchange,
+            request.analyzed_only
+        )
         
         return schemas.BaseResponse(
+            message="批量生成推荐任务已创建",
             data={
-                "sector_analysis": sector_analysis,
-                "total_sectors": len(sector_analysis),
-                "generated_at": datetime.now().isoformat()
+                "task_id": task_id,
+                "criteria": request.dict(),
+                "status": "pending"
             }
         )
         
+    except Exception as e:
+        logger.error(f"创建批量生成推荐任务失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sectors/analysis", response_model=schemas.BaseResponse)
+async def get_sector_analysis(request: Request, db: Session = Depends(get_db)):
+    """获取行业板块分析"""
+    try:
+        # 先清扫过期推荐再计算版本，保证缓存的响应体与版本对应
+        store = RecommendationRollupStore(db)
+        store.sync()
+        
+        def build():
+            # 按行业统计推荐情况（来自增量维护的汇总表，与推荐条数无关）
+            sector_stats = store.snapshot(sync=False)["sector"]
+            
+            sector_analysis = []
+            for stat in sector_stats:
+                if stat["key"]:  # 过滤空值
+                    avg_score = stat["average_score"]
+                    sector_analysis.append({
+                        "sector": stat["key"],
+                        "recommendation_count": stat["count"],
+                        "average_score": round(avg_score, 3),
+                        "performance_rating": get_sector_rating(avg_score)
+                    })
+            
+            # 按平均评分排序
+            sector_analysis.sort(key=lambda x: x["average_score"], reverse=True)
+            
+            return schemas.BaseResponse(
+                data={
+                    "sector_analysis": sector_analysis,
+                    "total_sectors": len(sector_analysis),
+                    "generated_at": datetime.now().isoformat()
+                }
+            )
+        
+        return cached_response(
+            request, "recommendations:sectors", store.version(), build,
+            max_age=HTTP_CACHE_RECOMMENDATION_MAX_AGE
+        )
+        
     except Exception as e:
         logger.error(f"获取行业分析失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/risk/analysis", response_model=schemas.BaseResponse)
-async def get_risk_analysis(db: Session = Depends(get_db)):
+async def get_risk_analysis(request: Request, db: Session = Depends(get_db)):
     """获取风险分析报告"""
     try:
-        # 按风险等级统计
-        risk_stats = db.query(
-            StockRecommendation.risk_level,
-            func.count(StockRecommendation.id).label('count'),
-            func.avg(StockRecommendation.score).label('avg_score')
-        ).filter(
-            StockRecommendation.expires_at > datetime.now()
-        ).group_by(StockRecommendation.risk_level).all()
-        
-        risk_analysis = []
-        for risk_level, count, avg_score in risk_stats:
-            if risk_level:
-                risk_analysis.append({
-                    "risk_level": risk_level,
-                    "stock_count": count,
-                    "average_score": round(float(avg_score), 3) if avg_score else 0
-                })
-        
-        # 获取推荐类型分布
-        recommendation_stats = db.query(
-            StockRecommendation.recommendation_type,
-            func.count(StockRecommendation.id).label('count')
-        ).filter(
-            StockRecommendation.expires_at > datetime.now()
-        ).group_by(StockRecommendation.recommendation_type).all()
-        
-        recommendation_distribution = [
-            {"type": rec_type, "count": count}
-            for rec_type, count in recommendation_stats
-        ]
+        store = RecommendationRollupStore(db)
+        store.sync()
         
-        return schemas.BaseResponse(
-            data={
-                "risk_analysis": risk_analysis,
-                "recommendation_distribution": recommendation_distribution,
-                "generated_at": datetime.now().isoformat()
-            }
+        def build():
+            rollups = store.snapshot(sync=False)
+            
+            # 按风险等级统计
+            risk_analysis = []
+            for stat in rollups["risk_level"]:
+                if stat["key"]:
+                    risk_analysis.append({
+                        "risk_level": stat["key"],
+                        "stock_count": stat["count"],
+                        "average_score": round(stat["average_score"], 3)
+                    })
+            
+            # 获取推荐类型分布
+            recommendation_distribution = [
+                {"type": stat["key"], "count": stat["count"]}
+                for stat in rollups["recommendation_type"]
+            ]
+            
+            return schemas.BaseResponse(
+                data={
+                    "risk_analysis": risk_analysis,
+                    "recommendation_distribution": recommendation_distribution,
+                    "generated_at": datetime.now().isoformat()
+                }
+            )
+        
+        return cached_response(
+            request, "recommendations:risk", store.version(), build,
+            max_age=HTTP_CACHE_RECOMMENDATION_MAX_AGE
         )
         
     except Exception as e:
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Body, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from ..database import get_db
@@ -6,7 +6,11 @@ from .. import schemas
 from ..services.stock_service import StockDataService
 from ..services.ai_service import AIAnalysisService
 from ..services.stock_mapping_service import StockMappingService
-from ..models import Stock, AIAnalysis, StockNameMapping
+from ..models import Stock, AIAnalysisLatest, StockNameMapping
+from ..services.analysis_store import AnalysisStore
+from ..http_cache import cached_response, market_cache_policy, price_version
+from ..pagination import InvalidCursor, keyset_page, table_count
+from ..services.intraday_buffer import INTERVAL_SECONDS, intraday_buffers, intraday_poller
 from datetime import datetime, timedelta
 import logging
 
@@ -15,12 +19,27 @@ router = APIRouter()
 
 @router.get("/", response_model=List[schemas.Stock])
 async def get_stocks(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """获取股票列表"""
-    stocks = db.query(Stock).offset(skip).limit(limit).all()
+    """获取股票列表
+
+    按ID排序，下一页游标通过 X-Next-Cursor 响应头返回；
+    仍然支持 skip，但只有不带 cursor 时生效，页码越深越慢。
+    """
+    if skip and not cursor:
+        stocks = db.query(Stock).order_by(Stock.id).offset(skip).limit(limit).all()
+        next_cursor = None
+    else:
+        try:
+            stocks, next_cursor = keyset_page(db.query(Stock), [Stock.id], limit, cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     # 将SQLAlchemy模型转换为Pydantic模型
     result = []
@@ -38,11 +57,11 @@ async def get_stocks(
     return result
 
 @router.get("/search", response_model=schemas.BaseResponse)
-async def search_stock_by_name(name: str):
-    """根据股票名称查找股票代码"""
+async def search_stock_by_name(name: str, limit: int = Query(20, ge=1, le=100)):
+    """根据股票名称查找股票代码（按相似度排序）"""
     try:
         stock_service = StockDataService()
-        results = stock_service.find_stock_by_name(name)
+        results = stock_service.find_stock_by_name(name, limit=limit)
         
         if not results:
             return schemas.BaseResponse(
@@ -62,25 +81,42 @@ async def search_stock_by_name(name: str):
 @router.get("/mappings", response_model=schemas.BaseResponse)
 async def get_stock_name_mappings(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """获取股票名称映射列表"""
+    """获取股票名称映射列表
+
+    传 cursor（上一页返回的 next_cursor）按游标翻页；不传 cursor 时按 skip 偏移，兼容页码跳转。
+    total 在表较大时为估算值（total_is_estimate 为 true）。
+    """
     try:
         mapping_service = StockMappingService()
-        mappings = mapping_service.get_all_mappings(skip, limit)
-        total = db.query(StockNameMapping).count()
+        if skip and not cursor:
+            mappings = mapping_service.get_all_mappings(skip, limit)
+            next_cursor = None
+            # 偏移分页无法得知是否还有下一页，按本页是否取满判断
+            has_more = len(mappings) == limit
+        else:
+            mappings, next_cursor = mapping_service.list_mappings(limit, cursor)
+            has_more = next_cursor is not None
+        total, is_estimate = table_count(db, StockNameMapping)
         
         return schemas.BaseResponse(
             message="获取股票名称映射列表成功",
             data={
                 "items": mappings,
                 "total": total,
+                "total_is_estimate": is_estimate,
                 "skip": skip,
-                "limit": limit
+                "limit": limit,
+                "next_cursor": next_cursor,
+                "has_more": has_more
             }
         )
         
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取股票名称映射列表失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -191,47 +227,55 @@ async def delete_stock_name_mapping(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{symbol}", response_model=schemas.BaseResponse)
-async def get_stock_info(symbol: str, db: Session = Depends(get_db)):
+async def get_stock_info(symbol: str, request: Request, db: Session = Depends(get_db)):
     """获取单个股票信息"""
     try:
-        stock_service = StockDataService()
-        
-        # 从数据库获取股票信息
-        stock = db.query(Stock).filter(Stock.symbol == symbol.upper()).first()
-        
-        if not stock:
-            # 如果数据库中没有，尝试从API获取
-            stock_info = stock_service.get_stock_info(symbol.upper())
-            if not stock_info:
-                raise HTTPException(status_code=404, detail="股票不存在")
+        def build():
+            stock_service = StockDataService()
             
-            # 保存到数据库
-            stock = Stock(
-                symbol=stock_info["symbol"],
-                name=stock_info["name"],
-                exchange=stock_info["exchange"],
-                sector=stock_info["sector"],
-                industry=stock_info["industry"]
+            # 从数据库获取股票信息
+            stock = db.query(Stock).filter(Stock.symbol == symbol.upper()).first()
+            
+            if not stock:
+                # 如果数据库中没有，尝试从API获取
+                stock_info = stock_service.get_stock_info(symbol.upper())
+                if not stock_info:
+                    raise HTTPException(status_code=404, detail="股票不存在")
+                
+                # 保存到数据库
+                stock = Stock(
+                    symbol=stock_info["symbol"],
+                    name=stock_info["name"],
+                    exchange=stock_info["exchange"],
+                    sector=stock_info["sector"],
+                    industry=stock_info["industry"]
+                )
+                db.add(stock)
+                db.commit()
+                db.refresh(stock)
+            
+            # 获取最新价格数据
+            chart_data = stock_service.get_chart_data(symbol.upper(), "1y")
+            
+            return schemas.BaseResponse(
+                data={
+                    "stock_info": {
+                        "id": stock.id,
+                        "symbol": stock.symbol,
+                        "name": stock.name,
+                        "exchange": stock.exchange,
+                        "sector": stock.sector,
+                        "industry": stock.industry
+                    },
+                    "chart_data": chart_data
+                }
             )
-            db.add(stock)
-            db.commit()
-            db.refresh(stock)
         
-        # 获取最新价格数据
-        chart_data = stock_service.get_chart_data(symbol.upper(), "1y")
-        
-        return schemas.BaseResponse(
-            data={
-                "stock_info": {
-                    "id": stock.id,
-                    "symbol": stock.symbol,
-                    "name": stock.name,
-                    "exchange": stock.exchange,
-                    "sector": stock.sector,
-                    "industry": stock.industry
-                },
-                "chart_data": chart_data
-            }
+        # 行情未更新且仍在同一交易时段时返回 304 或缓存的响应体
+        max_age, body_ttl = market_cache_policy(symbol.upper())
+        return cached_response(
+            request, f"stock:{symbol.upper()}", price_version(db, symbol.upper()), build,
+            max_age=max_age, body_ttl=body_ttl
         )
         
     except Exception as e:
@@ -251,9 +295,11 @@ async def analyze_stock(
         # 检查是否需要强制刷新
         if not request.force_refresh:
             # 查找最近的分析结果
-            recent_analysis = db.query(AIAnalysis).join(Stock).filter(
+            recent_analysis = AnalysisStore(db).latest_query().join(
+                Stock, Stock.id == AIAnalysisLatest.stock_id
+            ).filter(
                 Stock.symbol == symbol,
-                AIAnalysis.created_at >= datetime.now() - timedelta(hours=1)
+                AIAnalysisLatest.analysis_created_at >= datetime.now() - timedelta(hours=1)
             ).first()
             
             if recent_analysis:
@@ -287,12 +333,15 @@ async def get_stock_analysis(
 ):
     """获取股票分析结果"""
     try:
-        query = db.query(AIAnalysis).join(Stock).filter(Stock.symbol == symbol.upper())
+        # 通过指针表读取每种分析的最新结果
+        query = AnalysisStore(db).latest_query().join(
+            Stock, Stock.id == AIAnalysisLatest.stock_id
+        ).filter(Stock.symbol == symbol.upper())
         
         if analysis_type:
-            query = query.filter(AIAnalysis.analysis_type == analysis_type)
+            query = query.filter(AIAnalysisLatest.analysis_type == analysis_type)
         
-        analyses = query.order_by(AIAnalysis.created_at.desc()).limit(10).all()
+        analyses = query.order_by(AIAnalysisLatest.analysis_created_at.desc()).limit(10).all()
         
         if not analyses:
             raise HTTPException(status_code=404, detail="未找到分析结果")
@@ -317,20 +366,59 @@ async def get_stock_analysis(
 @router.get("/{symbol}/chart", response_model=schemas.BaseResponse)
 async def get_stock_chart(
     symbol: str,
-    period: str = "1y"
+    request: Request,
+    period: str = "1y",
+    db: Session = Depends(get_db)
 ):
     """获取股票K线图数据"""
     try:
-        stock_service = StockDataService()
-        chart_data = stock_service.get_chart_data(symbol.upper(), period)
+        def build():
+            stock_service = StockDataService()
+            chart_data = stock_service.get_chart_data(symbol.upper(), period)
+            
+            if not chart_data:
+                raise HTTPException(status_code=404, detail="无法获取图表数据")
+            
+            return schemas.BaseResponse(data=chart_data)
+        
+        max_age, body_ttl = market_cache_policy(symbol.upper())
+        return cached_response(
+            request, f"chart:{symbol.upper()}:{period}", price_version(db, symbol.upper()), build,
+            max_age=max_age, body_ttl=body_ttl
+        )
+        
+    except Exception as e:
+        logger.error(f"获取图表数据失败 {symbol}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{symbol}/intraday", response_model=schemas.BaseResponse)
+async def get_stock_intraday(
+    symbol: str,
+    interval: str = Query("1m", description="K线周期：1m/5m/15m/30m/60m")
+):
+    """获取当天的分钟K线和技术指标
+
+    数据来自进程内的环形缓冲区，首次请求时回补当天数据，之后由后台线程增量轮询。
+    """
+    if interval not in INTERVAL_SECONDS:
+        raise HTTPException(status_code=400, detail=f"不支持的周期: {interval}")
+    symbol = symbol.upper()
+    try:
+        buffer = intraday_buffers.touch(symbol)
+        if not buffer.size:
+            intraday_poller.refresh(symbol)
+        intraday_poller.ensure_started()
         
+        chart_data = intraday_buffers.chart(symbol, interval)
         if not chart_data:
-            raise HTTPException(status_code=404, detail="无法获取图表数据")
+            raise HTTPException(status_code=404, detail="暂无分钟数据")
         
         return schemas.BaseResponse(data=chart_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"获取图表数据失败 {symbol}: {e}")
+        logger.error(f"获取分钟数据失败 {symbol}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 async def perform_stock_analysis(symbol: str, analysis_types: List[str], db: Session):
@@ -369,25 +457,11 @@ async def perform_stock_analysis(symbol: str, analysis_types: List[str], db: Ses
         
         comprehensive_analysis = ai_service.generate_comprehensive_analysis(symbol, analysis_data)
         
-        # 保存分析结果
+        # 保存分析结果（只追加，并更新最新结果指针）
+        store = AnalysisStore(db)
         for analysis_type, content in comprehensive_analysis.get("comprehensive_analysis", {}).items():
             if analysis_type in analysis_types:
-                # 删除旧的分析结果
-                db.query(AIAnalysis).filter(
-                    AIAnalysis.stock_id == stock.id,
-                    AIAnalysis.analysis_type == analysis_type
-                ).delete()
-                
-                # 创建新的分析结果
-                analysis = AIAnalysis(
-                    stock_id=stock.id,
-                    analysis_type=analysis_type,
-                    analysis_content=content,
-                    confidence_score=content.get("confidence", 0.7),
-                    tags=content.get("tags", []),
-                    valid_until=datetime.now() + timedelta(hours=24)
-                )
-                db.add(analysis)
+                store.save(stock.id, analysis_type, content, commit=False)
         
         db.commit()
         logger.info(f"股票分析完成: {symbol}")
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from ..database import get_db
 from .. import schemas
 from ..models import AnalysisTask
+from ..pagination import InvalidCursor, keyset_page
 from ..tasks import analyze_batch_stocks, scan_market_opportunities
 from datetime import datetime
 import uuid
@@ -134,14 +136,26 @@ async def get_task_status(task_id: str, db: Session = Depends(get_db)):
 
 @router.get("/", response_model=schemas.BaseResponse)
 async def get_tasks(
+    response: Response,
     status: Optional[str] = None,
     task_type: Optional[str] = None,
-    limit: int = 20,
+    limit: int = Query(20, ge=1, le=500),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """获取任务列表"""
+    """获取任务列表（按创建时间倒序，下一页游标通过 X-Next-Cursor 响应头返回）"""
     try:
-        query = db.query(AnalysisTask)
+        # 只查询列表需要的列，symbols 在数据库里取数组长度，不加载 symbols/result 两个JSON列
+        query = db.query(
+            AnalysisTask.id,
+            AnalysisTask.task_id,
+            AnalysisTask.task_type,
+            func.json_array_length(AnalysisTask.symbols).label("symbols_count"),
+            AnalysisTask.status,
+            AnalysisTask.progress,
+            AnalysisTask.created_at,
+            AnalysisTask.completed_at,
+        )
         
         if status:
             query = query.filter(AnalysisTask.status == status)
@@ -149,14 +163,18 @@ async def get_tasks(
         if task_type:
             query = query.filter(AnalysisTask.task_type == task_type)
         
-        tasks = query.order_by(AnalysisTask.created_at.desc()).limit(limit).all()
+        tasks, next_cursor = keyset_page(
+            query, [AnalysisTask.created_at, AnalysisTask.id], limit, cursor, descending=True
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         
         result = []
         for task in tasks:
             result.append({
                 "task_id": task.task_id,
                 "task_type": task.task_type,
-                "symbols_count": len(task.symbols),
+                "symbols_count": task.symbols_count or 0,
                 "status": task.status,
                 "progress": task.progress,
                 "created_at": task.created_at.isoformat(),
@@ -165,6 +183,8 @@ async def get_tasks(
         
         return schemas.BaseResponse(data=result)
         
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取任务列表失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -133,6 +133,13 @@ class BatchAnalysisRequest(BaseModel):
     analysis_types: Optional[List[str]] = Field(["technical", "fundamental"], description="分析类型")
     priority: Optional[str] = Field("normal", description="任务优先级")
 
+# 批量生成推荐请求，不填任何条件时处理全部股票
+class RecommendationRegenerateRequest(BaseModel):
+    symbols: Optional[List[str]] = Field(None, description="股票代码列表")
+    sector: Optional[str] = Field(None, description="行业")
+    exchange: Optional[str] = Field(None, description="交易所")
+    analyzed_only: bool = Field(False, description="只处理最近一天有分析结果的股票")
+
 # 股票名称映射模型
 class StockNameMappingBase(BaseModel):
     chinese_name: str = Field(..., description="中文名称")
@@ -1,19 +1,86 @@
-import openai
 import json
 import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Iterator, Tuple
 from datetime import datetime
 import logging
 import os
+from .context_builder import dumps_compact
+from .stream_parser import IncrementalJSONParser
+from .rule_analysis_service import AnalysisPolicy, strip_metadata
+from ..http_transport import get_openai_client
+from ..metrics import observe_llm, record_llm_tokens
 
 logger = logging.getLogger(__name__)
 
+# OpenAI兼容接口配置，压测时可指向本地 llm_stub 服务
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.gpt.ge/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+
+# 流式问答中完整解析后推送给前端的字段
+STREAMED_QUERY_FIELDS = ("analysis", "recommendations", "chart_suggestions", "references")
+
+# 批量分析时每种分析结果必须包含的字段，缺失的条目回退为单只股票调用
+BATCH_REQUIRED_FIELDS = {
+    "technical": ("overall_sentiment", "key_levels", "confidence"),
+    "fundamental": ("fundamental_score", "confidence"),
+    "sentiment": ("sentiment_score", "confidence_level"),
+    "recommendation": ("rating", "risk_level", "confidence"),
+}
+
+SYSTEM_PROMPT = "你是一位专业的股票分析师，请提供准确、客观的分析建议。请直接返回JSON格式的响应，不要添加任何Markdown格式标记。"
+
 class AIAnalysisService:
     """AI分析服务"""
     
     def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url="https://api.gpt.ge/v1")
+        self.model = OPENAI_MODEL
+        self.client = get_openai_client(OPENAI_BASE_URL)
         self.prompts = self._load_prompts()
+        self.policy = AnalysisPolicy()
+        self.reset_usage()
+    
+    def reset_usage(self):
+        """重置调用统计"""
+        self.usage = {
+            "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+            "rule_based": 0, "reused": 0
+        }
+    
+    def _run_with_policy(self, analysis_type: str, items: Dict[str, Dict[str, Any]], batched: bool = False) -> Dict[str, Dict[str, Any]]:
+        """按 ANALYSIS_POLICY 执行一种分析
+        
+        规则模式直接本地计算；llm_on_change 模式下信号指纹未变化的股票复用上次结果，
+        其余股票调用LLM（batched 为 True 时合并为一次批量调用）。
+        """
+        results, pending, fingerprints = self.policy.resolve(analysis_type, items)
+        for result in results.values():
+            self.usage["reused" if result.get("reused") else "rule_based"] += 1
+        
+        if pending:
+            if batched:
+                llm_results = self.analyze_batch(analysis_type, pending)
+            else:
+                llm_results = {
+                    symbol: self.analyze_stock(symbol, analysis_type, {"symbol": symbol, **data})
+                    for symbol, data in pending.items()
+                }
+            self.policy.remember(analysis_type, llm_results, fingerprints)
+            results.update(llm_results)
+        return results
+    
+    def _chat_completion(self, messages: List[Dict[str, str]], analysis_type: str = "query",
+                         mode: str = "single", **kwargs):
+        """调用对话补全接口，累计请求数和token用量并记录指标"""
+        self.usage["requests"] += 1
+        with observe_llm(analysis_type, mode):
+            response = self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        usage = getattr(response, "usage", None)
+        record_llm_tokens(analysis_type, usage)
+        if usage is not None:
+            self.usage["prompt_tokens"] += usage.prompt_tokens or 0
+            self.usage["completion_tokens"] += usage.completion_tokens or 0
+            self.usage["total_tokens"] += usage.total_tokens or 0
+        return response
     
     def _parse_json_from_response(self, response_text: str) -> Dict[str, Any]:
         """
@@ -62,7 +129,7 @@ class AIAnalysisService:
 
 请以JSON格式返回，包含：
 - overall_sentiment: "bullish"/"bearish"/"neutral"
-- key_levels: {"support": 价格, "resistance": 价格}
+- key_levels: {{"support": 价格, "resistance": 价格}}
 - short_term_outlook: 文字描述
 - risk_factors: [风险因素列表]
 - confidence: 0-1之间的置信度
@@ -142,7 +209,7 @@ class AIAnalysisService:
 
 请以JSON格式返回，包含：
 - rating: "strong_buy"/"buy"/"hold"/"sell"/"strong_sell"
-- target_price_range: {"low": 价格, "high": 价格}
+- target_price_range: {{"low": 价格, "high": 价格}}
 - time_horizon: "short"/"medium"/"long"
 - risk_level: "low"/"medium"/"high"
 - action_plan: 具体操作建议
@@ -163,16 +230,16 @@ class AIAnalysisService:
             prompt = self.prompts[analysis_type].format(**data)
             
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4.1-mini",
+                response = self._chat_completion(
                     messages=[
-                        {"role": "system", "content": "你是一位专业的股票分析师，请提供准确、客观的分析建议。请直接返回JSON格式的响应，不要添加任何Markdown格式标记。"},
+                        {"role": "system", "content": SYSTEM_PROMPT},
                         {"role": "user", "content": prompt}
                     ],
+                    analysis_type=analysis_type,
                     temperature=0.3,
                     max_tokens=1500
                 )
-                logger.info(f"调试 ai 响应: {response}")
+                logger.debug(f"AI响应 {symbol} {analysis_type}: {response}")
 
                 # 解析AI响应
                 ai_response = response.choices[0].message.content
@@ -204,7 +271,7 @@ class AIAnalysisService:
                 "symbol": symbol,
                 "analysis_type": analysis_type,
                 "generated_at": datetime.now().isoformat(),
-                "model_used": "gpt-4.1-mini"
+                "model_used": self.model
             })
             
             return analysis_result
@@ -234,12 +301,12 @@ class AIAnalysisService:
                     "bollinger_bands": stock_data["indicators"].get("bollinger_bands", {}),
                     "price_change": stock_data["indicators"].get("price_change_percent", 0)
                 }
-                analyses["technical"] = self.analyze_stock(symbol, "technical", technical_data)
+                analyses["technical"] = self._run_with_policy("technical", {symbol: technical_data})[symbol]
             
             # 基本面分析
             if "stock_info" in stock_data:
                 fundamental_data = stock_data["stock_info"]
-                analyses["fundamental"] = self.analyze_stock(symbol, "fundamental", fundamental_data)
+                analyses["fundamental"] = self._run_with_policy("fundamental", {symbol: fundamental_data})[symbol]
             
             # 市场情绪分析
             sentiment_data = {
@@ -247,17 +314,17 @@ class AIAnalysisService:
                 "price_change": stock_data.get("indicators", {}).get("price_change_percent", 0),
                 "market_context": "当前市场环境"  # 可以从外部API获取
             }
-            analyses["sentiment"] = self.analyze_stock(symbol, "sentiment", sentiment_data)
+            analyses["sentiment"] = self._run_with_policy("sentiment", {symbol: sentiment_data})[symbol]
             
             # 综合推荐
             if len(analyses) >= 2:
                 recommendation_data = {
                     "symbol": symbol,
-                    "technical_analysis": analyses.get("technical", {}),
-                    "fundamental_analysis": analyses.get("fundamental", {}),
-                    "sentiment_analysis": analyses.get("sentiment", {})
+                    "technical_analysis": strip_metadata(analyses.get("technical", {})),
+                    "fundamental_analysis": strip_metadata(analyses.get("fundamental", {})),
+                    "sentiment_analysis": strip_metadata(analyses.get("sentiment", {}))
                 }
-                analyses["recommendation"] = self.analyze_stock(symbol, "recommendation", recommendation_data)
+                analyses["recommendation"] = self._run_with_policy("recommendation", {symbol: recommendation_data})[symbol]
             
             return {
                 "symbol": symbol,
@@ -270,17 +337,174 @@ class AIAnalysisService:
             logger.error(f"生成综合分析失败 {symbol}: {e}")
             return {"error": str(e), "symbol": symbol}
     
-    def answer_user_query(self, query: str, context_data: Dict[str, Any]) -> Dict[str, Any]:
-        """回答用户查询"""
+    def _extract_schema(self, analysis_type: str) -> str:
+        """从单只股票的提示词模板中取出返回字段说明，批量提示词复用同一份字段定义"""
+        template = self.prompts[analysis_type]
+        start = template.find("请以JSON格式返回，包含：")
+        end = template.find("重要：", start)
+        if start < 0 or end < 0:
+            return ""
+        schema = template[start + len("请以JSON格式返回，包含："):end].strip()
+        return schema.replace("{{", "{").replace("}}", "}")
+    
+    def _build_batch_messages(self, analysis_type: str, items: Dict[str, Dict[str, Any]]) -> List[Dict[str, str]]:
+        """构建多只股票共用一次调用的批量分析消息"""
+        titles = {
+            "technical": "技术分析",
+            "fundamental": "基本面分析",
+            "sentiment": "市场情绪分析",
+            "recommendation": "综合投资建议",
+        }
+        prompt = f"""
+请对以下 {len(items)} 只股票分别进行{titles.get(analysis_type, analysis_type)}，数据按股票代码给出：
+
+{dumps_compact(items)}
+
+请返回一个JSON数组，每只股票一个元素，每个元素包含：
+- symbol: 股票代码（与输入一致）
+{self._extract_schema(analysis_type)}
+
+重要：请直接返回JSON数组，不要添加任何Markdown格式标记（如 ```json 或 ```）。
+只返回原始JSON数据，没有任何其他文本或格式。
+"""
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _parse_batch_response(self, ai_response: str) -> Dict[str, Dict[str, Any]]:
+        """把批量响应解析为 {股票代码: 分析结果}"""
+        parsed: Any
         try:
-            # 构建上下文提示词
-            context_prompt = f"""
+            parsed = json.loads(ai_response)
+        except json.JSONDecodeError:
+            parsed = self._parse_json_from_response(ai_response)
+        
+        # 兼容模型把数组包在对象里的情况，如 {"results": [...]}
+        if isinstance(parsed, dict):
+            arrays = [v for v in parsed.values() if isinstance(v, list)]
+            parsed = arrays[0] if arrays else []
+        
+        entries = {}
+        for entry in parsed if isinstance(parsed, list) else []:
+            if isinstance(entry, dict) and entry.get("symbol"):
+                entries[str(entry["symbol"]).upper()] = entry
+        return entries
+    
+    def analyze_batch(self, analysis_type: str, items: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """一次调用分析多只股票
+        
+        items 为 {股票代码: 单只股票的模板数据}。校验每个返回条目的必需字段，
+        缺失或校验失败的股票回退为单只股票调用。
+        """
+        if analysis_type not in self.prompts:
+            raise ValueError(f"不支持的分析类型: {analysis_type}")
+        if not items:
+            return {}
+        if len(items) == 1:
+            symbol, data = next(iter(items.items()))
+            return {symbol: self.analyze_stock(symbol, analysis_type, {"symbol": symbol, **data})}
+        
+        required = BATCH_REQUIRED_FIELDS.get(analysis_type, ())
+        entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            response = self._chat_completion(
+                messages=self._build_batch_messages(analysis_type, items),
+                analysis_type=analysis_type,
+                mode="batch",
+                temperature=0.3,
+                max_tokens=min(1200 * len(items), 16000)
+            )
+            entries = self._parse_batch_response(response.choices[0].message.content)
+        except Exception as e:
+            logger.error(f"批量AI分析失败 {analysis_type} {list(items)}: {e}")
+        
+        results = {}
+        fallbacks = []
+        for symbol, data in items.items():
+            entry = entries.get(symbol.upper())
+            if entry is None or any(entry.get(field) in (None, "") for field in required):
+                fallbacks.append(symbol)
+                results[symbol] = self.analyze_stock(symbol, analysis_type, {"symbol": symbol, **data})
+                continue
+            entry.update({
+                "symbol": symbol,
+                "analysis_type": analysis_type,
+                "generated_at": datetime.now().isoformat(),
+                "model_used": self.model,
+                "batched": True
+            })
+            results[symbol] = entry
+        
+        if fallbacks:
+            logger.warning(f"批量分析 {analysis_type} 有 {len(fallbacks)} 只股票回退为单独调用: {fallbacks}")
+        return results
+    
+    def generate_batch_analysis(self, stocks: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """批量生成综合分析，每种分析类型对所有股票只调用一次
+        
+        stocks 为 {股票代码: 与 generate_comprehensive_analysis 相同的 stock_data}，
+        返回 {股票代码: 综合分析结果}。
+        """
+        analyses: Dict[str, Dict[str, Any]] = {symbol: {} for symbol in stocks}
+        
+        technical_items = {}
+        fundamental_items = {}
+        sentiment_items = {}
+        for symbol, stock_data in stocks.items():
+            indicators = stock_data.get("indicators", {})
+            if "indicators" in stock_data:
+                technical_items[symbol] = {
+                    "current_price": indicators.get("current_price", 0),
+                    "rsi": indicators.get("rsi", "N/A"),
+                    "macd": indicators.get("macd", {}),
+                    "moving_averages": indicators.get("moving_averages", {}),
+                    "bollinger_bands": indicators.get("bollinger_bands", {}),
+                    "price_change": indicators.get("price_change_percent", 0)
+                }
+            if "stock_info" in stock_data:
+                fundamental_items[symbol] = stock_data["stock_info"]
+            sentiment_items[symbol] = {
+                "price_change": indicators.get("price_change_percent", 0),
+                "market_context": "当前市场环境"
+            }
+        
+        for analysis_type, items in (("technical", technical_items),
+                                     ("fundamental", fundamental_items),
+                                     ("sentiment", sentiment_items)):
+            for symbol, result in self._run_with_policy(analysis_type, items, batched=True).items():
+                analyses[symbol][analysis_type] = result
+        
+        # 综合推荐依赖前三种分析的结果
+        recommendation_items = {}
+        for symbol, symbol_analyses in analyses.items():
+            if len(symbol_analyses) >= 2:
+                recommendation_items[symbol] = {
+                    f"{analysis_type}_analysis": strip_metadata(symbol_analyses.get(analysis_type, {}))
+                    for analysis_type in ("technical", "fundamental", "sentiment")
+                }
+        for symbol, result in self._run_with_policy("recommendation", recommendation_items, batched=True).items():
+            analyses[symbol]["recommendation"] = result
+        
+        return {
+            symbol: {
+                "symbol": symbol,
+                "comprehensive_analysis": symbol_analyses,
+                "generated_at": datetime.now().isoformat(),
+                "analysis_count": len(symbol_analyses)
+            }
+            for symbol, symbol_analyses in analyses.items()
+        }
+    
+    def _build_query_messages(self, query: str, context_data: Dict[str, Any]) -> List[Dict[str, str]]:
+        """构建问答的对话消息"""
+        context_prompt = f"""
 基于以下股票数据回答用户问题：
 
 用户问题: {query}
 
 可用数据:
-{json.dumps(context_data, indent=2, ensure_ascii=False)}
+{dumps_compact(context_data)}
 
 请提供：
 1. 直接回答用户问题
@@ -289,7 +513,7 @@ class AIAnalysisService:
 4. 包含K线图数据的建议
 5. 相关参考信息
 
-请以JSON格式返回，包含：
+请以JSON格式返回，字段按以下顺序输出，包含：
 - answer: 主要回答 (该字段是字符串)
 - analysis: 分析见解 (该字段是字符串)
 - recommendations: 推荐列表（列表的元素里包含 "symbol"、"action"、"rationale" 三个字段的信息）
@@ -299,19 +523,47 @@ class AIAnalysisService:
 重要：请直接返回JSON格式的响应，不要添加任何Markdown格式标记（如 ```json 或 ```）。
 只返回原始JSON数据，没有任何其他文本或格式。
 """
+        return [
+            {"role": "system", "content": "你是一位专业的股票投资顾问，请基于提供的数据回答用户问题。请直接返回JSON格式的响应，不要添加任何Markdown格式标记。"},
+            {"role": "user", "content": context_prompt}
+        ]
+    
+    def _parse_query_response(self, ai_response: str, query: str) -> Dict[str, Any]:
+        """解析问答响应为标准结构"""
+        try:
+            result = json.loads(ai_response)
+        except json.JSONDecodeError:
+            # 尝试清理并解析JSON
+            result = self._parse_json_from_response(ai_response)
             
+            # 如果仍然无法解析为JSON，使用默认结构
+            if "raw_text" in result:
+                result = {
+                    "answer": result["raw_text"],
+                    "analysis": {},
+                    "recommendations": [],
+                    "chart_suggestions": {},
+                    "references": []
+                }
+        
+        result.update({
+            "query": query,
+            "generated_at": datetime.now().isoformat(),
+            "model_used": self.model
+        })
+        return result
+    
+    def answer_user_query(self, query: str, context_data: Dict[str, Any]) -> Dict[str, Any]:
+        """回答用户查询"""
+        try:
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4.1-mini",
-                    messages=[
-                        {"role": "system", "content": "你是一位专业的股票投资顾问，请基于提供的数据回答用户问题。请直接返回JSON格式的响应，不要添加任何Markdown格式标记。"},
-                        {"role": "user", "content": context_prompt}
-                    ],
+                response = self._chat_completion(
+                    messages=self._build_query_messages(query, context_data),
                     temperature=0.4,
                     max_tokens=5000
                 )
                 
-                logger.info(f"Debug Info {response}")
+                logger.debug(f"问答AI响应: {response}")
                 ai_response = response.choices[0].message.content
             except Exception as e:
                 logger.error(f"OpenAI API调用失败: {e}")
@@ -321,29 +573,7 @@ class AIAnalysisService:
                 else:
                     raise e
             
-            try:
-                result = json.loads(ai_response)
-            except json.JSONDecodeError:
-                # 尝试清理并解析JSON
-                result = self._parse_json_from_response(ai_response)
-                
-                # 如果仍然无法解析为JSON，使用默认结构
-                if "raw_text" in result:
-                    result = {
-                        "answer": result["raw_text"],
-                        "analysis": {},
-                        "recommendations": [],
-                        "chart_suggestions": {},
-                        "references": []
-                    }
-            
-            result.update({
-                "query": query,
-                "generated_at": datetime.now().isoformat(),
-                "model_used": "gpt-4.1-mini"
-            })
-            
-            return result
+            return self._parse_query_response(ai_response, query)
             
         except Exception as e:
             logger.error(f"回答用户查询失败: {e}")
@@ -351,4 +581,47 @@ class AIAnalysisService:
                 "error": str(e),
                 "query": query,
                 "generated_at": datetime.now().isoformat()
-            }
\ No newline at end of file
+            }
+    
+    def stream_user_query(self, query: str, context_data: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """流式回答用户查询
+        
+        逐步产出 ("answer", 文本片段) 以及已完整解析的结构化字段
+        ("recommendations" / "references" / "analysis" / "chart_suggestions", 值)，
+        最后产出 ("result", 完整解析结果)。
+        """
+        parser = IncrementalJSONParser(stream_fields=("answer",))
+        chunks = []
+        try:
+            self.usage["requests"] += 1
+            with observe_llm("query", "stream"):
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_query_messages(query, context_data),
+                    temperature=0.4,
+                    max_tokens=5000,
+                    stream=True
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if not delta:
+                        continue
+                    chunks.append(delta)
+                    for kind, field, value in parser.feed(delta):
+                        if kind == "delta" and field == "answer":
+                            yield "answer", value
+                        elif kind == "field" and field in STREAMED_QUERY_FIELDS:
+                            yield field, value
+            
+            result = self._parse_query_response("".join(chunks), query)
+        except Exception as e:
+            logger.error(f"流式回答用户查询失败: {e}")
+            result = {
+                "error": str(e),
+                "query": query,
+                "generated_at": datetime.now().isoformat()
+            }
+        
+        yield "result", result
@@ -0,0 +1,257 @@
+import os
+import re
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import Query, Session
+from ..database import is_postgresql, upsert_rows
+from ..models import AIAnalysis, AIAnalysisLatest, Stock
+
+logger = logging.getLogger(__name__)
+
+# 分析结果的有效期（小时）和历史保留天数；过期分区整体删除
+ANALYSIS_VALID_HOURS = int(os.getenv("ANALYSIS_VALID_HOURS", "24"))
+ANALYSIS_RETENTION_DAYS = int(os.getenv("ANALYSIS_RETENTION_DAYS", "7"))
+# 提前创建的未来分区天数
+ANALYSIS_PARTITION_PREMAKE_DAYS = int(os.getenv("ANALYSIS_PARTITION_PREMAKE_DAYS", "3"))
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations"
+PARTITION_MIGRATION = "0001_partition_ai_analyses.sql"
+PARTITION_PREFIX = "ai_analyses_p"
+_PARTITION_NAME = re.compile(rf"^{PARTITION_PREFIX}(\d{{8}})$")
+
+# 本进程已确认存在的分区日期
+_known_partitions = set()
+
+def _partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+IS_PARTITIONED_SQL = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+    "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'ai_analyses')"
+)
+
+def _is_partitioned(connection) -> bool:
+    return connection.execute(IS_PARTITIONED_SQL).scalar()
+
+def _create_partition_sql(day: date):
+    return text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(day)} PARTITION OF ai_analyses "
+        f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+    )
+
+def create_partition(connection, day: date):
+    """创建某一天的分区（已存在时跳过）"""
+    if day in _known_partitions:
+        return
+    connection.execute(_create_partition_sql(day))
+    _known_partitions.add(day)
+
+def ensure_partitions(engine, start: Optional[date] = None, days_ahead: int = ANALYSIS_PARTITION_PREMAKE_DAYS):
+    """创建从 start（默认今天）到未来 days_ahead 天的分区"""
+    if not is_postgresql(engine):
+        return
+    start = start or date.today()
+    end = date.today() + timedelta(days=days_ahead)
+    with engine.begin() as connection:
+        if not _is_partitioned(connection):
+            return
+        day = start
+        while day <= end:
+            create_partition(connection, day)
+            day += timedelta(days=1)
+
+def _copy_legacy_table(connection):
+    """把旧的非分区表中保留期内的数据复制到分区表，并重建最新结果指针"""
+    exists = connection.execute(text("SELECT to_regclass('ai_analyses_legacy') IS NOT NULL")).scalar()
+    if not exists:
+        return
+    cutoff = date.today() - timedelta(days=ANALYSIS_RETENTION_DAYS)
+    connection.execute(text(
+        "INSERT INTO ai_analyses (id, stock_id, analysis_type, analysis_content, confidence_score, "
+        "tags, prompt_template, valid_until, created_at) "
+        "SELECT id, stock_id, analysis_type, analysis_content, confidence_score, tags, prompt_template, "
+        "valid_until, created_at FROM ai_analyses_legacy "
+        "WHERE created_at >= :cutoff AND created_at < :limit"
+    ), {"cutoff": cutoff, "limit": date.today() + timedelta(days=ANALYSIS_PARTITION_PREMAKE_DAYS + 1)})
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence('ai_analyses', 'id'), "
+        "GREATEST((SELECT COALESCE(MAX(id), 0) FROM ai_analyses), 1))"
+    ))
+    connection.execute(text(
+        "INSERT INTO ai_analysis_latest (stock_id, analysis_type, analysis_id, analysis_created_at, valid_until, updated_at) "
+        "SELECT DISTINCT ON (stock_id, analysis_type) stock_id, analysis_type, id, created_at, valid_until, now() "
+        "FROM ai_analyses WHERE stock_id IS NOT NULL AND analysis_type IS NOT NULL "
+        "ORDER BY stock_id, analysis_type, created_at DESC, id DESC "
+        "ON CONFLICT (stock_id, analysis_type) DO NOTHING"
+    ))
+    connection.execute(text("DROP TABLE ai_analyses_legacy"))
+    logger.info("已将旧的 ai_analyses 表迁移为按天分区的表")
+
+def ensure_analysis_storage(engine):
+    """在PostgreSQL上执行分区迁移并创建保留期内和未来几天的分区，其他数据库不做处理"""
+    if not is_postgresql(engine):
+        return
+    try:
+        sql = (MIGRATIONS_DIR / PARTITION_MIGRATION).read_text(encoding="utf-8")
+        with engine.begin() as connection:
+            connection.exec_driver_sql(sql)
+            if not _is_partitioned(connection):
+                return
+            day = date.today() - timedelta(days=ANALYSIS_RETENTION_DAYS)
+            while day <= date.today() + timedelta(days=ANALYSIS_PARTITION_PREMAKE_DAYS):
+                create_partition(connection, day)
+                day += timedelta(days=1)
+            _copy_legacy_table(connection)
+    except Exception as e:
+        _known_partitions.clear()
+        logger.error(f"初始化分析结果分区表失败: {e}")
+
+def drop_expired_partitions(engine) -> Dict[str, Any]:
+    """清理过期分析
+
+    PostgreSQL 上删除保留期之前的整个分区，并清理指向这些分区的指针；
+    其他数据库回退为按 valid_until 逐行删除。
+    """
+    cutoff_day = date.today() - timedelta(days=ANALYSIS_RETENTION_DAYS)
+    if not is_postgresql(engine):
+        with engine.begin() as connection:
+            deleted = connection.execute(
+                AIAnalysis.__table__.delete().where(AIAnalysis.valid_until < datetime.now())
+            ).rowcount
+            connection.execute(
+                AIAnalysisLatest.__table__.delete().where(AIAnalysisLatest.valid_until < datetime.now())
+            )
+        return {"mode": "delete", "deleted_rows": deleted}
+
+    dropped = []
+    with engine.begin() as connection:
+        partitions = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'ai_analyses'"
+        )).scalars().all()
+        for name in partitions:
+            match = _PARTITION_NAME.match(name)
+            if not match:
+                continue
+            day = datetime.strptime(match.group(1), "%Y%m%d").date()
+            if day < cutoff_day:
+                connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                _known_partitions.discard(day)
+                dropped.append(name)
+        connection.execute(
+            AIAnalysisLatest.__table__.delete().where(
+                AIAnalysisLatest.analysis_created_at < datetime.combine(cutoff_day, datetime.min.time())
+            )
+        )
+    ensure_partitions(engine)
+    return {"mode": "partition_drop", "dropped_partitions": dropped}
+
+class AnalysisStore:
+    """AI分析结果的读写
+
+    写入只追加新行并更新 (stock_id, analysis_type) 的最新结果指针，不再删除旧行；
+    读取通过指针表定位最新结果。
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _ensure_today_partition(self, created_at: datetime):
+        if created_at.date() in _known_partitions or not is_postgresql(self.session):
+            return
+        day = created_at.date()
+        exists = self.session.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": _partition_name(day)}
+        ).scalar()
+        if exists:
+            _known_partitions.add(day)
+        elif _is_partitioned(self.session):
+            # 在当前事务中创建，随本次写入一起提交；提交前不记入已知分区
+            self.session.execute(_create_partition_sql(day))
+        else:
+            _known_partitions.add(day)
+    
+    def save(self, stock_id: int, analysis_type: str, content: Dict[str, Any],
+             valid_hours: int = ANALYSIS_VALID_HOURS, commit: bool = True) -> AIAnalysis:
+        """追加一条分析结果并把指针指向它"""
+        created_at = datetime.now()
+        self._ensure_today_partition(created_at)
+        analysis = AIAnalysis(
+            stock_id=stock_id,
+            analysis_type=analysis_type,
+            analysis_content=content,
+            confidence_score=content.get("confidence", 0.7),
+            tags=content.get("tags", []),
+            valid_until=created_at + timedelta(hours=valid_hours),
+            created_at=created_at
+        )
+        self.session.add(analysis)
+        self.session.flush()
+        upsert_rows(self.session, AIAnalysisLatest, {
+            "stock_id": stock_id,
+            "analysis_type": analysis_type,
+            "analysis_id": analysis.id,
+            "analysis_created_at": created_at,
+            "valid_until": analysis.valid_until,
+            "updated_at": created_at
+        }, index_elements=["stock_id", "analysis_type"])
+        if commit:
+            self.session.commit()
+        return analysis
+
+    def latest_query(self, include_expired: bool = False) -> Query:
+        """最新分析结果的查询，返回 AIAnalysis 实体，可继续追加过滤条件"""
+        query = self.session.query(AIAnalysis).join(
+            AIAnalysisLatest,
+            and_(
+                AIAnalysisLatest.analysis_id == AIAnalysis.id,
+                AIAnalysisLatest.analysis_created_at == AIAnalysis.created_at
+            )
+        )
+        if not include_expired:
+            query = query.filter(or_(AIAnalysisLatest.valid_until.is_(None), AIAnalysisLatest.valid_until >= datetime.now()))
+        return query
+
+    def latest_for_stock(self, stock_id: int, analysis_type: Optional[str] = None,
+                         since: Optional[datetime] = None) -> List[AIAnalysis]:
+        """某只股票各类型的最新分析"""
+        query = self.latest_query().filter(AIAnalysisLatest.stock_id == stock_id)
+        if analysis_type:
+            query = query.filter(AIAnalysisLatest.analysis_type == analysis_type)
+        if since:
+            query = query.filter(AIAnalysisLatest.analysis_created_at >= since)
+        return query.order_by(AIAnalysisLatest.analysis_created_at.desc()).all()
+
+    def latest_for_stocks(self, stock_ids: List[int], since: Optional[datetime] = None) -> Dict[int, List[AIAnalysis]]:
+        """多只股票各类型的最新分析（一次查询），按股票ID分组"""
+        grouped: Dict[int, List[AIAnalysis]] = {stock_id: [] for stock_id in stock_ids}
+        if not stock_ids:
+            return grouped
+        query = self.latest_query().filter(AIAnalysisLatest.stock_id.in_(stock_ids))
+        if since:
+            query = query.filter(AIAnalysisLatest.analysis_created_at >= since)
+        for analysis in query.order_by(AIAnalysisLatest.analysis_created_at.desc()).all():
+            grouped[analysis.stock_id].append(analysis)
+        return grouped
+
+    def latest_for_symbols(self, symbols: List[str]) -> List[tuple]:
+        """多只股票各类型的最新分析，返回 (股票代码, AIAnalysis)"""
+        return self.latest_query().add_columns(Stock.symbol).join(
+            Stock, Stock.id == AIAnalysisLatest.stock_id
+        ).filter(Stock.symbol.in_(symbols)).order_by(AIAnalysisLatest.analysis_created_at.desc()).all()
+
+    def recently_analyzed_stocks(self, since: Optional[datetime] = None, limit: Optional[int] = None) -> List[Stock]:
+        """最近有分析结果的股票，按最近一次分析时间倒序"""
+        last_analyzed = func.max(AIAnalysisLatest.analysis_created_at)
+        query = self.session.query(Stock).join(AIAnalysisLatest, AIAnalysisLatest.stock_id == Stock.id)
+        if since:
+            query = query.filter(AIAnalysisLatest.analysis_created_at >= since)
+        query = query.group_by(Stock.id).order_by(last_analyzed.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from ..lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# 比较分析配置
+COMPARE_BENCHMARK = os.getenv("COMPARE_BENCHMARK", "SPY")
+COMPARE_PERIOD = os.getenv("COMPARE_PERIOD", "6mo")
+COMPARE_RS_WINDOW = int(os.getenv("COMPARE_RS_WINDOW", "20"))
+# 相对前高回撤超过该比例的交易日视为处于回撤中
+COMPARE_DRAWDOWN_THRESHOLD = float(os.getenv("COMPARE_DRAWDOWN_THRESHOLD", "0.05"))
+
+TRADING_DAYS = 252
+
+def _matrix(symbols: List[str], values: np.ndarray, digits: int = 4) -> Dict[str, Any]:
+    """矩阵序列化为 {symbols, matrix}，比逐对的字典更紧凑"""
+    return {"symbols": symbols, "matrix": np.round(values, digits).tolist()}
+
+def _finite(value: float, digits: int = 2) -> Optional[float]:
+    return round(float(value), digits) if np.isfinite(value) else None
+
+class ComparisonService:
+    """多股票比较分析
+
+    把各股票收盘价按交易日对齐成一个面板，然后一次性用矩阵运算得到
+    收益率、相关/协方差矩阵、相对基准的Beta、滚动相对强弱和回撤重叠。
+    """
+
+    def __init__(self, benchmark: str = COMPARE_BENCHMARK, rs_window: int = COMPARE_RS_WINDOW,
+                 drawdown_threshold: float = COMPARE_DRAWDOWN_THRESHOLD):
+        self.benchmark = benchmark.upper() if benchmark else None
+        self.rs_window = rs_window
+        self.drawdown_threshold = drawdown_threshold
+
+    def build_panel(self, histories: Dict[str, Optional[pd.DataFrame]]) -> Tuple[List[str], List[str], np.ndarray]:
+        """按交易日对齐收盘价，返回 (日期, 股票代码, 收盘价矩阵 T×N)
+
+        不同交易所的时间戳时区不同，统一按日期对齐，只保留所有股票都有价格的日期。
+        """
+        series = {}
+        for symbol, data in histories.items():
+            if data is None or data.empty or "Close" not in data:
+                continue
+            close = data["Close"].astype(float)
+            close.index = pd.to_datetime(close.index.date)
+            series[symbol] = close[~close.index.duplicated(keep="last")]
+
+        if not series:
+            return [], [], np.empty((0, 0))
+
+        panel = pd.concat(series, axis=1, join="inner").dropna()
+        panel = panel[(panel > 0).all(axis=1)]
+        dates = [d.strftime("%Y-%m-%d") for d in panel.index]
+        return dates, list(panel.columns), panel.to_numpy(dtype=float)
+
+    def compute(self, dates: List[str], symbols: List[str], closes: np.ndarray) -> Dict[str, Any]:
+        """在对齐后的收盘价面板上计算全部比较指标"""
+        observations, count = closes.shape
+        if observations < 3 or count == 0:
+            return {}
+
+        # 日收益率矩阵 (T-1)×N
+        returns = closes[1:] / closes[:-1] - 1.0
+        centered = returns - returns.mean(axis=0)
+        covariance = centered.T @ centered / (returns.shape[0] - 1)
+        std = np.sqrt(np.diag(covariance))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.outer(std, std)
+        correlation = np.nan_to_num(correlation)
+
+        # 收益、波动率与回撤
+        total_return = closes[-1] / closes[0] - 1.0
+        volatility = std * np.sqrt(TRADING_DAYS)
+        drawdown = 1.0 - closes / np.maximum.accumulate(closes, axis=0)
+        max_drawdown = drawdown.max(axis=0)
+
+        # 回撤重叠：两只股票同时处于回撤中的交易日占比
+        in_drawdown = (drawdown > self.drawdown_threshold).astype(float)
+        drawdown_overlap = in_drawdown.T @ in_drawdown / observations
+
+        # 相对基准的Beta与相对强弱
+        benchmark_index = symbols.index(self.benchmark) if self.benchmark in symbols else None
+        beta = np.full(count, np.nan)
+        relative_strength = np.full(count, np.nan)
+        rolling_strength = np.full(count, np.nan)
+        rolling_series = None
+        if benchmark_index is not None:
+            benchmark_variance = covariance[benchmark_index, benchmark_index]
+            if benchmark_variance > 0:
+                beta = covariance[:, benchmark_index] / benchmark_variance
+            # 相对强弱线：个股净值 / 基准净值
+            ratio = (closes / closes[0]) / (closes[:, [benchmark_index]] / closes[0, benchmark_index])
+            relative_strength = ratio[-1] - 1.0
+            # 观测数不足一个窗口时不计算滚动相对强弱，避免用更短的窗口冒充
+            if observations > self.rs_window:
+                rolling_series = ratio[self.rs_window:] / ratio[:-self.rs_window] - 1.0
+                rolling_strength = rolling_series[-1]
+
+        metrics = {}
+        for index, symbol in enumerate(symbols):
+            sharpe = total_return[index] / volatility[index] if volatility[index] > 0 else 0.0
+            metrics[symbol] = {
+                "total_return": _finite(total_return[index] * 100),
+                "volatility": _finite(volatility[index] * 100),
+                "max_drawdown": _finite(max_drawdown[index] * 100),
+                "sharpe_ratio": _finite(sharpe),
+                "beta": _finite(beta[index]),
+                "relative_strength": _finite(relative_strength[index] * 100),
+            }
+            if rolling_series is not None:
+                metrics[symbol][f"relative_strength_{self.rs_window}d"] = _finite(rolling_strength[index] * 100)
+
+        result = {
+            "start": dates[0],
+            "end": dates[-1],
+            "observations": observations,
+            "benchmark": self.benchmark if benchmark_index is not None else None,
+            "metrics": metrics,
+            "correlation": _matrix(symbols, correlation),
+            "covariance": _matrix(symbols, covariance * TRADING_DAYS, 6),
+            "drawdown_overlap": _matrix(symbols, drawdown_overlap),
+        }
+        if rolling_series is not None:
+            # 滚动相对强弱只返回最近的点，供前端绘图
+            tail = min(len(rolling_series), 60)
+            result["rolling_relative_strength"] = {
+                "window": self.rs_window,
+                "dates": dates[-tail:],
+                "values": {s: np.round(rolling_series[-tail:, i] * 100, 2).tolist() for i, s in enumerate(symbols)},
+            }
+        return result
+
+    def compare(self, histories: Dict[str, Optional[pd.DataFrame]]) -> Dict[str, Any]:
+        """对齐历史数据并计算比较指标"""
+        try:
+            dates, symbols, closes = self.build_panel(histories)
+            if not symbols:
+                return {}
+            return self.compute(dates, symbols, closes)
+        except Exception as e:
+            logger.error(f"计算比较指标失败: {e}")
+            return {}
+
+    @staticmethod
+    def prompt_summary(comparison: Dict[str, Any]) -> Dict[str, Any]:
+        """提示词用的精简版本：去掉协方差和滚动序列，只保留指标和矩阵"""
+        return {
+            key: comparison[key]
+            for key in ("start", "end", "observations", "benchmark", "metrics", "correlation", "drawdown_overlap")
+            if key in comparison
+        }
@@ -0,0 +1,168 @@
+import json
+import math
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 问答上下文的token预算
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# 每种分析只保留的字段，按重要性排序；长文本字段在压缩时会被截断或丢弃
+ANALYSIS_FIELDS = {
+    "technical": ["overall_sentiment", "key_levels", "confidence", "short_term_outlook"],
+    "fundamental": ["fundamental_score", "confidence", "investment_thesis", "long_term_outlook"],
+    "sentiment": ["sentiment_score", "confidence_level", "recommendation"],
+    "recommendation": ["rating", "target_price_range", "time_horizon", "risk_level", "stop_loss", "confidence", "action_plan"],
+}
+TEXT_FIELDS = {"short_term_outlook", "investment_thesis", "long_term_outlook", "recommendation", "action_plan"}
+
+def estimate_tokens(text: str) -> int:
+    """本地估算token数：中日韩字符约1个token，其余约4个字符1个token"""
+    cjk = sum(1 for c in text if "⺀" <= c <= "鿿" or "豈" <= c <= "￯")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def dumps_compact(data: Any) -> str:
+    """紧凑的JSON序列化，用于拼接提示词"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def _round(value: Any, digits: int = 2) -> Any:
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return {k: _round(v, digits) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_round(v, digits) for v in value]
+    return value
+
+def summarize_bars(bars: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把逐日K线压缩为区间统计"""
+    if not bars:
+        return {}
+    closes = [b["close"] for b in bars]
+    returns = [(closes[i] - closes[i - 1]) / closes[i - 1] for i in range(1, len(closes)) if closes[i - 1]]
+
+    volatility = None
+    if len(returns) > 1:
+        mean = sum(returns) / len(returns)
+        variance = sum((r - mean) ** 2 for r in returns) / (len(returns) - 1)
+        volatility = math.sqrt(variance) * math.sqrt(252) * 100
+
+    peak = closes[0]
+    max_drawdown = 0.0
+    for price in closes:
+        peak = max(peak, price)
+        if peak:
+            max_drawdown = max(max_drawdown, (peak - price) / peak)
+
+    return {
+        "bars": len(bars),
+        "start": bars[0]["date"],
+        "end": bars[-1]["date"],
+        "first_close": closes[0],
+        "last_close": closes[-1],
+        "return_pct": (closes[-1] - closes[0]) / closes[0] * 100 if closes[0] else None,
+        "high": max(b["high"] for b in bars),
+        "low": min(b["low"] for b in bars),
+        "avg_volume": int(sum(b["volume"] for b in bars) / len(bars)),
+        "volatility_pct": volatility,
+        "max_drawdown_pct": max_drawdown * 100,
+        "recent_closes": closes[-5:],
+    }
+
+class ContextBuilder:
+    """问答上下文构建器
+
+    把K线压缩为统计摘要，只保留技术指标和每种分析最新一条的关键字段，
+    并逐级裁剪直到满足token预算。
+    """
+
+    def __init__(self, token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def _compact_analyses(self, analyses: List[Dict[str, Any]], level: int) -> Dict[str, Any]:
+        latest: Dict[str, Dict[str, Any]] = {}
+        for analysis in sorted(analyses, key=lambda a: a.get("created_at", ""), reverse=True):
+            latest.setdefault(analysis.get("type"), analysis)
+
+        compact = {}
+        for analysis_type, analysis in latest.items():
+            content = analysis.get("content") or {}
+            if not isinstance(content, dict) or "error" in content:
+                continue
+            fields = {}
+            for field in ANALYSIS_FIELDS.get(analysis_type, ["confidence"]):
+                value = content.get(field)
+                if value in (None, "", [], {}):
+                    continue
+                if field in TEXT_FIELDS and isinstance(value, str):
+                    if level >= 2:
+                        continue
+                    if level >= 1 and len(value) > 120:
+                        value = value[:120] + "…"
+                fields[field] = value
+            if fields:
+                fields["as_of"] = (analysis.get("created_at") or "")[:10]
+                compact[analysis_type] = fields
+        return compact
+
+    def _compact_symbol(self, data: Dict[str, Any], level: int) -> Dict[str, Any]:
+        compact: Dict[str, Any] = {}
+        stock_info = data.get("stock_info") or {}
+        if stock_info:
+            compact["info"] = {k: v for k, v in stock_info.items() if v not in (None, "") and k != "symbol"}
+
+        chart_data = data.get("chart_data") or {}
+        summary = summarize_bars(chart_data.get("data") or [])
+        if summary:
+            if level >= 1:
+                summary.pop("recent_closes", None)
+            compact["price_summary"] = summary
+        if chart_data.get("indicators"):
+            compact["indicators"] = chart_data["indicators"]
+
+        analyses = self._compact_analyses(data.get("analyses") or [], level)
+        if analyses:
+            compact["analyses"] = analyses
+        if data.get("unavailable"):
+            compact["unavailable"] = data["unavailable"]
+        return _round(compact)
+
+    def _compact(self, context: Dict[str, Any], level: int, max_symbols: Optional[int]) -> Dict[str, Any]:
+        compact = {}
+        for index, (key, value) in enumerate(context.items()):
+            if max_symbols is not None and index >= max_symbols:
+                break
+            if isinstance(value, dict) and ("stock_info" in value or "chart_data" in value or "analyses" in value):
+                compact[key] = self._compact_symbol(value, level)
+            else:
+                compact[key] = _round(value)
+        return compact
+
+    def build(self, context: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """返回 (压缩后的上下文, token统计)"""
+        original_tokens = estimate_tokens(json.dumps(context, indent=2, ensure_ascii=False, default=str))
+
+        compact: Dict[str, Any] = {}
+        tokens = 0
+        level = 0
+        max_symbols = None
+        # 逐级压缩：0 完整摘要；1 截断长文本；2 去掉长文本；之后逐个减少股票数量
+        for level in range(3 + max(len(context) - 1, 0)):
+            if level >= 3:
+                max_symbols = len(context) - (level - 2)
+            compact = self._compact(context, min(level, 2), max_symbols)
+            tokens = estimate_tokens(dumps_compact(compact))
+            if tokens <= self.token_budget:
+                break
+
+        stats = {
+            "original_tokens": original_tokens,
+            "context_tokens": tokens,
+            "tokens_saved": max(original_tokens - tokens, 0),
+            "token_budget": self.token_budget,
+            "compaction_level": level,
+            "within_budget": tokens <= self.token_budget,
+        }
+        return compact, stats
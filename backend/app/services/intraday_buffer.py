@@ -0,0 +1,356 @@
+"""活跃股票的分钟K线：进程内定长环形缓冲区
+
+每只股票一个按数组存放的环形缓冲区（时间戳、开高低收、成交量各一列），容量覆盖一个自然日的1分钟K线：
+- 轮询线程只取当天数据，只追加比缓冲区最后一根更新的K线，每根 O(1)；最后一根未走完时原地覆盖；
+- 5分钟等更粗的周期在读取时由1分钟数据聚合，技术指标直接在数组上计算，不经过 DataFrame 和数据库；
+- 收盘后（或数据跨日时）把当天的分钟线汇总成一根日线，价格表中该日还没有日线时补入（不覆盖行情源的日线）。
+
+股票在被请求分钟数据后成为活跃股票，超过 INTRADAY_ACTIVE_TTL 秒没有请求后停止轮询并释放缓冲区。
+缓冲区在每个 API 进程内各自维护。
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from ..database import SessionLocal
+from ..http_cache import market_state
+from ..lazy_imports import lazy_import
+from ..models import Stock
+from .price_store import get_price_store
+from .stock_service import get_intraday_bars
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# 每只股票缓冲区的容量（根），默认容纳一个自然日的1分钟K线
+INTRADAY_BUFFER_CAPACITY = int(os.getenv("INTRADAY_BUFFER_CAPACITY", "1440"))
+# 同时维护的活跃股票上限，超过时释放最久未请求的
+INTRADAY_MAX_SYMBOLS = int(os.getenv("INTRADAY_MAX_SYMBOLS", "200"))
+# 轮询间隔（秒）和股票保持活跃的时间（秒）
+INTRADAY_POLL_SECONDS = float(os.getenv("INTRADAY_POLL_SECONDS", "60"))
+INTRADAY_ACTIVE_TTL = float(os.getenv("INTRADAY_ACTIVE_TTL", "1800"))
+
+BASE_INTERVAL = "1m"
+# 支持的周期及其秒数，均由1分钟数据聚合
+INTERVAL_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "60m": 3600}
+
+class IntradayRingBuffer:
+    """单只股票一个交易日的1分钟K线"""
+
+    def __init__(self, capacity: int = INTRADAY_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        # 依次为开、高、低、收
+        self.prices = np.zeros((4, capacity), dtype=np.float64)
+        self.volumes = np.zeros(capacity, dtype=np.int64)
+        self.start = 0
+        self.size = 0
+        self.session_date: Optional[date] = None
+        self.timezone = "UTC"
+        # 当天的分钟线是否已汇总为日线入库
+        self.rolled_up = False
+        self.updated_at = 0.0
+        self._lock = threading.Lock()
+        # 轮询线程和首次请求的回补可能同时写入，整批追加时串行
+        self.ingest_lock = threading.Lock()
+
+    @property
+    def last_timestamp(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return int(self.timestamps[(self.start + self.size - 1) % self.capacity])
+
+    def reset(self, session_date: Optional[date] = None, timezone: Optional[str] = None):
+        with self._lock:
+            self.start = 0
+            self.size = 0
+            self.session_date = session_date
+            self.timezone = timezone or self.timezone
+            self.rolled_up = False
+
+    def append(self, timestamp: int, open_: float, high: float, low: float, close: float, volume: int) -> bool:
+        """追加一根K线；与最后一根时间相同时覆盖（未走完的K线随轮询更新），比最后一根早的忽略"""
+        with self._lock:
+            last = (self.start + self.size - 1) % self.capacity
+            if self.size and timestamp < self.timestamps[last]:
+                return False
+            if self.size and timestamp == self.timestamps[last]:
+                position = last
+            elif self.size < self.capacity:
+                position = (self.start + self.size) % self.capacity
+                self.size += 1
+            else:
+                # 已满时覆盖最早的一根
+                position = self.start
+                self.start = (self.start + 1) % self.capacity
+            self.timestamps[position] = timestamp
+            self.prices[:, position] = (open_, high, low, close)
+            self.volumes[position] = volume
+            self.updated_at = time.time()
+            return True
+
+    def arrays(self) -> Tuple[Any, Any, Any]:
+        """按时间顺序复制出 (时间戳, 开高低收[4, n], 成交量)"""
+        with self._lock:
+            order = (self.start + np.arange(self.size)) % self.capacity
+            return self.timestamps[order], self.prices[:, order], self.volumes[order]
+
+    def daily_bar(self) -> Optional[Dict[str, Any]]:
+        """把缓冲区中的分钟线汇总为一根日线"""
+        timestamps, prices, volumes = self.arrays()
+        if not len(timestamps):
+            return None
+        return {
+            "date": self.session_date,
+            "open": float(prices[0, 0]),
+            "high": float(prices[1].max()),
+            "low": float(prices[2].min()),
+            "close": float(prices[3, -1]),
+            "volume": int(volumes.sum()),
+        }
+
+def resample(timestamps, prices, volumes, seconds: int):
+    """把1分钟K线聚合为 seconds 秒一根（按UTC时间对齐）"""
+    if seconds <= 60 or not len(timestamps):
+        return timestamps, prices, volumes
+    buckets = timestamps // seconds
+    boundaries = np.flatnonzero(np.diff(buckets)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries - 1, [len(timestamps) - 1]))
+    merged = np.vstack([
+        prices[0, starts],
+        np.maximum.reduceat(prices[1], starts),
+        np.minimum.reduceat(prices[2], starts),
+        prices[3, ends],
+    ])
+    return buckets[starts] * seconds, merged, np.add.reduceat(volumes, starts)
+
+def _ewm(values, span: int):
+    """与 pandas ewm(span=span).mean()（adjust=True）相同的指数加权平均序列"""
+    decay = 1 - 2 / (span + 1)
+    result = np.empty(len(values))
+    numerator = denominator = 0.0
+    for i, value in enumerate(values):
+        numerator = value + decay * numerator
+        denominator = 1 + decay * denominator
+        result[i] = numerator / denominator
+    return result
+
+def _last_mean(values, window: int) -> Optional[float]:
+    return float(values[-window:].mean()) if len(values) >= window else None
+
+def indicators_from_arrays(close, volume) -> Dict[str, Any]:
+    """在收盘价数组上计算与 StockDataService.calculate_technical_indicators 相同结构的指标"""
+    if not len(close):
+        return {}
+    # RSI：首根没有涨跌，按0计入
+    delta = np.diff(close, prepend=close[0])
+    gain = _last_mean(np.where(delta > 0, delta, 0.0), 14)
+    loss = _last_mean(np.where(delta < 0, -delta, 0.0), 14)
+    rsi = None
+    if gain is not None and loss:
+        rsi = 100 - 100 / (1 + gain / loss)
+    elif gain and loss == 0:
+        rsi = 100.0
+
+    macd_line = _ewm(close, 12) - _ewm(close, 26)
+    signal = _ewm(macd_line, 9)
+
+    middle = _last_mean(close, 20)
+    std = float(close[-20:].std(ddof=1)) if len(close) >= 20 else None
+    change = float(close[-1] - close[-2]) if len(close) > 1 else 0
+    return {
+        "moving_averages": {f"MA{n}": _last_mean(close, n) for n in (5, 10, 20, 50)},
+        "rsi": rsi,
+        "macd": {
+            "macd": float(macd_line[-1]),
+            "signal": float(signal[-1]),
+            "histogram": float(macd_line[-1] - signal[-1]),
+        },
+        "bollinger_bands": {
+            "upper": middle + std * 2 if middle is not None else None,
+            "middle": middle,
+            "lower": middle - std * 2 if middle is not None else None,
+        },
+        "current_price": float(close[-1]),
+        "volume": int(volume[-1]),
+        "price_change": change,
+        "price_change_percent": change / float(close[-2]) * 100 if len(close) > 1 and close[-2] else 0,
+    }
+
+class IntradayBuffers:
+    """进程内所有活跃股票的缓冲区"""
+
+    def __init__(self, capacity: int = INTRADAY_BUFFER_CAPACITY, max_symbols: int = INTRADAY_MAX_SYMBOLS):
+        self.capacity = capacity
+        self.max_symbols = max_symbols
+        self._buffers: "OrderedDict[str, IntradayRingBuffer]" = OrderedDict()
+        self._requested: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> Optional[IntradayRingBuffer]:
+        with self._lock:
+            return self._buffers.get(symbol)
+
+    def touch(self, symbol: str) -> IntradayRingBuffer:
+        """登记一次请求，返回该股票的缓冲区（不存在时创建）"""
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None:
+                buffer = IntradayRingBuffer(self.capacity)
+                self._buffers[symbol] = buffer
+            self._buffers.move_to_end(symbol)
+            self._requested[symbol] = time.time()
+            while len(self._buffers) > self.max_symbols:
+                evicted, _ = self._buffers.popitem(last=False)
+                self._requested.pop(evicted, None)
+            return buffer
+
+    def active_symbols(self, ttl: float = INTRADAY_ACTIVE_TTL) -> List[str]:
+        """仍在活跃期内的股票，同时释放已过期的"""
+        cutoff = time.time() - ttl
+        with self._lock:
+            for symbol in [s for s, at in self._requested.items() if at < cutoff]:
+                self._buffers.pop(symbol, None)
+                self._requested.pop(symbol, None)
+            return list(self._buffers)
+
+    def ingest(self, symbol: str, data) -> List[Dict[str, Any]]:
+        """把 yfinance 的分钟数据追加到缓冲区，返回因跨日而结束的交易日的日线"""
+        buffer = self.get(symbol)
+        if buffer is None or data is None or data.empty:
+            return []
+        index = data.index
+        # 索引的存储精度随 pandas 版本不同（ns/us），统一换算为秒
+        timestamps = index.as_unit("s").asi8
+        dates = index.date
+        timezone = str(index.tz) if index.tz is not None else "UTC"
+        columns = data[["Open", "High", "Low", "Close"]].to_numpy(dtype=float)
+        volumes = data["Volume"].fillna(0).to_numpy(dtype=np.int64)
+
+        completed = []
+        with buffer.ingest_lock:
+            last = buffer.last_timestamp
+            # 只处理比缓冲区最后一根新的K线（包括最后一根本身，它可能尚未走完）
+            first = 0 if last is None else int(np.searchsorted(timestamps, last))
+            for i in range(first, len(timestamps)):
+                if dates[i] != buffer.session_date:
+                    if buffer.size and not buffer.rolled_up:
+                        completed.append(buffer.daily_bar())
+                    buffer.reset(dates[i], timezone)
+                o, h, l, c = columns[i]
+                if np.isnan(c):
+                    continue
+                buffer.append(int(timestamps[i]), o, h, l, c, int(volumes[i]))
+        return completed
+
+    def chart(self, symbol: str, interval: str = BASE_INTERVAL) -> Dict[str, Any]:
+        """分钟K线图数据和技术指标，格式与日K线接口一致"""
+        buffer = self.get(symbol)
+        if buffer is None or not buffer.size:
+            return {}
+        timestamps, prices, volumes = resample(*buffer.arrays(), INTERVAL_SECONDS[interval])
+        zone = ZoneInfo(buffer.timezone)
+        chart_data = [
+            {
+                "time": datetime.fromtimestamp(int(ts), zone).isoformat(),
+                "open": float(o), "high": float(h), "low": float(l), "close": float(c), "volume": int(v)
+            }
+            for ts, o, h, l, c, v in zip(timestamps, prices[0], prices[1], prices[2], prices[3], volumes)
+        ]
+        return {
+            "symbol": symbol,
+            "interval": interval,
+            "session_date": buffer.session_date.isoformat() if buffer.session_date else None,
+            "timezone": buffer.timezone,
+            "data": chart_data,
+            "indicators": indicators_from_arrays(prices[3], volumes),
+            "daily_bar": {**buffer.daily_bar(), "date": buffer.session_date.isoformat()},
+            "updated_at": datetime.fromtimestamp(buffer.updated_at).isoformat(),
+            "total_records": len(chart_data)
+        }
+
+def save_daily_bar(symbol: str, bar: Dict[str, Any]) -> bool:
+    """把汇总的日线补入价格表，只在该日期还没有日线时插入；股票不在库中时跳过
+
+    日线以行情源（update_market_data）为准：分钟线汇总只覆盖常规交易时段，成交量也不是全市场合计，
+    因此不覆盖已有的日线；紧凑存储下行情源之后写入的日线会覆盖这里补入的K线。
+    """
+    session = SessionLocal()
+    try:
+        stock = session.query(Stock).filter(Stock.symbol == symbol).first()
+        if not stock:
+            return False
+        frame = pd.DataFrame(
+            {"Open": [bar["open"]], "High": [bar["high"]], "Low": [bar["low"]],
+             "Close": [bar["close"]], "Volume": [bar["volume"]]},
+            index=[bar["date"]]
+        )
+        get_price_store(session).save_bars(stock.id, frame, overwrite=False)
+        session.commit()
+        return True
+    except Exception as e:
+        logger.error(f"保存分钟线汇总日线失败 {symbol}: {e}")
+        session.rollback()
+        return False
+    finally:
+        session.close()
+
+class IntradayPoller:
+    """后台轮询活跃股票的分钟数据，有活跃股票时才启动"""
+
+    def __init__(self, buffers: IntradayBuffers, interval: float = INTRADAY_POLL_SECONDS):
+        self.buffers = buffers
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="intraday-poller", daemon=True)
+                self._thread.start()
+
+    def refresh(self, symbol: str) -> int:
+        """拉取当天的分钟数据并追加，返回缓冲区中的K线数"""
+        data = get_intraday_bars(symbol, BASE_INTERVAL, "1d")
+        for bar in self.buffers.ingest(symbol, data):
+            save_daily_bar(symbol, bar)
+        buffer = self.buffers.get(symbol)
+        return buffer.size if buffer else 0
+
+    def poll_once(self):
+        for symbol in self.buffers.active_symbols():
+            try:
+                is_open, _, _ = market_state(symbol)
+                buffer = self.buffers.get(symbol)
+                if is_open:
+                    self.refresh(symbol)
+                elif buffer is not None and buffer.size and not buffer.rolled_up:
+                    # 收盘后补齐最后几根，再把当天汇总为日线
+                    self.refresh(symbol)
+                    bar = buffer.daily_bar()
+                    if bar and save_daily_bar(symbol, bar):
+                        buffer.rolled_up = True
+            except Exception as e:
+                logger.error(f"轮询分钟数据失败 {symbol}: {e}")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.buffers.active_symbols():
+                    # 没有活跃股票时退出，下一次请求重新启动
+                    self._thread = None
+                    return
+            started = time.time()
+            self.poll_once()
+            time.sleep(max(self.interval - (time.time() - started), 1))
+
+intraday_buffers = IntradayBuffers()
+intraday_poller = IntradayPoller(intraday_buffers)
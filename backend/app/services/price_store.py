@@ -0,0 +1,319 @@
+from __future__ import annotations
+import os
+import logging
+import time
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+from ..database import is_postgresql, upsert_rows
+from ..models import Stock, StockPrice, StockPriceBar
+from ..lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# 价格存储模式：legacy 使用 stock_prices（Numeric价格），compact 使用 stock_price_bars
+PRICE_STORAGE = os.getenv("PRICE_STORAGE", "compact")
+# 批量写入时每条语句包含的行数
+PRICE_INSERT_CHUNK = int(os.getenv("PRICE_INSERT_CHUNK", "1000"))
+# worker 进程内价格面板覆盖的自然日数和有效期（秒），与行情更新周期一致
+PRICE_PANEL_DAYS = int(os.getenv("PRICE_PANEL_DAYS", "60"))
+PRICE_PANEL_TTL = float(os.getenv("PRICE_PANEL_TTL", "300"))
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations"
+PRICE_MIGRATION = "0002_stock_price_bars.sql"
+PARTITION_PREFIX = "stock_price_bars_y"
+
+# 本进程已确认存在的年度分区
+_known_years: Set[int] = set()
+
+IS_PARTITIONED_SQL = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+    "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'stock_price_bars')"
+)
+
+def _create_partition_sql(year: int):
+    return text(
+        f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{year} PARTITION OF stock_price_bars "
+        f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    )
+
+def _ensure_years(connection, years: Iterable[int]):
+    for year in sorted(set(years) - _known_years):
+        connection.execute(_create_partition_sql(year))
+        _known_years.add(year)
+
+def ensure_price_storage(engine):
+    """在PostgreSQL上把 stock_price_bars 改建为按年分区的表，并从 stock_prices 回填历史数据"""
+    if not is_postgresql(engine):
+        return
+    try:
+        sql = (MIGRATIONS_DIR / PRICE_MIGRATION).read_text(encoding="utf-8")
+        with engine.begin() as connection:
+            connection.exec_driver_sql(sql)
+            if not connection.execute(IS_PARTITIONED_SQL).scalar():
+                return
+
+            legacy = connection.execute(text("SELECT to_regclass('stock_price_bars_legacy') IS NOT NULL")).scalar()
+            bounds = connection.execute(text(
+                "SELECT MIN(EXTRACT(YEAR FROM date))::int, MAX(EXTRACT(YEAR FROM date))::int FROM stock_prices"
+            )).first() if connection.execute(text("SELECT to_regclass('stock_prices') IS NOT NULL")).scalar() else None
+
+            first_year = date.today().year
+            if bounds and bounds[0]:
+                first_year = min(first_year, bounds[0])
+            if legacy:
+                legacy_first = connection.execute(text(
+                    "SELECT MIN(EXTRACT(YEAR FROM date))::int FROM stock_price_bars_legacy"
+                )).scalar()
+                if legacy_first:
+                    first_year = min(first_year, legacy_first)
+            _ensure_years(connection, range(first_year, date.today().year + 2))
+
+            if legacy:
+                connection.execute(text(
+                    "INSERT INTO stock_price_bars SELECT stock_id, date, open_price, high_price, low_price, "
+                    "close_price, adj_close, volume FROM stock_price_bars_legacy ON CONFLICT DO NOTHING"
+                ))
+                # 首次改建时从旧表回填，之后旧表仍可在 legacy 模式下使用
+                backfilled = connection.execute(text(
+                    "INSERT INTO stock_price_bars (stock_id, date, open_price, high_price, low_price, "
+                    "close_price, adj_close, volume) "
+                    "SELECT DISTINCT ON (stock_id, date) stock_id, date, open_price::float8, high_price::float8, "
+                    "low_price::float8, close_price::float8, adj_close::float8, volume::bigint "
+                    "FROM stock_prices WHERE stock_id IS NOT NULL AND date IS NOT NULL "
+                    "ORDER BY stock_id, date, id DESC "
+                    "ON CONFLICT DO NOTHING"
+                )).rowcount
+                connection.execute(text("DROP TABLE stock_price_bars_legacy"))
+                logger.info(f"已创建按年分区的 stock_price_bars，从 stock_prices 回填 {backfilled} 行")
+    except Exception as e:
+        _known_years.clear()
+        logger.error(f"初始化价格分区表失败: {e}")
+
+def _bar_rows(stock_id: int, data: pd.DataFrame) -> List[Dict[str, Any]]:
+    """把 yfinance 的历史数据转为入库的行"""
+    if data is None or data.empty:
+        return []
+    # 按列整体转换，避免逐行 iterrows
+    dates = [d.date() if hasattr(d, "date") else d for d in data.index]
+    close = data["Close"].astype(float).tolist()
+    adj_close = data["Adj Close"].astype(float).tolist() if "Adj Close" in data.columns else close
+    columns = zip(
+        dates,
+        data["Open"].astype(float).tolist(),
+        data["High"].astype(float).tolist(),
+        data["Low"].astype(float).tolist(),
+        close,
+        adj_close,
+        data["Volume"].fillna(0).astype("int64").tolist(),
+    )
+    return [
+        {"stock_id": stock_id, "date": d, "open_price": o, "high_price": h, "low_price": l,
+         "close_price": c, "adj_close": a, "volume": v}
+        for d, o, h, l, c, a, v in columns
+    ]
+
+class PriceStore(ABC):
+    """日K线存储接口"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    @abstractmethod
+    def save_bars(self, stock_id: int, data: pd.DataFrame, overwrite: bool = True) -> int:
+        """批量保存K线，返回写入的行数（不提交事务）
+
+        overwrite 为 False 时只插入库中还没有的日期，已有的K线保持不变。
+        """
+
+    @abstractmethod
+    def recent_closes(self, stock_id: int, limit: int) -> List[float]:
+        """最近 limit 个交易日的收盘价，按日期升序"""
+
+    @abstractmethod
+    def close_range(self, stock_id: int, start: date, end: Optional[date] = None) -> List[tuple]:
+        """日期区间内的 (日期, 收盘价)，按日期升序"""
+
+    @abstractmethod
+    def latest_date(self, symbol: str) -> Optional[date]:
+        """某只股票已入库的最新K线日期，没有数据时返回 None"""
+
+    @abstractmethod
+    def closes_since(self, start: date, stock_ids: Optional[List[int]] = None) -> Dict[int, List[float]]:
+        """所有股票（或 stock_ids 中的股票）自 start 起的收盘价，按日期升序，用于一次性加载价格面板"""
+
+class LegacyPriceStore(PriceStore):
+    """使用原 stock_prices 表（Numeric价格，代理主键）"""
+
+    def save_bars(self, stock_id: int, data: pd.DataFrame, overwrite: bool = True) -> int:
+        rows = _bar_rows(stock_id, data)
+        if not rows:
+            return 0
+        # stock_prices 上没有唯一约束，已有日期一律不覆盖（overwrite 不影响结果）；先一次性查出已有日期再批量插入缺失的行
+        existing = {
+            d for (d,) in self.session.query(StockPrice.date).filter(
+                StockPrice.stock_id == stock_id,
+                StockPrice.date >= min(r["date"] for r in rows),
+                StockPrice.date <= max(r["date"] for r in rows)
+            )
+        }
+        rows = [r for r in rows if r["date"] not in existing]
+        for start in range(0, len(rows), PRICE_INSERT_CHUNK):
+            self.session.execute(insert(StockPrice), rows[start:start + PRICE_INSERT_CHUNK])
+        return len(rows)
+
+    def recent_closes(self, stock_id: int, limit: int) -> List[float]:
+        rows = self.session.query(StockPrice.close_price).filter(
+            StockPrice.stock_id == stock_id
+        ).order_by(StockPrice.date.desc()).limit(limit).all()
+        return [float(close) for (close,) in reversed(rows)]
+
+    def close_range(self, stock_id: int, start: date, end: Optional[date] = None) -> List[tuple]:
+        query = self.session.query(StockPrice.date, StockPrice.close_price).filter(
+            StockPrice.stock_id == stock_id, StockPrice.date >= start
+        )
+        if end:
+            query = query.filter(StockPrice.date <= end)
+        return [(d, float(close)) for d, close in query.order_by(StockPrice.date).all()]
+
+    def latest_date(self, symbol: str) -> Optional[date]:
+        return self.session.query(func.max(StockPrice.date)).join(
+            Stock, Stock.id == StockPrice.stock_id
+        ).filter(Stock.symbol == symbol).scalar()
+
+    def closes_since(self, start: date, stock_ids: Optional[List[int]] = None) -> Dict[int, List[float]]:
+        panel: Dict[int, List[float]] = {}
+        rows = self.session.query(StockPrice.stock_id, StockPrice.close_price).filter(StockPrice.date >= start)
+        if stock_ids is not None:
+            rows = rows.filter(StockPrice.stock_id.in_(stock_ids))
+        rows = rows.order_by(StockPrice.stock_id, StockPrice.date)
+        for stock_id, close in rows:
+            panel.setdefault(stock_id, []).append(float(close))
+        return panel
+
+class CompactPriceStore(PriceStore):
+    """使用 stock_price_bars 表（float8价格，(stock_id, date) 主键，按年分区）"""
+
+    def _ensure_partitions(self, rows: List[Dict[str, Any]]):
+        years = {r["date"].year for r in rows} - _known_years
+        if not years or not is_postgresql(self.session):
+            return
+        if not self.session.execute(IS_PARTITIONED_SQL).scalar():
+            _known_years.update(years)
+            return
+        for year in sorted(years):
+            exists = self.session.execute(
+                text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f"{PARTITION_PREFIX}{year}"}
+            ).scalar()
+            if exists:
+                _known_years.add(year)
+            else:
+                # 在当前事务中创建，随本次写入一起提交
+                self.session.execute(_create_partition_sql(year))
+
+    def save_bars(self, stock_id: int, data: pd.DataFrame, overwrite: bool = True) -> int:
+        rows = _bar_rows(stock_id, data)
+        if not rows:
+            return 0
+        self._ensure_partitions(rows)
+        if not overwrite:
+            return self._insert_missing(stock_id, rows)
+        # 已存在的日期用最新数据覆盖（当日K线在收盘前会变化）
+        for start in range(0, len(rows), PRICE_INSERT_CHUNK):
+            upsert_rows(self.session, StockPriceBar, rows[start:start + PRICE_INSERT_CHUNK],
+                        index_elements=["stock_id", "date"])
+        return len(rows)
+
+    def _insert_missing(self, stock_id: int, rows: List[Dict[str, Any]]) -> int:
+        """只插入还没有的日期：PostgreSQL/SQLite 用 ON CONFLICT DO NOTHING，其他数据库先查已有日期"""
+        dialect = self.session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(StockPriceBar.__table__).on_conflict_do_nothing(index_elements=["stock_id", "date"])
+            # 逐行执行以得到实际插入的行数（该路径只用于补入少量K线）
+            return sum(self.session.execute(stmt, row).rowcount or 0 for row in rows)
+        existing = {
+            d for (d,) in self.session.query(StockPriceBar.date).filter(
+                StockPriceBar.stock_id == stock_id,
+                StockPriceBar.date.in_([r["date"] for r in rows])
+            )
+        }
+        rows = [r for r in rows if r["date"] not in existing]
+        for start in range(0, len(rows), PRICE_INSERT_CHUNK):
+            self.session.execute(insert(StockPriceBar), rows[start:start + PRICE_INSERT_CHUNK])
+        return len(rows)
+
+    def recent_closes(self, stock_id: int, limit: int) -> List[float]:
+        rows = self.session.query(StockPriceBar.close_price).filter(
+            StockPriceBar.stock_id == stock_id
+        ).order_by(StockPriceBar.date.desc()).limit(limit).all()
+        return [close for (close,) in reversed(rows)]
+
+    def close_range(self, stock_id: int, start: date, end: Optional[date] = None) -> List[tuple]:
+        query = self.session.query(StockPriceBar.date, StockPriceBar.close_price).filter(
+            StockPriceBar.stock_id == stock_id, StockPriceBar.date >= start
+        )
+        if end:
+            query = query.filter(StockPriceBar.date <= end)
+        return [tuple(row) for row in query.order_by(StockPriceBar.date).all()]
+
+    def latest_date(self, symbol: str) -> Optional[date]:
+        return self.session.query(func.max(StockPriceBar.date)).join(
+            Stock, Stock.id == StockPriceBar.stock_id
+        ).filter(Stock.symbol == symbol).scalar()
+
+    def closes_since(self, start: date, stock_ids: Optional[List[int]] = None) -> Dict[int, List[float]]:
+        panel: Dict[int, List[float]] = {}
+        rows = self.session.query(StockPriceBar.stock_id, StockPriceBar.close_price).filter(StockPriceBar.date >= start)
+        if stock_ids is not None:
+            rows = rows.filter(StockPriceBar.stock_id.in_(stock_ids))
+        rows = rows.order_by(StockPriceBar.stock_id, StockPriceBar.date)
+        for stock_id, close in rows:
+            panel.setdefault(stock_id, []).append(close)
+        return panel
+
+def get_price_store(session: Session, mode: str = None) -> PriceStore:
+    """按 PRICE_STORAGE 返回价格存储"""
+    mode = mode or PRICE_STORAGE
+    if mode == "legacy":
+        return LegacyPriceStore(session)
+    return CompactPriceStore(session)
+
+class PricePanel:
+    """进程内的最近收盘价面板
+
+    一条查询加载所有股票最近 days 个自然日的收盘价，超过 ttl 秒后视为过期，
+    过期或未收录的股票返回 None，由调用方回退到逐只查询。
+    """
+
+    def __init__(self, days: int = PRICE_PANEL_DAYS, ttl: float = PRICE_PANEL_TTL):
+        self.days = days
+        self.ttl = ttl
+        self.closes: Dict[int, List[float]] = {}
+        self.loaded_at = 0.0
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.loaded_at > self.ttl
+
+    def load(self, session: Session) -> int:
+        """重新加载面板，返回收录的股票数"""
+        self.closes = get_price_store(session).closes_since(date.today() - timedelta(days=self.days))
+        self.loaded_at = time.time()
+        return len(self.closes)
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+
+    def recent_closes(self, stock_id: int, limit: int) -> Optional[List[float]]:
+        if self.stale or stock_id not in self.closes:
+            return None
+        return self.closes[stock_id][-limit:]
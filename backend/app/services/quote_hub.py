@@ -0,0 +1,348 @@
+"""实时报价的轮询与推送
+
+页面不再各自通过 get_stock_info（yf.Ticker().info）取当前价，而是通过 WebSocket 订阅报价：
+- 每个 API 进程一个 QuoteHub，有订阅时才运行轮询协程，每 QUOTE_POLL_SECONDS 秒对所有连接
+  订阅的股票并集各取一次报价，行情源调用次数只和股票数有关，和观看人数无关；
+- 多个进程订阅同一只股票时，每个周期通过 Redis 的 SET NX 抢轮询权，抢到的进程调用行情源并把
+  报价写入 Redis，其余进程直接读取；Redis 不可用时各进程自行轮询；
+- 只推送有变化的报价。每个连接有一个按股票合并的待发送区，发送慢时同一股票只保留最新一条，
+  单次发送超过 QUOTE_SEND_TIMEOUT 秒的连接被断开，不会拖慢其他连接。
+
+QUOTE_FEED=replay 时使用回放行情（离线开发和压测）：QUOTE_REPLAY_DIR 下有 {代码}.csv 时
+按收盘价逐行循环回放，否则按代码生成确定的随机游走。
+"""
+import os
+import json
+import zlib
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+import redis
+from fastapi import WebSocket
+from ..lazy_imports import lazy_import
+from ..redis_client import get_redis, mark_redis_unavailable
+from .stock_service import get_quote
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# 报价来源：yfinance 或 replay（回放）
+QUOTE_FEED = os.getenv("QUOTE_FEED", "yfinance")
+# 轮询间隔（秒）
+QUOTE_POLL_SECONDS = float(os.getenv("QUOTE_POLL_SECONDS", "15"))
+# 回放数据目录，文件格式与 benchmarks 的 --bars-dir 相同
+QUOTE_REPLAY_DIR = os.getenv("QUOTE_REPLAY_DIR", "")
+# 单个周期内同时请求行情源的股票数
+QUOTE_FETCH_CONCURRENCY = int(os.getenv("QUOTE_FETCH_CONCURRENCY", "8"))
+# 单个连接最多订阅的股票数
+QUOTE_MAX_SYMBOLS_PER_CONNECTION = int(os.getenv("QUOTE_MAX_SYMBOLS_PER_CONNECTION", "50"))
+# 单次发送的超时时间（秒），超时的连接被断开
+QUOTE_SEND_TIMEOUT = float(os.getenv("QUOTE_SEND_TIMEOUT", "5"))
+# 单个连接待发送的控制消息（订阅确认、错误提示）上限，超出时丢弃最早的
+QUOTE_MAX_CONTROL_MESSAGES = int(os.getenv("QUOTE_MAX_CONTROL_MESSAGES", "100"))
+
+LATEST_KEY_PREFIX = "quote:latest:"
+POLL_KEY_PREFIX = "quote:poll:"
+
+class YFinanceFeed:
+    """通过 yfinance 的 fast_info 取报价"""
+
+    name = "yfinance"
+
+    def fetch(self, symbol: str) -> Optional[Dict[str, Any]]:
+        return get_quote(symbol)
+
+class ReplayFeed:
+    """回放行情，每次调用前进一步"""
+
+    name = "replay"
+
+    def __init__(self, directory: str = QUOTE_REPLAY_DIR):
+        self.directory = Path(directory) if directory else None
+        self._series: Dict[str, Any] = {}
+        self._steps: Dict[str, int] = {}
+        self._walks: Dict[str, random.Random] = {}
+        self._prices: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, symbol: str):
+        path = self.directory / f"{symbol}.csv" if self.directory else None
+        if path is None or not path.exists():
+            return None
+        bars = pd.read_csv(path, index_col=0)
+        if bars.empty or "Close" not in bars:
+            return None
+        volumes = bars["Volume"] if "Volume" in bars else pd.Series(0, index=bars.index)
+        return list(zip(bars["Close"].astype(float), volumes.fillna(0).astype(int)))
+
+    def fetch(self, symbol: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if symbol not in self._series:
+                self._series[symbol] = self._load(symbol)
+            series = self._series[symbol]
+            step = self._steps.get(symbol, 0)
+            self._steps[symbol] = step + 1
+            if series:
+                price, volume = series[step % len(series)]
+                previous_close = series[(step - 1) % len(series)][0]
+            else:
+                walk = self._walks.setdefault(symbol, random.Random(zlib.crc32(symbol.encode("utf-8"))))
+                previous_close = self._prices.get(symbol) or walk.uniform(20, 500)
+                price = max(previous_close * (1 + walk.gauss(0, 0.002)), 0.01)
+                volume = walk.randint(1_000, 100_000)
+                self._prices[symbol] = price
+        change = price - previous_close
+        return {
+            "symbol": symbol,
+            "price": round(price, 4),
+            "previous_close": round(previous_close, 4),
+            "change": round(change, 4),
+            "change_percent": round(change / previous_close * 100, 2) if previous_close else 0.0,
+            "volume": int(volume),
+            "timestamp": datetime.now().isoformat()
+        }
+
+def create_feed(name: str = QUOTE_FEED):
+    if name == "replay":
+        return ReplayFeed()
+    return YFinanceFeed()
+
+def _changed(previous: Optional[Dict[str, Any]], quote: Dict[str, Any]) -> bool:
+    if previous is None:
+        return True
+    return previous["price"] != quote["price"] or previous["volume"] != quote["volume"]
+
+class QuoteConnection:
+    """一个 WebSocket 连接：订阅的股票和待发送的报价
+
+    只有发送协程向 WebSocket 写入；待发送区按股票合并，客户端跟不上时旧报价被新报价覆盖。
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.symbols: Set[str] = set()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.control: deque = deque(maxlen=QUOTE_MAX_CONTROL_MESSAGES)
+        self.coalesced = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+
+    def start(self, on_slow):
+        self._sender = asyncio.create_task(self._send_loop(on_slow))
+
+    def offer(self, quote: Dict[str, Any]):
+        if self.closed:
+            return
+        if quote["symbol"] in self.pending:
+            self.coalesced += 1
+        self.pending[quote["symbol"]] = quote
+        self._wakeup.set()
+
+    def reply(self, message: Dict[str, Any]):
+        if self.closed:
+            return
+        self.control.append(message)
+        self._wakeup.set()
+
+    async def _send_loop(self, on_slow):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                messages = list(self.control)
+                self.control.clear()
+                if self.pending:
+                    messages.append({"type": "quotes", "data": self.pending})
+                    self.pending = {}
+                for message in messages:
+                    await asyncio.wait_for(self.websocket.send_json(message), QUOTE_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # 先发送关闭帧再注销；close() 不会取消正在执行的发送协程本身
+            logger.warning(f"报价推送超时，断开连接: {sorted(self.symbols)[:5]}")
+            self.closed = True
+            try:
+                await asyncio.wait_for(self.websocket.close(code=1013), QUOTE_SEND_TIMEOUT)
+            except Exception:
+                pass
+            on_slow(self)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 客户端已断开，由接收循环清理
+            self.closed = True
+            logger.debug(f"报价推送失败: {e}")
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+        self.control.clear()
+        if self._sender is not None and not self._sender.done() and self._sender is not asyncio.current_task():
+            self._sender.cancel()
+
+class QuoteHub:
+    """本进程所有报价连接的订阅、轮询和分发，只在事件循环线程上修改状态"""
+
+    def __init__(self, feed=None, poll_seconds: float = QUOTE_POLL_SECONDS):
+        self.feed = feed or create_feed()
+        self.poll_seconds = poll_seconds
+        self.connections: Set[QuoteConnection] = set()
+        self.subscribers: Dict[str, Set[QuoteConnection]] = {}
+        self.latest: Dict[str, Dict[str, Any]] = {}
+        self.provider_calls = 0
+        self.shared_reads = 0
+        self.polls = 0
+        self.slow_disconnects = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def connect(self, websocket: WebSocket) -> QuoteConnection:
+        connection = QuoteConnection(websocket)
+        connection.start(self._on_slow)
+        self.connections.add(connection)
+        return connection
+
+    def disconnect(self, connection: QuoteConnection):
+        connection.close()
+        self.connections.discard(connection)
+        self.unsubscribe(connection, list(connection.symbols))
+
+    def _on_slow(self, connection: QuoteConnection):
+        self.slow_disconnects += 1
+        self.disconnect(connection)
+
+    def subscribe(self, connection: QuoteConnection, symbols: Iterable[str]) -> List[str]:
+        """订阅股票，超出单连接上限的部分被忽略；已有报价的股票立即推送一次；已关闭的连接不再订阅"""
+        if connection.closed:
+            return []
+        added = []
+        for symbol in symbols:
+            symbol = symbol.strip().upper()
+            if not symbol or symbol in connection.symbols:
+                continue
+            if len(connection.symbols) >= QUOTE_MAX_SYMBOLS_PER_CONNECTION:
+                break
+            connection.symbols.add(symbol)
+            self.subscribers.setdefault(symbol, set()).add(connection)
+            added.append(symbol)
+            if symbol in self.latest:
+                connection.offer(self.latest[symbol])
+        if added:
+            self._ensure_polling()
+        return added
+
+    def unsubscribe(self, connection: QuoteConnection, symbols: Iterable[str]):
+        for symbol in symbols:
+            symbol = symbol.strip().upper()
+            connection.symbols.discard(symbol)
+            subscribers = self.subscribers.get(symbol)
+            if subscribers is None:
+                continue
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.subscribers[symbol]
+                self.latest.pop(symbol, None)
+
+    def _ensure_polling(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            started = loop.time()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"轮询报价失败: {e}")
+            await asyncio.sleep(max(self.poll_seconds - (loop.time() - started), 0.1))
+
+    async def poll_once(self):
+        """取一轮报价并把有变化的推送给订阅者"""
+        symbols = list(self.subscribers)
+        if not symbols:
+            return
+        semaphore = asyncio.Semaphore(QUOTE_FETCH_CONCURRENCY)
+
+        async def refresh(symbol: str):
+            async with semaphore:
+                return await asyncio.to_thread(self._refresh, symbol)
+
+        results = await asyncio.gather(*(refresh(symbol) for symbol in symbols), return_exceptions=True)
+        self.polls += 1
+        for symbol, quote in zip(symbols, results):
+            if isinstance(quote, Exception):
+                logger.error(f"获取报价失败 {symbol}: {quote}")
+                continue
+            # 等待期间所有订阅者都已离开
+            if not quote or symbol not in self.subscribers:
+                continue
+            if not _changed(self.latest.get(symbol), quote):
+                continue
+            self.latest[symbol] = quote
+            for connection in list(self.subscribers[symbol]):
+                connection.offer(quote)
+
+    def _refresh(self, symbol: str) -> Optional[Dict[str, Any]]:
+        """在线程池中执行：抢到本周期轮询权时调用行情源并写入 Redis，否则读取其他进程写入的报价"""
+        client = get_redis()
+        if client is not None:
+            try:
+                claimed = client.set(POLL_KEY_PREFIX + symbol, os.getpid(), nx=True,
+                                     px=max(int(self.poll_seconds * 1000) - 200, 100))
+                if not claimed:
+                    cached = client.get(LATEST_KEY_PREFIX + symbol)
+                    self.shared_reads += 1
+                    return json.loads(cached) if cached else None
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+                client = None
+        self.provider_calls += 1
+        quote = self.feed.fetch(symbol)
+        if quote and client is not None:
+            try:
+                client.setex(LATEST_KEY_PREFIX + symbol, max(int(self.poll_seconds * 4), 60), json.dumps(quote))
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+        return quote
+
+    def snapshot(self, symbols: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """已知的最新报价：本进程的，或其他进程写入 Redis 的；不触发轮询"""
+        result = {}
+        missing = []
+        for symbol in symbols:
+            symbol = symbol.strip().upper()
+            if symbol in self.latest:
+                result[symbol] = self.latest[symbol]
+            elif symbol:
+                missing.append(symbol)
+        client = get_redis() if missing else None
+        if client is not None:
+            try:
+                for symbol, cached in zip(missing, client.mget([LATEST_KEY_PREFIX + s for s in missing])):
+                    if cached:
+                        result[symbol] = json.loads(cached)
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "feed": self.feed.name,
+            "poll_seconds": self.poll_seconds,
+            "polling": self._task is not None and not self._task.done(),
+            "connections": len(self.connections),
+            "symbols": len(self.subscribers),
+            "polls": self.polls,
+            "provider_calls": self.provider_calls,
+            "shared_reads": self.shared_reads,
+            "coalesced": sum(c.coalesced for c in self.connections),
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+quote_hub = QuoteHub()
@@ -0,0 +1,225 @@
+"""推荐汇总的增量维护
+
+行业分析和风险分析接口只需要未过期推荐按行业、风险等级、推荐类型分组的条数和平均分。
+这些汇总保存在 recommendation_rollups 表中：
+- 保存推荐（单只或批量）时在同一事务里扣除被替换的旧推荐、计入新推荐；
+- 过期清扫按水位线（上次清扫到的时间）扫描 (水位线, 现在] 之间过期的推荐并扣除，再推进水位线；
+- 重建按原始表整体重新统计，用于初始化和定期校正（例如股票的行业变更后旧推荐仍计在原行业下）。
+
+写入、清扫和重建都先锁住水位线所在的行，三者互相串行，保证每条推荐只被计入和扣除一次。
+读取时如果水位线落后超过 ROLLUP_MAX_LAG_SECONDS（定时任务没有运行），先在本次请求中清扫。
+接口缓存的版本取自汇总行本身（version），只有汇总内容变化时才变化，读取代价与推荐条数无关。
+"""
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import RecommendationRollup, Stock, StockRecommendation
+
+logger = logging.getLogger(__name__)
+
+# 读取汇总时允许的最大清扫延迟（秒），超过时在读取前清扫一次
+ROLLUP_MAX_LAG_SECONDS = int(os.getenv("ROLLUP_MAX_LAG_SECONDS", "120"))
+
+DIMENSIONS = ("sector", "risk_level", "recommendation_type")
+META_DIMENSION = "_meta"
+WATERMARK_KEY = "expired_until"
+
+def _dimension_keys(sector: Optional[str], risk_level: Optional[str], recommendation_type: Optional[str]):
+    # 空值用空字符串作为键，读取时还原为 None
+    return (("sector", sector or ""), ("risk_level", risk_level or ""),
+            ("recommendation_type", recommendation_type or ""))
+
+def _insert(session: Session):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(RecommendationRollup)
+
+class RecommendationRollupStore:
+    """recommendation_rollups 表的读写"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _watermark(self, lock: bool = True) -> Optional[RecommendationRollup]:
+        query = self.session.query(RecommendationRollup).filter(
+            RecommendationRollup.dimension == META_DIMENSION,
+            RecommendationRollup.key == WATERMARK_KEY
+        )
+        return query.with_for_update().first() if lock else query.first()
+
+    def _add(self, delta: Dict[Tuple[str, str], List[float]], rows: Iterable[Tuple[Any, ...]], sign: int):
+        for sector, risk_level, recommendation_type, score in rows:
+            for key in _dimension_keys(sector, risk_level, recommendation_type):
+                delta[key][0] += sign
+                delta[key][1] += sign * float(score or 0)
+
+    def _apply(self, delta: Dict[Tuple[str, str], List[float]]):
+        """把增量累加到汇总行，按主键顺序更新以免并发事务互相死锁"""
+        now = datetime.now()
+        rows = [
+            {"dimension": dimension, "key": key, "count": int(count), "score_sum": score_sum, "updated_at": now}
+            for (dimension, key), (count, score_sum) in sorted(delta.items()) if count or score_sum
+        ]
+        if not rows:
+            return
+        stmt = _insert(self.session)
+        if stmt is None:
+            for row in rows:
+                existing = self.session.get(RecommendationRollup, (row["dimension"], row["key"]), with_for_update=True)
+                if existing is None:
+                    self.session.add(RecommendationRollup(**row))
+                else:
+                    existing.count += row["count"]
+                    existing.score_sum += row["score_sum"]
+                    existing.updated_at = now
+            return
+        table = RecommendationRollup.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["dimension", "key"],
+            set_={
+                "count": table.c.count + stmt.excluded.count,
+                "score_sum": table.c.score_sum + stmt.excluded.score_sum,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+        self.session.execute(stmt, rows)
+
+    def replace(self, sectors: Dict[int, Optional[str]], rows: List[Dict[str, Any]]):
+        """用新推荐替换这些股票的全部旧推荐并更新汇总，不提交事务
+
+        sectors 为 {stock_id: 行业}，rows 为待插入的推荐行；旧推荐一次删除，新推荐一次批量插入。
+        """
+        watermark = self._watermark()
+        stock_ids = list(sectors)
+        old = self.session.query(
+            StockRecommendation.stock_id, StockRecommendation.risk_level,
+            StockRecommendation.recommendation_type, StockRecommendation.score, StockRecommendation.expires_at
+        ).filter(StockRecommendation.stock_id.in_(stock_ids)).all()
+        self.session.query(StockRecommendation).filter(
+            StockRecommendation.stock_id.in_(stock_ids)
+        ).delete(synchronize_session=False)
+        if rows:
+            self.session.execute(insert(StockRecommendation), rows)
+        # 汇总尚未建立时不做增量，下一次读取会整体重建
+        if watermark is None:
+            return
+        delta = defaultdict(lambda: [0, 0.0])
+        # 只有过期时间晚于水位线的推荐仍计在汇总中（已清扫的不能重复扣除）
+        self._add(delta, [
+            (sectors.get(rec.stock_id), rec.risk_level, rec.recommendation_type, rec.score)
+            for rec in old if rec.expires_at and rec.expires_at > watermark.updated_at
+        ], -1)
+        self._add(delta, [
+            (sectors.get(row["stock_id"]), row.get("risk_level"), row.get("recommendation_type"), row.get("score"))
+            for row in rows if row.get("expires_at") and row["expires_at"] > watermark.updated_at
+        ], 1)
+        self._apply(delta)
+
+    def _source_rows(self):
+        return self.session.query(
+            Stock.sector, StockRecommendation.risk_level,
+            StockRecommendation.recommendation_type, StockRecommendation.score
+        ).select_from(StockRecommendation).outerjoin(Stock, StockRecommendation.stock_id == Stock.id)
+
+    def sweep_expired(self, now: Optional[datetime] = None) -> int:
+        """扣除上次清扫之后过期的推荐并推进水位线，返回扣除的条数"""
+        now = now or datetime.now()
+        watermark = self._watermark()
+        if watermark is None:
+            self.rebuild(now)
+            return 0
+        if now <= watermark.updated_at:
+            self.session.commit()
+            return 0
+        expired = self._source_rows().filter(
+            StockRecommendation.expires_at > watermark.updated_at,
+            StockRecommendation.expires_at <= now
+        ).all()
+        delta = defaultdict(lambda: [0, 0.0])
+        self._add(delta, expired, -1)
+        self._apply(delta)
+        watermark.updated_at = now
+        self.session.commit()
+        return len(expired)
+
+    def rebuild(self, now: Optional[datetime] = None) -> int:
+        """按推荐表重新统计全部汇总，返回计入的推荐条数"""
+        now = now or datetime.now()
+        stmt = _insert(self.session)
+        if stmt is not None:
+            self.session.execute(stmt.on_conflict_do_nothing(index_elements=["dimension", "key"]), [
+                {"dimension": META_DIMENSION, "key": WATERMARK_KEY, "count": 0, "score_sum": 0, "updated_at": now}
+            ])
+        watermark = self._watermark()
+        if watermark is None:
+            watermark = RecommendationRollup(dimension=META_DIMENSION, key=WATERMARK_KEY, count=0, score_sum=0)
+            self.session.add(watermark)
+
+        self.session.query(RecommendationRollup).filter(
+            RecommendationRollup.dimension != META_DIMENSION
+        ).delete(synchronize_session=False)
+        active = self._source_rows().filter(StockRecommendation.expires_at > now).all()
+        delta = defaultdict(lambda: [0, 0.0])
+        self._add(delta, active, 1)
+        self._apply(delta)
+        watermark.updated_at = now
+        self.session.commit()
+        logger.info(f"重建推荐汇总: {len(active)} 条未过期推荐")
+        return len(active)
+
+    def sync(self):
+        """汇总尚未建立时重建；水位线落后超过 ROLLUP_MAX_LAG_SECONDS 时先清扫"""
+        watermark = self._watermark(lock=False)
+        if watermark is None:
+            self.rebuild()
+        elif (datetime.now() - watermark.updated_at).total_seconds() > ROLLUP_MAX_LAG_SECONDS:
+            self.sweep_expired()
+
+    def version(self) -> str:
+        """汇总数据的版本：汇总行的最近更新时间和行数
+
+        写入、扣除过期和重建都会更新所涉及行的 updated_at；水位线本身不计入，
+        没有推荐过期的清扫不改变版本。调用前应先 sync()，使版本和随后读取的内容一致。
+        """
+        latest, rows = self.session.query(
+            func.max(RecommendationRollup.updated_at), func.count()
+        ).filter(RecommendationRollup.dimension != META_DIMENSION).one()
+        return f"rollup:{latest.isoformat() if latest else '-'}:{rows}"
+
+    def snapshot(self, sync: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """各维度的 [{"key", "count", "average_score"}]，只包含仍有推荐的分组"""
+        if sync:
+            self.sync()
+
+        result: Dict[str, List[Dict[str, Any]]] = {dimension: [] for dimension in DIMENSIONS}
+        rows = self.session.query(RecommendationRollup).filter(
+            RecommendationRollup.dimension.in_(DIMENSIONS),
+            RecommendationRollup.count > 0
+        ).all()
+        for row in rows:
+            result[row.dimension].append({
+                "key": row.key or None,
+                "count": row.count,
+                "average_score": row.score_sum / row.count,
+            })
+        return result
+
+def ensure_recommendation_rollups(engine):
+    """为已存在的推荐表补建过期时间索引，并按现有推荐重建汇总"""
+    for index in StockRecommendation.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    session = SessionLocal()
+    try:
+        RecommendationRollupStore(session).rebuild()
+    finally:
+        session.close()
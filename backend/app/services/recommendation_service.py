@@ -1,9 +1,10 @@
-import numpy as np
-import pandas as pd
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from ..models import Stock, AIAnalysis, StockRecommendation, StockPrice
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import Session, contains_eager
+from ..models import Stock, StockRecommendation
+from .price_store import PRICE_PANEL_DAYS, PricePanel, get_price_store
+from .analysis_store import AnalysisStore
+from .recommendation_rollup import RecommendationRollupStore
 from ..database import SessionLocal
 import logging
 
@@ -12,8 +13,9 @@ logger = logging.getLogger(__name__)
 class RecommendationService:
     """推荐算法服务"""
     
-    def __init__(self):
+    def __init__(self, price_panel: Optional[PricePanel] = None):
         self.session = SessionLocal()
+        self.price_panel = price_panel
         self.weights = {
             "technical_score": 0.3,
             "fundamental_score": 0.4,
@@ -147,16 +149,45 @@ class RecommendationService:
             stock = self.session.query(Stock).filter(Stock.symbol == symbol).first()
             if not stock:
                 return 0.5
-            
-            recent_prices = self.session.query(StockPrice).filter(
-                StockPrice.stock_id == stock.id
-            ).order_by(StockPrice.date.desc()).limit(30).all()
-            
-            if len(recent_prices) < 10:
+            return self.momentum_from_prices(self._recent_closes(stock.id), symbol)
+        except Exception as e:
+            logger.error(f"计算动量评分失败 {symbol}: {e}")
+            return 0.5
+
+    def _recent_closes(self, stock_id: int) -> List[float]:
+        """最近30个交易日的收盘价（按日期升序），worker 中优先使用进程内价格面板"""
+        prices = self.price_panel.recent_closes(stock_id, 30) if self.price_panel else None
+        if prices is None:
+            prices = get_price_store(self.session).recent_closes(stock_id, 30)
+        return prices
+
+    def _recent_closes_for(self, stock_ids: List[int], fallback: bool = True) -> Dict[int, List[float]]:
+        """多只股票最近30个交易日的收盘价，一次查询加载
+
+        fallback 为 False 时不再逐只查询窗口内没有行情的股票，这些股票的收盘价为空（动量按中性计）。
+        """
+        if self.price_panel and not self.price_panel.stale:
+            closes = {stock_id: self.price_panel.recent_closes(stock_id, 30) for stock_id in stock_ids}
+            closes = {stock_id: prices for stock_id, prices in closes.items() if prices is not None}
+        else:
+            start = date.today() - timedelta(days=PRICE_PANEL_DAYS)
+            closes = {
+                stock_id: prices[-30:]
+                for stock_id, prices in get_price_store(self.session).closes_since(start, stock_ids=stock_ids).items()
+            }
+        # 面板窗口内没有行情的股票（如长期停牌）逐只回退查询
+        for stock_id in stock_ids if fallback else []:
+            if stock_id not in closes:
+                closes[stock_id] = get_price_store(self.session).recent_closes(stock_id, 30)
+        return closes
+
+    def momentum_from_prices(self, prices: List[float], symbol: str = "") -> float:
+        """根据按日期升序的收盘价计算动量评分"""
+        try:
+            if len(prices) < 10:
                 return 0.5
             
             # 计算不同时间段的收益率
-            prices = [float(p.close_price) for p in reversed(recent_prices)]
             
             # 1周、2周、1月收益率
             returns = {}
@@ -197,11 +228,19 @@ class RecommendationService:
             if not stock:
                 return {"error": "股票不存在"}
             
-            recent_analyses = self.session.query(AIAnalysis).filter(
-                AIAnalysis.stock_id == stock.id,
-                AIAnalysis.created_at >= datetime.now() - timedelta(days=1)
-            ).all()
+            recent_analyses = AnalysisStore(self.session).latest_for_stock(
+                stock.id, since=datetime.now() - timedelta(days=1)
+            )
+            momentum = self.momentum_from_prices(self._recent_closes(stock.id), symbol)
+            return self._build_score(symbol, recent_analyses, momentum)
             
+        except Exception as e:
+            logger.error(f"生成股票评分失败 {symbol}: {e}")
+            return {"error": str(e), "symbol": symbol}
+
+    def _build_score(self, symbol: str, recent_analyses: List[Any], momentum: float) -> Dict[str, Any]:
+        """由已加载的分析结果和动量评分计算综合评分，不访问数据库"""
+        try:
             # 组织分析数据
             analysis_data = {}
             for analysis in recent_analyses:
@@ -235,7 +274,7 @@ class RecommendationService:
                 scores["sentiment_score"] = 0.5
             
             # 动量评分
-            scores["momentum_score"] = self.calculate_momentum_score(symbol)
+            scores["momentum_score"] = momentum
             
             # 计算综合评分
             total_score = sum(
@@ -274,20 +313,35 @@ class RecommendationService:
             logger.error(f"生成股票评分失败 {symbol}: {e}")
             return {"error": str(e), "symbol": symbol}
     
+    def score_stocks(self, stocks: List[Stock], fallback: bool = True) -> List[Dict[str, Any]]:
+        """批量计算多只股票的综合评分，与 stocks 一一对应
+
+        分析结果和收盘价按股票批量加载，避免每只股票各查一遍；fallback 含义同 _recent_closes_for。
+        """
+        stock_ids = [stock.id for stock in stocks]
+        analyses = AnalysisStore(self.session).latest_for_stocks(
+            stock_ids, since=datetime.now() - timedelta(days=1)
+        )
+        closes = self._recent_closes_for(stock_ids, fallback=fallback)
+        
+        scores = []
+        for stock in stocks:
+            momentum = self.momentum_from_prices(closes.get(stock.id, []), stock.symbol)
+            scores.append(self._build_score(stock.symbol, analyses.get(stock.id, []), momentum))
+        return scores
+
     def find_potential_stocks(self, limit: int = 10) -> List[Dict[str, Any]]:
         """寻找潜力股票"""
         try:
             # 获取所有有分析数据的股票
-            stocks_with_analysis = self.session.query(Stock).join(AIAnalysis).filter(
-                AIAnalysis.created_at >= datetime.now() - timedelta(days=1)
-            ).distinct().all()
-            
-            stock_scores = []
+            stocks_with_analysis = AnalysisStore(self.session).recently_analyzed_stocks(
+                since=datetime.now() - timedelta(days=1)
+            )
             
-            for stock in stocks_with_analysis:
-                score_data = self.generate_stock_score(stock.symbol)
-                if "error" not in score_data:
-                    stock_scores.append(score_data)
+            stock_scores = [
+                score_data for score_data in self.score_stocks(stocks_with_analysis)
+                if "error" not in score_data
+            ]
             
             # 按评分排序
             stock_scores.sort(key=lambda x: x["total_score"], reverse=True)
@@ -306,30 +360,46 @@ class RecommendationService:
             if not stock:
                 return False
             
-            # 删除旧的推荐
-            self.session.query(StockRecommendation).filter(
-                StockRecommendation.stock_id == stock.id
-            ).delete()
-            
-            # 创建新推荐
-            recommendation = StockRecommendation(
-                stock_id=stock.id,
-                recommendation_type=recommendation_data.get("recommendation"),
-                score=recommendation_data.get("total_score", 0),
-                reasoning=f"综合评分: {recommendation_data.get('total_score', 0):.3f}",
-                risk_level=recommendation_data.get("risk_level"),
-                time_horizon="medium",
-                expires_at=datetime.now() + timedelta(days=1)
-            )
-            
-            self.session.add(recommendation)
-            self.session.commit()
+            self.save_recommendations([stock], [recommendation_data])
             return True
             
         except Exception as e:
             logger.error(f"保存推荐失败 {symbol}: {e}")
             self.session.rollback()
             return False
+
+    def _recommendation_row(self, stock_id: int, recommendation_data: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        return {
+            "stock_id": stock_id,
+            "recommendation_type": recommendation_data.get("recommendation"),
+            "score": recommendation_data.get("total_score", 0),
+            "reasoning": f"综合评分: {recommendation_data.get('total_score', 0):.3f}",
+            "risk_level": recommendation_data.get("risk_level"),
+            "time_horizon": "medium",
+            "expires_at": now + timedelta(days=1),
+            "created_at": now,
+        }
+
+    def save_recommendations(self, stocks: List[Stock], score_list: List[Dict[str, Any]]) -> int:
+        """在一个事务中替换多只股票的推荐（旧推荐一次删除、新推荐一次批量插入），返回写入条数
+
+        评分出错的股票保留原有推荐；失败时回滚并抛出异常。
+        """
+        now = datetime.now()
+        pairs = [(stock, data) for stock, data in zip(stocks, score_list) if "error" not in data]
+        if not pairs:
+            return 0
+        try:
+            # 创建新推荐，替换旧推荐并在同一事务中更新汇总
+            RecommendationRollupStore(self.session).replace(
+                {stock.id: stock.sector for stock, _ in pairs},
+                [self._recommendation_row(stock.id, data, now) for stock, data in pairs]
+            )
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return len(pairs)
     
     def get_recommendations_by_criteria(self, 
                                       min_score: float = 0.6,
@@ -337,7 +407,10 @@ class RecommendationService:
                                       limit: int = 20) -> List[Dict[str, Any]]:
         """根据条件获取推荐"""
         try:
-            query = self.session.query(StockRecommendation).join(Stock).filter(
+            # 股票信息随推荐一起加载，避免逐条访问 rec.stock 时再查询
+            query = self.session.query(StockRecommendation).join(Stock).options(
+                contains_eager(StockRecommendation.stock)
+            ).filter(
                 StockRecommendation.score >= min_score,
                 StockRecommendation.expires_at > datetime.now()
             )
@@ -367,6 +440,10 @@ class RecommendationService:
             logger.error(f"获取推荐失败: {e}")
             return []
     
+    def close(self):
+        """释放数据库会话，会话对象下次使用时重新获取连接"""
+        self.session.close()
+    
     def __del__(self):
         if hasattr(self, 'session'):
             self.session.close()
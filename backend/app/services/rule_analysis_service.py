@@ -0,0 +1,346 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import logging
+import redis
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from ..redis_client import get_redis, mark_redis_unavailable
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_TYPES = ("technical", "fundamental", "sentiment", "recommendation")
+POLICY_MODES = ("rule", "llm", "llm_on_change")
+
+# 每种分析类型的执行策略：rule 本地规则，llm 每次调用模型，llm_on_change 信号变化时才调用模型
+ANALYSIS_POLICY = os.getenv("ANALYSIS_POLICY", "technical=rule")
+# llm_on_change 模式下记录的信号指纹和上次结果的保留时间（秒）
+ANALYSIS_SIGNAL_TTL = int(os.getenv("ANALYSIS_SIGNAL_TTL", str(24 * 3600)))
+
+SIGNAL_KEY_PREFIX = "analysis:signals:"
+
+# 目前只有技术分析有本地规则实现
+RULE_SUPPORTED_TYPES = {"technical"}
+
+# 分析结果中的元数据字段，作为下一步提示词输入和计算信号指纹时去掉
+ANALYSIS_METADATA_FIELDS = {"symbol", "analysis_type", "generated_at", "model_used", "batched", "reused", "reused_at"}
+
+# 信号指纹的分档边界：涨跌幅（%）、市盈率、股息率、Beta、52周区间位置
+PRICE_CHANGE_EDGES = (-5, -2, 0, 2, 5)
+PE_RATIO_EDGES = (0, 15, 25, 40)
+DIVIDEND_YIELD_EDGES = (0.01, 0.03, 0.05)
+BETA_EDGES = (0.8, 1.2, 1.5)
+RANGE_POSITION_EDGES = (0.2, 0.4, 0.6, 0.8)
+
+def parse_policy(spec: str) -> Dict[str, str]:
+    """解析 "technical=rule,sentiment=llm_on_change" 形式的策略配置，未配置的类型使用 llm"""
+    policy = {analysis_type: "llm" for analysis_type in ANALYSIS_TYPES}
+    for part in (spec or "").split(","):
+        analysis_type, _, mode = part.strip().partition("=")
+        analysis_type, mode = analysis_type.strip(), mode.strip()
+        if not analysis_type:
+            continue
+        if mode not in POLICY_MODES:
+            logger.warning(f"忽略无效的分析策略: {part}")
+            continue
+        if mode == "rule" and analysis_type not in RULE_SUPPORTED_TYPES:
+            logger.warning(f"{analysis_type} 没有规则实现，改为 llm_on_change")
+            mode = "llm_on_change"
+        policy[analysis_type] = mode
+    return policy
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _bucket(value: Any, edges: Tuple[float, ...]) -> Optional[int]:
+    """数值所在的档位（不小于的边界个数），无法解析时为 None"""
+    number = _number(value)
+    return None if number is None else sum(number >= edge for edge in edges)
+
+def strip_metadata(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉分析结果中的元数据字段"""
+    return {k: v for k, v in (analysis or {}).items() if k not in ANALYSIS_METADATA_FIELDS}
+
+class RuleBasedTechnicalAnalyzer:
+    """基于规则的技术分析
+
+    直接根据 calculate_technical_indicators 的结果（RSI区间、MACD柱方向、均线排列、
+    布林带位置）打分，输出与LLM技术分析相同结构的JSON。
+    """
+
+    model_name = "rule-based"
+
+    def _signals(self, data: Dict[str, Any]) -> Tuple[List[Tuple[str, float]], List[str]]:
+        """返回 ([(信号描述, 分值)], [风险因素])"""
+        price = _number(data.get("current_price"))
+        rsi = _number(data.get("rsi"))
+        macd = data.get("macd") or {}
+        averages = data.get("moving_averages") or {}
+        bands = data.get("bollinger_bands") or {}
+        ma5, ma20, ma50 = (_number(averages.get(k)) for k in ("MA5", "MA20", "MA50"))
+        histogram = _number(macd.get("histogram"))
+
+        signals: List[Tuple[str, float]] = []
+        risks: List[str] = []
+
+        if rsi is not None:
+            if rsi >= 70:
+                signals.append((f"RSI {rsi:.1f} 处于超买区", -1.0))
+                risks.append("RSI超买，存在回调风险")
+            elif rsi <= 30:
+                signals.append((f"RSI {rsi:.1f} 处于超卖区", 1.0))
+                risks.append("RSI超卖，下跌动能可能延续")
+            elif rsi >= 50:
+                signals.append((f"RSI {rsi:.1f} 位于强势区", 0.5))
+            else:
+                signals.append((f"RSI {rsi:.1f} 位于弱势区", -0.5))
+
+        if histogram is not None:
+            if histogram > 0:
+                signals.append(("MACD柱为正，动能向上", 1.0))
+            else:
+                signals.append(("MACD柱为负，动能向下", -1.0))
+
+        if price is not None and ma20 is not None:
+            if price >= ma20:
+                signals.append(("价格位于20日均线上方", 1.0))
+            else:
+                signals.append(("价格跌破20日均线", -1.0))
+        if ma5 is not None and ma20 is not None:
+            if ma5 >= ma20:
+                signals.append(("5日均线在20日均线上方", 0.5))
+            else:
+                signals.append(("5日均线在20日均线下方", -0.5))
+        if ma20 is not None and ma50 is not None:
+            if ma20 >= ma50:
+                signals.append(("中期均线多头排列", 0.5))
+            else:
+                signals.append(("中期均线空头排列", -0.5))
+                risks.append("中期趋势偏弱")
+
+        upper, lower = _number(bands.get("upper")), _number(bands.get("lower"))
+        if price is not None and upper is not None and lower is not None and upper > lower:
+            position = (price - lower) / (upper - lower)
+            if position > 1:
+                signals.append(("价格突破布林带上轨", -0.5))
+                risks.append("价格偏离布林带上轨，短期过热")
+            elif position < 0:
+                signals.append(("价格跌破布林带下轨", 0.5))
+                risks.append("价格跌破布林带下轨，波动加大")
+            if (upper - lower) / price > 0.2:
+                risks.append("布林带开口较大，波动率偏高")
+
+        change = _number(data.get("price_change"))
+        if change is not None and abs(change) >= 5:
+            risks.append(f"单日涨跌幅 {change:.1f}%，短期波动剧烈")
+
+        return signals, risks
+
+    def _key_levels(self, data: Dict[str, Any]) -> Dict[str, Optional[float]]:
+        """取当前价下方最近的均线/布林下轨作为支撑，上方最近的作为阻力"""
+        price = _number(data.get("current_price"))
+        if price is None:
+            return {"support": None, "resistance": None}
+        averages = data.get("moving_averages") or {}
+        bands = data.get("bollinger_bands") or {}
+        levels = [_number(v) for v in list(averages.values()) + [bands.get("upper"), bands.get("middle"), bands.get("lower")]]
+        levels = [level for level in levels if level is not None]
+        below = [level for level in levels if level < price]
+        above = [level for level in levels if level > price]
+        return {
+            "support": round(max(below), 2) if below else round(price * 0.95, 2),
+            "resistance": round(min(above), 2) if above else round(price * 1.05, 2),
+        }
+
+    def analyze(self, symbol: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """data 与技术分析提示词模板使用的数据相同"""
+        signals, risks = self._signals(data)
+        total = sum(abs(weight) for _, weight in signals)
+        score = sum(weight for _, weight in signals) / total if total else 0.0
+
+        if score > 0.25:
+            sentiment = "bullish"
+        elif score < -0.25:
+            sentiment = "bearish"
+        else:
+            sentiment = "neutral"
+
+        # 置信度取决于信号一致程度和可用指标数量
+        agreeing = sum(abs(w) for _, w in signals if (w > 0) == (score > 0)) / total if total else 0.0
+        coverage = min(len(signals) / 5, 1.0)
+        confidence = round(0.3 + 0.5 * agreeing * coverage, 2)
+
+        key_levels = self._key_levels(data)
+        outlook = {
+            "bullish": "多数技术信号偏多，短期（1-7天）倾向于震荡上行",
+            "bearish": "多数技术信号偏空，短期（1-7天）倾向于震荡下行",
+            "neutral": "技术信号多空交织，短期（1-7天）以区间震荡为主",
+        }[sentiment]
+        if key_levels["support"] is not None:
+            outlook += f"，关注支撑位 {key_levels['support']} 和阻力位 {key_levels['resistance']}"
+
+        return {
+            "overall_sentiment": sentiment,
+            "key_levels": key_levels,
+            "short_term_outlook": outlook + "。",
+            "signals": [description for description, _ in signals],
+            "risk_factors": risks or ["暂无明显技术面风险信号"],
+            "confidence": confidence,
+            "score": round(score, 3),
+            "symbol": symbol,
+            "analysis_type": "technical",
+            "generated_at": datetime.now().isoformat(),
+            "model_used": self.model_name
+        }
+
+def signal_fingerprint(analysis_type: str, data: Dict[str, Any]) -> str:
+    """计算输入信号的指纹，指纹不变时可以复用上次的LLM结果
+
+    各类型只取决定结论的字段并离散化，实时价格等每次都会变化的字段不参与计算：
+    技术分析按信号状态（RSI区间、MACD方向、均线排列、布林带位置），基本面按行业和估值分档，
+    情绪按涨跌幅分档，综合推荐按去掉元数据后的前三种分析结果。
+    """
+    if analysis_type == "technical":
+        price = _number(data.get("current_price"))
+        rsi = _number(data.get("rsi"))
+        averages = data.get("moving_averages") or {}
+        bands = data.get("bollinger_bands") or {}
+        histogram = _number((data.get("macd") or {}).get("histogram"))
+        ma5, ma20, ma50 = (_number(averages.get(k)) for k in ("MA5", "MA20", "MA50"))
+        upper, lower = _number(bands.get("upper")), _number(bands.get("lower"))
+
+        def compare(a, b):
+            return None if a is None or b is None else a >= b
+
+        state = {
+            "rsi": None if rsi is None else (rsi >= 30) + (rsi >= 50) + (rsi >= 70),
+            "macd": None if histogram is None else histogram > 0,
+            "price_ma20": compare(price, ma20),
+            "ma5_ma20": compare(ma5, ma20),
+            "ma20_ma50": compare(ma20, ma50),
+            "band": None if None in (price, upper, lower) else (price > lower) + (price > upper),
+        }
+    elif analysis_type == "fundamental":
+        market_cap = _number(data.get("market_cap"))
+        price = _number(data.get("current_price"))
+        high, low = _number(data.get("52_week_high")), _number(data.get("52_week_low"))
+        position = None
+        if None not in (price, high, low) and high > low:
+            position = _bucket((price - low) / (high - low), RANGE_POSITION_EDGES)
+        state = {
+            "sector": data.get("sector"),
+            "industry": data.get("industry"),
+            # 市值按数量级分档
+            "market_cap": None if not market_cap or market_cap <= 0 else int(math.log10(market_cap)),
+            "pe_ratio": _bucket(data.get("pe_ratio"), PE_RATIO_EDGES),
+            "dividend_yield": _bucket(data.get("dividend_yield"), DIVIDEND_YIELD_EDGES),
+            "beta": _bucket(data.get("beta"), BETA_EDGES),
+            "range_position": position,
+        }
+    elif analysis_type == "sentiment":
+        state = {
+            "price_change": _bucket(data.get("price_change"), PRICE_CHANGE_EDGES),
+            "market_context": data.get("market_context"),
+        }
+    elif analysis_type == "recommendation":
+        state = {key: strip_metadata(value) for key, value in data.items() if key.endswith("_analysis")}
+    else:
+        state = data
+    payload = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+class SignalMemory:
+    """记录每只股票每种分析上次调用LLM时的信号指纹和结果
+
+    优先写入Redis供多个进程共享，Redis不可用时使用进程内缓存。
+    """
+
+    def __init__(self, ttl: int = ANALYSIS_SIGNAL_TTL):
+        self.ttl = ttl
+        self._local: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(analysis_type: str, symbol: str) -> str:
+        return f"{SIGNAL_KEY_PREFIX}{analysis_type}:{symbol.upper()}"
+
+    def get(self, analysis_type: str, symbol: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """指纹相同时返回上次的结果"""
+        key = self._key(analysis_type, symbol)
+        entry = None
+        client = get_redis()
+        if client is not None:
+            try:
+                raw = client.get(key)
+                entry = json.loads(raw) if raw else None
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+        if entry is None:
+            with self._lock:
+                cached = self._local.get(key)
+            if cached and cached[0] > time.time():
+                entry = cached[1]
+        if entry and entry.get("fingerprint") == fingerprint:
+            return entry.get("result")
+        return None
+
+    def put(self, analysis_type: str, symbol: str, fingerprint: str, result: Dict[str, Any]):
+        if "error" in result:
+            return
+        key = self._key(analysis_type, symbol)
+        entry = {"fingerprint": fingerprint, "result": result}
+        with self._lock:
+            self._local[key] = (time.time() + self.ttl, entry)
+        client = get_redis()
+        if client is not None:
+            try:
+                client.setex(key, self.ttl, json.dumps(entry, ensure_ascii=False, default=str))
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+class AnalysisPolicy:
+    """按分析类型决定使用规则、LLM，还是仅在信号变化时调用LLM"""
+
+    def __init__(self, spec: str = ANALYSIS_POLICY, memory: Optional[SignalMemory] = None):
+        self.modes = parse_policy(spec)
+        self.memory = memory or signal_memory
+        self.technical_analyzer = RuleBasedTechnicalAnalyzer()
+
+    def mode(self, analysis_type: str) -> str:
+        return self.modes.get(analysis_type, "llm")
+
+    def resolve(self, analysis_type: str, items: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]], Dict[str, str]]:
+        """不需要调用LLM的股票直接给出结果
+
+        返回 (已得到的结果, 仍需调用LLM的输入, 需要调用LLM的股票的信号指纹)。
+        """
+        mode = self.mode(analysis_type)
+        if mode == "rule" and analysis_type == "technical":
+            return {symbol: self.technical_analyzer.analyze(symbol, data) for symbol, data in items.items()}, {}, {}
+        if mode != "llm_on_change":
+            return {}, dict(items), {}
+
+        resolved, pending, fingerprints = {}, {}, {}
+        for symbol, data in items.items():
+            fingerprint = signal_fingerprint(analysis_type, data)
+            previous = self.memory.get(analysis_type, symbol, fingerprint)
+            if previous is not None:
+                resolved[symbol] = {**previous, "reused": True, "reused_at": datetime.now().isoformat()}
+            else:
+                pending[symbol] = data
+                fingerprints[symbol] = fingerprint
+        return resolved, pending, fingerprints
+
+    def remember(self, analysis_type: str, results: Dict[str, Dict[str, Any]], fingerprints: Dict[str, str]):
+        """记录本次LLM结果，供信号未变化时复用"""
+        for symbol, fingerprint in fingerprints.items():
+            if symbol in results:
+                self.memory.put(analysis_type, symbol, fingerprint, results[symbol])
+
+signal_memory = SignalMemory()
@@ -5,9 +5,14 @@ import logging
 from sqlalchemy.orm import Session
 from ..models import StockNameMapping
 from ..database import SessionLocal
+from .symbol_extractor import invalidate_symbol_extractor
+from ..pagination import invalidate_count, keyset_page
 
 logger = logging.getLogger(__name__)
 
+# 本进程是否已确认默认映射存在，避免每次创建服务都执行 COUNT(*)
+_defaults_ensured = False
+
 class StockMappingService:
     """股票名称映射服务，提供中英文股票名称映射"""
     
@@ -16,7 +21,10 @@ class StockMappingService:
         self.ensure_default_mappings()
     
     def ensure_default_mappings(self):
-        """确保默认映射数据存在于数据库中"""
+        """确保默认映射数据存在于数据库中（每个进程只检查一次）"""
+        global _defaults_ensured
+        if _defaults_ensured:
+            return
         try:
             # 检查数据库中是否已有映射数据
             count = self.session.query(StockNameMapping).count()
@@ -35,7 +43,9 @@ class StockMappingService:
                     self.session.add(mapping)
                 
                 self.session.commit()
+                invalidate_count(StockNameMapping.__tablename__)
                 logger.info(f"成功导入 {len(default_mappings)} 条默认映射数据")
+            _defaults_ensured = True
         except Exception as e:
             logger.error(f"确保默认映射数据失败: {e}")
             self.session.rollback()
@@ -145,9 +155,18 @@ class StockMappingService:
         return results
     
     def get_all_mappings(self, skip: int = 0, limit: int = 100) -> List[Dict[str, str]]:
-        """获取所有映射数据"""
-        mappings = self.session.query(StockNameMapping).offset(skip).limit(limit).all()
-        
+        """获取所有映射数据（偏移分页，页码越深越慢，新代码请用 list_mappings）"""
+        mappings = self.session.query(StockNameMapping).order_by(StockNameMapping.id).offset(skip).limit(limit).all()
+        return self._serialize(mappings)
+
+    def list_mappings(self, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """按ID游标分页，返回 (本页映射, 下一页游标)"""
+        mappings, next_cursor = keyset_page(
+            self.session.query(StockNameMapping), [StockNameMapping.id], limit, cursor
+        )
+        return self._serialize(mappings), next_cursor
+
+    def _serialize(self, mappings: List[StockNameMapping]) -> List[Dict[str, str]]:
         results = []
         for mapping in mappings:
             results.append({
@@ -197,6 +216,8 @@ class StockMappingService:
             self.session.add(mapping)
             self.session.commit()
             self.session.refresh(mapping)
+            invalidate_symbol_extractor()
+            invalidate_count(StockNameMapping.__tablename__)
             
             return {
                 "id": mapping.id,
@@ -239,6 +260,7 @@ class StockMappingService:
             
             self.session.commit()
             self.session.refresh(mapping)
+            invalidate_symbol_extractor()
             
             return {
                 "id": mapping.id,
@@ -265,6 +287,8 @@ class StockMappingService:
             
             self.session.delete(mapping)
             self.session.commit()
+            invalidate_symbol_extractor()
+            invalidate_count(StockNameMapping.__tablename__)
             return True
         except Exception as e:
             logger.error(f"删除映射失败: {e}")
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+import time
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import func, or_, case, text
+from sqlalchemy.orm import Session
+from ..models import Stock
+
+logger = logging.getLogger(__name__)
+
+# 搜索配置
+SEARCH_DEFAULT_LIMIT = int(os.getenv("STOCK_SEARCH_LIMIT", "20"))
+SEARCH_MIN_SIMILARITY = float(os.getenv("STOCK_SEARCH_MIN_SIMILARITY", "0.3"))
+# 进程内索引检查数据变化的间隔（秒）
+SEARCH_INDEX_REFRESH_INTERVAL = int(os.getenv("STOCK_SEARCH_INDEX_REFRESH", "60"))
+
+SEARCH_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_stocks_name_trgm ON stocks USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_stocks_symbol_trgm ON stocks USING gin (symbol gin_trgm_ops)",
+]
+
+def ensure_search_indexes(engine):
+    """在PostgreSQL上创建 pg_trgm 扩展和名称/代码的GIN三元组索引"""
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            for statement in SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+    except Exception as e:
+        logger.warning(f"创建三元组索引失败，搜索将使用进程内索引: {e}")
+
+def _trigrams(value: str) -> Set[str]:
+    """按 pg_trgm 的规则生成三元组：小写、按单词切分、首尾补空格"""
+    grams = set()
+    for word in re.findall(r"\w+", (value or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+class TrigramIndex:
+    """进程内三元组倒排索引，用于没有 pg_trgm 的数据库"""
+
+    def __init__(self):
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+        self.documents: Dict[int, Dict[str, object]] = {}
+
+    def build(self, stocks: List[Tuple[int, str, Optional[str], Optional[str]]]):
+        postings = defaultdict(set)
+        documents = {}
+        for stock_id, symbol, name, exchange in stocks:
+            name_grams = _trigrams(name)
+            symbol_grams = _trigrams(symbol)
+            for gram in name_grams | symbol_grams:
+                postings[gram].add(stock_id)
+            documents[stock_id] = {
+                "symbol": symbol,
+                "name": name or "",
+                "exchange": exchange or "",
+                "name_grams": name_grams,
+                "symbol_grams": symbol_grams,
+            }
+        self.postings = postings
+        self.documents = documents
+
+    def search(self, query: str, limit: int) -> List[Dict[str, object]]:
+        query_grams = _trigrams(query)
+        if not query_grams:
+            return []
+
+        # 只对至少共享一个三元组的候选计算相似度
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in query_grams:
+            for stock_id in self.postings.get(gram, ()):
+                shared[stock_id] += 1
+
+        lowered = query.lower()
+        scored = []
+        for stock_id in shared:
+            doc = self.documents[stock_id]
+            name_common = len(query_grams & doc["name_grams"])
+            # 与 word_similarity 一致：以查询的三元组数为分母
+            name_score = name_common / len(query_grams)
+            symbol_union = len(query_grams | doc["symbol_grams"])
+            symbol_score = len(query_grams & doc["symbol_grams"]) / symbol_union if symbol_union else 0
+            score = max(name_score, symbol_score)
+            if doc["symbol"].lower() == lowered:
+                score = 2.0
+            elif lowered in doc["name"].lower():
+                score = max(score, 1.0)
+            if score >= SEARCH_MIN_SIMILARITY:
+                scored.append((score, len(doc["name"]), doc["symbol"], doc))
+
+        scored.sort(key=lambda item: (-item[0], item[1], item[2]))
+        return [
+            {"symbol": doc["symbol"], "name": doc["name"], "exchange": doc["exchange"], "score": round(min(score, 1.0), 3)}
+            for score, _, _, doc in scored[:limit]
+        ]
+
+class StockSearchService:
+    """股票名称/代码搜索服务
+
+    PostgreSQL 且安装了 pg_trgm 时使用GIN三元组索引并按相似度排序；
+    否则使用按数据变化自动重建的进程内倒排索引。
+    """
+
+    _trgm_available: Optional[bool] = None
+    _index = TrigramIndex()
+    _index_signature = None
+    _index_checked_at = 0.0
+    _index_lock = threading.Lock()
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _use_trigram(self) -> bool:
+        cls = StockSearchService
+        if cls._trgm_available is None:
+            if self.session.get_bind().dialect.name != "postgresql":
+                cls._trgm_available = False
+            else:
+                try:
+                    cls._trgm_available = self.session.execute(
+                        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                    ).first() is not None
+                except Exception as e:
+                    logger.warning(f"检查 pg_trgm 扩展失败: {e}")
+                    self.session.rollback()
+                    cls._trgm_available = False
+        return cls._trgm_available
+
+    def _search_trigram(self, query: str, limit: int) -> List[Dict[str, object]]:
+        exact_symbol = case((Stock.symbol == query.upper(), 1), else_=0)
+        score = func.greatest(
+            func.word_similarity(query, Stock.name),
+            func.similarity(query, Stock.symbol)
+        )
+        rows = self.session.query(Stock.symbol, Stock.name, Stock.exchange, score.label("score")).filter(
+            or_(
+                Stock.symbol == query.upper(),
+                Stock.name.op("%>")(query),
+                Stock.symbol.op("%")(query),
+                Stock.name.ilike(f"%{_escape_like(query)}%", escape="\\")
+            )
+        ).order_by(exact_symbol.desc(), score.desc(), func.length(Stock.name), Stock.symbol).limit(limit).all()
+
+        return [
+            {"symbol": symbol, "name": name, "exchange": exchange, "score": round(float(s or 0), 3)}
+            for symbol, name, exchange, s in rows
+        ]
+
+    def _refresh_index(self):
+        """数据有变化时重建进程内索引"""
+        cls = StockSearchService
+        now = time.time()
+        if now - cls._index_checked_at < SEARCH_INDEX_REFRESH_INTERVAL and cls._index_signature is not None:
+            return
+        with cls._index_lock:
+            signature = tuple(self.session.query(func.count(Stock.id), func.max(Stock.updated_at)).one())
+            cls._index_checked_at = now
+            if signature == cls._index_signature:
+                return
+            index = TrigramIndex()
+            index.build(self.session.query(Stock.id, Stock.symbol, Stock.name, Stock.exchange).all())
+            cls._index = index
+            cls._index_signature = signature
+            logger.info(f"重建股票搜索索引: {signature[0]} 条")
+
+    def search(self, query: str, limit: int = SEARCH_DEFAULT_LIMIT) -> List[Dict[str, object]]:
+        """按相似度排序返回匹配的股票"""
+        query = (query or "").strip()
+        if not query:
+            return []
+        if self._use_trigram():
+            return self._search_trigram(query, limit)
+        self._refresh_index()
+        return StockSearchService._index.search(query, limit)
@@ -1,29 +1,80 @@
-import yfinance as yf
-import pandas as pd
-import numpy as np
+from __future__ import annotations
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from ..models import Stock, StockPrice
+from ..models import Stock
+from .price_store import get_price_store
 from ..database import SessionLocal
 import logging
 import re
 from .stock_mapping_service import StockMappingService
+from .symbol_probe_cache import symbol_probe_cache
+from .stock_search_service import StockSearchService, SEARCH_DEFAULT_LIMIT
+from ..lazy_imports import lazy_import
+from ..http_transport import call_with_retry, get_yf_session
+from ..metrics import observe_yfinance
+
+yf = lazy_import("yfinance")
+pd = lazy_import("pandas")
 
 logger = logging.getLogger(__name__)
 
+def _ticker(symbol: str):
+    """使用当前线程共享 yfinance 会话的 Ticker，复用到 Yahoo 的长连接"""
+    return yf.Ticker(symbol, session=get_yf_session())
+
+def _probe_info(symbol: str):
+    # 探测的候选代码来自用户输入，不按代码区分以控制序列数
+    with observe_yfinance("probe", "-"):
+        return call_with_retry(lambda: _ticker(symbol).info, host="yfinance")
+
+def get_intraday_bars(symbol: str, interval: str = "1m", period: str = "1d") -> Optional[pd.DataFrame]:
+    """获取当天的分钟K线（索引为交易所时区的时间）"""
+    try:
+        with observe_yfinance("intraday", symbol):
+            return call_with_retry(lambda: _ticker(symbol).history(period=period, interval=interval), host="yfinance")
+    except Exception as e:
+        logger.error(f"获取分钟数据失败 {symbol}: {e}")
+        return None
+
+def get_quote(symbol: str) -> Optional[Dict[str, Any]]:
+    """获取最新报价，只读取 fast_info，不请求完整的 info"""
+    def read():
+        fast_info = _ticker(symbol).fast_info
+        return fast_info.last_price, fast_info.previous_close, fast_info.last_volume
+
+    try:
+        with observe_yfinance("quote", symbol):
+            price, previous_close, volume = call_with_retry(read, host="yfinance")
+        if price is None:
+            return None
+        change = price - previous_close if previous_close else 0.0
+        return {
+            "symbol": symbol,
+            "price": round(float(price), 4),
+            "previous_close": float(previous_close) if previous_close else None,
+            "change": round(float(change), 4),
+            "change_percent": round(float(change / previous_close * 100), 2) if previous_close else 0.0,
+            "volume": int(volume or 0),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"获取报价失败 {symbol}: {e}")
+        return None
+
 class StockDataService:
     """股票数据服务"""
     
     def __init__(self):
         self.session = SessionLocal()
         self.mapping_service = StockMappingService()
+        self.search_service = StockSearchService(self.session)
     
     def get_stock_info(self, symbol: str) -> Optional[Dict[str, Any]]:
         """获取股票基本信息"""
         try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
+            with observe_yfinance("info", symbol):
+                info = call_with_retry(lambda: _ticker(symbol).info, host="yfinance")
             
             return {
                 "symbol": symbol,
@@ -46,8 +97,8 @@ class StockDataService:
     def get_historical_data(self, symbol: str, period: str = "1y") -> Optional[pd.DataFrame]:
         """获取历史价格数据"""
         try:
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(period=period)
+            with observe_yfinance("history", symbol):
+                data = call_with_retry(lambda: _ticker(symbol).history(period=period), host="yfinance")
             return data
         except Exception as e:
             logger.error(f"获取历史数据失败 {symbol}: {e}")
@@ -73,25 +124,8 @@ class StockDataService:
                 else:
                     return False
             
-            # 保存价格数据
-            for date, row in data.iterrows():
-                existing = self.session.query(StockPrice).filter(
-                    StockPrice.stock_id == stock.id,
-                    StockPrice.date == date.date()
-                ).first()
-                
-                if not existing:
-                    price_record = StockPrice(
-                        stock_id=stock.id,
-                        date=date.date(),
-                        open_price=float(row['Open']),
-                        high_price=float(row['High']),
-                        low_price=float(row['Low']),
-                        close_price=float(row['Close']),
-                        volume=int(row['Volume']),
-                        adj_close=float(row['Close'])
-                    )
-                    self.session.add(price_record)
+            # 批量保存价格数据
+            get_price_store(self.session).save_bars(stock.id, data)
             
             self.session.commit()
             return True
@@ -195,11 +229,12 @@ class StockDataService:
             logger.error(f"获取K线图数据失败 {symbol}: {e}")
             return {}
     
-    def find_stock_by_name(self, name: str) -> List[Dict[str, str]]:
+    def find_stock_by_name(self, name: str, limit: int = SEARCH_DEFAULT_LIMIT) -> List[Dict[str, str]]:
         """根据股票名称查找股票代码
         
         Args:
             name: 股票名称（中文或英文）
+            limit: 最多返回的结果数
             
         Returns:
             匹配的股票列表，每个元素包含 symbol 和 name
@@ -230,59 +265,29 @@ class StockDataService:
                             "exchange": ""  # 可以通过 yfinance 获取，但为了性能这里先不获取
                         })
             
-            # 2. 在数据库中查找
-            query = self.session.query(Stock)
-            
-            # 如果输入是中文，尝试模糊匹配名称
-            if re.search(r'[\u4e00-\u9fff]', name):
-                stocks = query.filter(Stock.name.like(f"%{name}%")).all()
-            else:
-                # 英文名称可能是部分匹配
-                stocks = query.filter(Stock.name.ilike(f"%{name}%")).all()
-            
-            for stock in stocks:
-                if not any(r["symbol"] == stock.symbol for r in results):
+            # 2. 在数据库中查找（三元组索引，按相似度排序）
+            for stock in self.search_service.search(name, limit=limit):
+                if not any(r["symbol"] == stock["symbol"] for r in results):
                     results.append({
-                        "symbol": stock.symbol,
-                        "name": stock.name,
-                        "exchange": stock.exchange
+                        "symbol": stock["symbol"],
+                        "name": stock["name"],
+                        "exchange": stock["exchange"]
                     })
             
-            # 3. 如果数据库中没有找到，尝试使用 yfinance 搜索
+            # 3. 如果数据库中没有找到，尝试使用 yfinance 探测可能的代码
             if not results and not re.search(r'[\u4e00-\u9fff]', name):
+                candidates = []
                 # 对于英文名称，尝试直接使用名称的首字母缩写
                 words = name.split()
                 if len(words) > 1:
-                    acronym = ''.join(word[0].upper() for word in words if word)
-                    try:
-                        ticker = yf.Ticker(acronym)
-                        info = ticker.info
-                        if info and 'longName' in info:
-                            results.append({
-                                "symbol": acronym,
-                                "name": info.get("longName", ""),
-                                "exchange": info.get("exchange", "")
-                            })
-                    except:
-                        pass
+                    candidates.append(''.join(word[0].upper() for word in words if word))
                 
                 # 尝试使用名称的前几个字母
                 name_no_space = ''.join(name.split()).upper()
                 if len(name_no_space) >= 2:
-                    possible_symbols = [name_no_space[:i] for i in range(2, min(5, len(name_no_space) + 1))]
-                    for symbol in possible_symbols:
-                        try:
-                            ticker = yf.Ticker(symbol)
-                            info = ticker.info
-                            if info and 'longName' in info:
-                                if not any(r["symbol"] == symbol for r in results):
-                                    results.append({
-                                        "symbol": symbol,
-                                        "name": info.get("longName", ""),
-                                        "exchange": info.get("exchange", "")
-                                    })
-                        except:
-                            pass
+                    candidates.extend(name_no_space[:i] for i in range(2, min(5, len(name_no_space) + 1)))
+                
+                results.extend(self._probe_symbols(candidates))
             
             # 4. 如果是中文名称但没有找到匹配，尝试将中文转为英文再搜索
             if not results and re.search(r'[\u4e00-\u9fff]', name):
@@ -293,24 +298,34 @@ class StockDataService:
                     words = en_name.split()
                     if len(words) > 1:
                         acronym = ''.join(word[0].upper() for word in words if word and not word.lower() in ['inc', 'corp', 'co', 'ltd', 'limited'])
-                        try:
-                            ticker = yf.Ticker(acronym)
-                            info = ticker.info
-                            if info and 'longName' in info:
-                                results.append({
-                                    "symbol": acronym,
-                                    "name": info.get("longName", ""),
-                                    "exchange": info.get("exchange", "")
-                                })
-                        except:
-                            pass
+                        results.extend(self._probe_symbols([acronym]))
             
-            return results
+            return results[:limit]
             
         except Exception as e:
             logger.error(f"根据名称查找股票失败 {name}: {e}")
             return []
     
+    def _probe_symbols(self, candidates: List[str]) -> List[Dict[str, str]]:
+        """通过 yfinance 并发探测候选代码，结果经正/负缓存复用"""
+        probed = symbol_probe_cache.probe_many(
+            [c for c in candidates if c],
+            _probe_info
+        )
+        return [
+            {
+                "symbol": symbol,
+                "name": info.get("longName", ""),
+                "exchange": info.get("exchange", "")
+            }
+            for symbol, info in probed.items()
+        ]
+    
+    def close(self):
+        """释放数据库会话，会话对象下次使用时重新获取连接"""
+        self.session.close()
+        self.mapping_service.session.close()
+    
     def __del__(self):
         if hasattr(self, 'session'):
             self.session.close()
\ No newline at end of file
@@ -0,0 +1,162 @@
+import json
+import re
+from typing import Any, Iterable, List, Tuple
+
+# 允许出现在JSON对象之前的Markdown代码块前缀
+_FENCE_PREFIX = re.compile(r"^\s*(`{1,3}(j(s(o(n)?)?)?)?)?\s*$")
+
+class IncrementalJSONParser:
+    """增量解析模型流式输出的顶层JSON对象
+
+    feed() 每次接收一段文本，返回新产生的事件：
+    - ("delta", 字段名, 文本片段)：stream_fields 中字符串字段的增量内容
+    - ("field", 字段名, 值)：某个字段的值已完整解析
+    如果输出不是JSON对象，所有文本都作为 answer 字段的增量返回。
+    """
+
+    def __init__(self, stream_fields: Iterable[str] = ("answer",)):
+        self.stream_fields = set(stream_fields)
+        self.state = "start"
+        self.prefix = ""
+        self.raw: List[str] = []
+        self.key = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = ""
+        self.decoded: List[str] = []
+        self.pending: List[str] = []
+
+    def _flush_delta(self, events: List[Tuple[str, str, Any]]):
+        if self.pending:
+            field = "answer" if self.state == "plain" else self.key
+            events.append(("delta", field, "".join(self.pending)))
+            self.pending = []
+
+    def _finish_field(self, events: List[Tuple[str, str, Any]], value: Any):
+        self._flush_delta(events)
+        events.append(("field", self.key, value))
+        self.key = None
+        self.raw = []
+        self.state = "after_value"
+
+    def _decode_string_char(self, char: str) -> str:
+        """处理字符串中的转义序列，返回可以输出的已解码文本"""
+        if self.escape:
+            self.escape += char
+            if self.escape[1] != "u":
+                text, self.escape = json.loads(f'"{self.escape}"'), ""
+                return text
+            if len(self.escape) < 6:
+                return ""
+            code = int(self.escape[2:6], 16)
+            # 高位代理需要等待后续的低位代理
+            if 0xD800 <= code <= 0xDBFF and len(self.escape) < 12:
+                return ""
+            text, self.escape = json.loads(f'"{self.escape}"'), ""
+            return text
+        if char == "\\":
+            self.escape = char
+            return ""
+        return char
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        events: List[Tuple[str, str, Any]] = []
+
+        for char in chunk:
+            state = self.state
+            if state == "start":
+                if char == "{":
+                    self.state = "key_or_end"
+                    continue
+                self.prefix += char
+                if not _FENCE_PREFIX.match(self.prefix):
+                    self.state = "plain"
+                    self.pending.append(self.prefix)
+            elif state == "plain":
+                self.pending.append(char)
+            elif state == "key_or_end":
+                if char == '"':
+                    self.state = "key"
+                    self.raw = []
+                elif char == "}":
+                    self.state = "done"
+            elif state == "key":
+                if self.escape:
+                    self.raw.append(char)
+                    self.escape = ""
+                elif char == "\\":
+                    self.raw.append(char)
+                    self.escape = char
+                elif char == '"':
+                    self.key = json.loads('"' + "".join(self.raw) + '"')
+                    self.raw = []
+                    self.state = "colon"
+                else:
+                    self.raw.append(char)
+            elif state == "colon":
+                if char == ":":
+                    self.state = "value"
+            elif state == "value":
+                if char.isspace():
+                    continue
+                if char == '"':
+                    self.state = "string_value"
+                    self.decoded = []
+                elif char in "[{":
+                    self.state = "compound_value"
+                    self.depth = 1
+                    self.in_string = False
+                    self.raw = [char]
+                else:
+                    self.state = "scalar_value"
+                    self.raw = [char]
+            elif state == "string_value":
+                if not self.escape and char == '"':
+                    self._finish_field(events, "".join(self.decoded))
+                    continue
+                text = self._decode_string_char(char)
+                if text:
+                    self.decoded.append(text)
+                    if self.key in self.stream_fields:
+                        self.pending.append(text)
+            elif state == "compound_value":
+                self.raw.append(char)
+                if self.in_string:
+                    if self.escape:
+                        self.escape = ""
+                    elif char == "\\":
+                        self.escape = char
+                    elif char == '"':
+                        self.in_string = False
+                elif char == '"':
+                    self.in_string = True
+                elif char in "[{":
+                    self.depth += 1
+                elif char in "]}":
+                    self.depth -= 1
+                    if self.depth == 0:
+                        raw = "".join(self.raw)
+                        try:
+                            value = json.loads(raw)
+                        except json.JSONDecodeError:
+                            value = raw
+                        self._finish_field(events, value)
+            elif state == "scalar_value":
+                if char in ",}":
+                    raw = "".join(self.raw).strip()
+                    try:
+                        value = json.loads(raw)
+                    except json.JSONDecodeError:
+                        value = raw
+                    self._finish_field(events, value)
+                    self.state = "key_or_end" if char == "," else "done"
+                else:
+                    self.raw.append(char)
+            elif state == "after_value":
+                if char == ",":
+                    self.state = "key_or_end"
+                elif char == "}":
+                    self.state = "done"
+
+        self._flush_delta(events)
+        return events
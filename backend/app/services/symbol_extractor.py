@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..models import Stock, StockNameMapping
+
+logger = logging.getLogger(__name__)
+
+# 词典自动机的刷新间隔（秒）
+EXTRACTOR_REFRESH_INTERVAL = int(os.getenv("SYMBOL_EXTRACTOR_REFRESH", "300"))
+
+# 公司名称中不具区分度的后缀
+NAME_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited",
+    "plc", "holdings", "holding", "group", "sa", "ag", "nv", "the", "com"
+}
+
+# 既是股票代码又是常见英文单词的词，只有写成 $CODE 或在混合大小写的句子中才视为代码
+AMBIGUOUS_WORDS = {
+    "A", "I", "IT", "ON", "ALL", "ARE", "NOW", "SO", "BE", "GO", "OR", "AN", "AT", "BY",
+    "FOR", "HAS", "CAN", "ONE", "OUT", "SEE", "NEW", "BIG", "LOW", "KEY", "FUN", "CAR",
+    "WELL", "GOOD", "REAL", "LIFE", "LOVE", "CASH", "TRUE", "EDIT", "MAIN", "PLAY", "TEAM"
+}
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, value: object):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((len(pattern), value))
+
+    def build(self):
+        """按广度优先计算失败指针"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state].extend(self.output[self.fail[next_state]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """返回 (起始位置, 结束位置, 值)"""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                yield index - length + 1, index + 1, value
+
+def _normalize_company_name(name: str) -> Optional[str]:
+    """去掉公司后缀，得到可用于匹配的核心名称"""
+    words = re.findall(r"[a-z0-9][a-z0-9&'.\-]*", (name or "").lower())
+    words = [w.strip(".") for w in words]
+    while words and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    while words and words[0] in NAME_SUFFIXES:
+        words.pop(0)
+    core = " ".join(w for w in words if w and w != "&").strip()
+    return core if len(core) >= 3 else None
+
+def _is_ascii_word_char(char: str) -> bool:
+    return char.isascii() and (char.isalnum() or char == "_")
+
+class SymbolExtractor:
+    """基于股票词典的代码提取器
+
+    用 stock_name_mappings 和 stocks 中的代码、中英文名称构建自动机，
+    只返回词典中真实存在的股票代码，并按出现频次排序。
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, str]]):
+        """entries: (匹配文本, 类型 symbol/name, 股票代码)"""
+        self.automaton = AhoCorasick()
+        self.size = 0
+        seen = set()
+        for pattern, kind, symbol in entries:
+            key = (pattern.lower(), kind, symbol)
+            if not pattern or key in seen:
+                continue
+            seen.add(key)
+            self.automaton.add(pattern.lower(), (kind, symbol, pattern))
+            self.size += 1
+        self.automaton.build()
+
+    @classmethod
+    def from_session(cls, session: Session) -> "SymbolExtractor":
+        entries = []
+        for chinese_name, english_name, symbol in session.query(
+            StockNameMapping.chinese_name, StockNameMapping.english_name, StockNameMapping.symbol
+        ).all():
+            if not symbol:
+                continue
+            entries.append((symbol.upper(), "symbol", symbol.upper()))
+            if chinese_name:
+                entries.append((chinese_name, "name", symbol.upper()))
+            core = _normalize_company_name(english_name)
+            if core:
+                entries.append((core, "name", symbol.upper()))
+
+        for symbol, name in session.query(Stock.symbol, Stock.name).all():
+            if not symbol:
+                continue
+            entries.append((symbol.upper(), "symbol", symbol.upper()))
+            # A股/港股代码允许只写数字部分，如 600519 -> 600519.SS
+            code = symbol.split(".")[0]
+            if code != symbol and code.isdigit():
+                entries.append((code, "symbol", symbol.upper()))
+            core = _normalize_company_name(name)
+            if core:
+                entries.append((core, "name", symbol.upper()))
+
+        return cls(entries)
+
+    def extract(self, text: str, limit: int = 3) -> List[str]:
+        """提取文本中的股票代码，按出现频次（同频按首次出现位置）排序"""
+        if not text:
+            return []
+        lowered = text.lower()
+        shouting = not any(c.islower() for c in text)
+
+        candidates = []
+        for start, end, (kind, symbol, pattern) in self.automaton.iter_matches(lowered):
+            # 英文/代码需要完整单词匹配，中文名称不需要
+            if _is_ascii_word_char(lowered[start]):
+                if start > 0 and _is_ascii_word_char(lowered[start - 1]):
+                    continue
+                if end < len(lowered) and _is_ascii_word_char(lowered[end]):
+                    continue
+            if kind == "symbol":
+                # $AAPL 形式不限大小写；否则代码必须以大写形式出现
+                if not (start > 0 and text[start - 1] == "$"):
+                    if text[start:end] != pattern:
+                        continue
+                    if len(pattern) == 1 or (pattern in AMBIGUOUS_WORDS and shouting):
+                        continue
+            candidates.append((start, end, symbol))
+
+        # 重叠时保留更长的匹配，例如 "美国银行" 优先于其中的子串
+        candidates.sort(key=lambda item: (item[0], -(item[1] - item[0])))
+        counts: Dict[str, int] = {}
+        first_seen: Dict[str, int] = {}
+        last_end = -1
+        for start, end, symbol in candidates:
+            if start < last_end:
+                continue
+            last_end = end
+            counts[symbol] = counts.get(symbol, 0) + 1
+            first_seen.setdefault(symbol, start)
+
+        ranked = sorted(counts, key=lambda s: (-counts[s], first_seen[s]))
+        return ranked[:limit]
+
+_extractor: Optional[SymbolExtractor] = None
+_extractor_built_at = 0.0
+_extractor_lock = threading.Lock()
+
+def get_symbol_extractor(session: Session) -> SymbolExtractor:
+    """获取进程内缓存的代码提取器，过期后重建"""
+    global _extractor, _extractor_built_at
+    if _extractor is not None and time.time() - _extractor_built_at < EXTRACTOR_REFRESH_INTERVAL:
+        return _extractor
+    with _extractor_lock:
+        if _extractor is None or time.time() - _extractor_built_at >= EXTRACTOR_REFRESH_INTERVAL:
+            _extractor = SymbolExtractor.from_session(session)
+            _extractor_built_at = time.time()
+            logger.info(f"构建股票代码提取词典: {_extractor.size} 个词条")
+    return _extractor
+
+def invalidate_symbol_extractor():
+    """名称映射变更后使提取器在下次使用时重建"""
+    global _extractor_built_at
+    _extractor_built_at = 0.0
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import logging
+import redis
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ..redis_client import get_redis, mark_redis_unavailable
+
+logger = logging.getLogger(__name__)
+
+# 探测缓存配置
+PROBE_POSITIVE_TTL = int(os.getenv("SYMBOL_PROBE_POSITIVE_TTL", str(24 * 3600)))
+PROBE_NEGATIVE_TTL = int(os.getenv("SYMBOL_PROBE_NEGATIVE_TTL", str(6 * 3600)))
+PROBE_DEADLINE = float(os.getenv("SYMBOL_PROBE_DEADLINE", "3.0"))
+PROBE_MAX_WORKERS = int(os.getenv("SYMBOL_PROBE_MAX_WORKERS", "8"))
+# 从Redis同步无效代码集合、重建布隆过滤器的间隔（秒）
+PROBE_SYNC_INTERVAL = int(os.getenv("SYMBOL_PROBE_SYNC_INTERVAL", "60"))
+
+POSITIVE_KEY_PREFIX = "stock:probe:valid:"
+NEGATIVE_SET_KEY = "stock:probe:invalid"
+
+class BloomFilter:
+    """基于位数组的布隆过滤器，用于快速判断代码是否可能已知无效"""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class SymbolProbeCache:
+    """yfinance 代码探测结果缓存
+
+    有效代码缓存在本地并写入 Redis（带TTL）；无效代码写入 Redis 有序集合（分数为过期时间），
+    本地用布隆过滤器做预判，绝大多数未命中无需访问 Redis。
+    """
+
+    def __init__(self,
+                 positive_ttl: int = PROBE_POSITIVE_TTL,
+                 negative_ttl: int = PROBE_NEGATIVE_TTL,
+                 max_workers: int = PROBE_MAX_WORKERS):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._positive: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._negative: Dict[str, float] = {}
+        self._bloom = BloomFilter()
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="symbol-probe")
+        self._inflight: Dict[str, Any] = {}
+
+    def _sync_negative_set(self):
+        """从Redis加载未过期的无效代码并重建布隆过滤器"""
+        now = time.time()
+        if now < self._next_sync:
+            return
+        self._next_sync = now + PROBE_SYNC_INTERVAL
+
+        client = get_redis()
+        members = []
+        if client:
+            try:
+                client.zremrangebyscore(NEGATIVE_SET_KEY, "-inf", now)
+                members = client.zrangebyscore(NEGATIVE_SET_KEY, now, "+inf", withscores=True)
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+        bloom = BloomFilter()
+        with self._lock:
+            negative = {s: exp for s, exp in self._negative.items() if exp > now}
+            for symbol, expires_at in members:
+                negative[symbol] = max(expires_at, negative.get(symbol, 0))
+            for symbol in negative:
+                bloom.add(symbol)
+            self._negative = negative
+            self._bloom = bloom
+
+    def lookup(self, symbol: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """查询缓存，返回 (是否命中, 股票信息)；命中且信息为None表示已知无效"""
+        now = time.time()
+        with self._lock:
+            cached = self._positive.get(symbol)
+            if cached and cached[0] > now:
+                return True, cached[1]
+
+        self._sync_negative_set()
+
+        client = get_redis()
+        if symbol in self._bloom:
+            expires_at = self._negative.get(symbol, 0)
+            if expires_at > now:
+                return True, None
+            if client:
+                try:
+                    score = client.zscore(NEGATIVE_SET_KEY, symbol)
+                    if score and score > now:
+                        with self._lock:
+                            self._negative[symbol] = score
+                        return True, None
+                except redis.RedisError as e:
+                    mark_redis_unavailable(e)
+                    client = None
+
+        if client:
+            try:
+                raw = client.get(POSITIVE_KEY_PREFIX + symbol)
+                if raw:
+                    info = json.loads(raw)
+                    with self._lock:
+                        self._positive[symbol] = (now + self.positive_ttl, info)
+                    return True, info
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+        return False, None
+
+    def mark_valid(self, symbol: str, info: Dict[str, Any]):
+        """记录有效代码"""
+        with self._lock:
+            self._positive[symbol] = (time.time() + self.positive_ttl, info)
+        client = get_redis()
+        if client:
+            try:
+                client.setex(POSITIVE_KEY_PREFIX + symbol, self.positive_ttl, json.dumps(info, ensure_ascii=False))
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+    def mark_invalid(self, symbol: str):
+        """记录无效代码"""
+        expires_at = time.time() + self.negative_ttl
+        with self._lock:
+            self._negative[symbol] = expires_at
+            self._bloom.add(symbol)
+        client = get_redis()
+        if client:
+            try:
+                client.zadd(NEGATIVE_SET_KEY, {symbol: expires_at})
+            except redis.RedisError as e:
+                mark_redis_unavailable(e)
+
+    def _record(self, symbol: str, future):
+        """探测完成后写入缓存（包括超过截止时间才完成的探测）"""
+        with self._lock:
+            self._inflight.pop(symbol, None)
+        try:
+            info = future.result()
+        except Exception as e:
+            # 网络错误不写入负缓存，下次仍会重试
+            logger.debug(f"探测股票代码失败 {symbol}: {e}")
+            return
+        if info and info.get("longName"):
+            self.mark_valid(symbol, {
+                "longName": info.get("longName", ""),
+                "exchange": info.get("exchange", "")
+            })
+        else:
+            self.mark_invalid(symbol)
+
+    def probe_many(self,
+                   symbols: List[str],
+                   fetch_info: Callable[[str], Optional[Dict[str, Any]]],
+                   deadline: float = PROBE_DEADLINE) -> Dict[str, Dict[str, Any]]:
+        """并发探测多个代码，在截止时间内返回已确认有效的代码（保持输入顺序）"""
+        resolved: Dict[str, Optional[Dict[str, Any]]] = {}
+        pending = {}
+
+        for symbol in dict.fromkeys(symbols):
+            hit, info = self.lookup(symbol)
+            if hit:
+                resolved[symbol] = info
+                continue
+            with self._lock:
+                future = self._inflight.get(symbol)
+                submitted = future is None
+                if submitted:
+                    future = self._executor.submit(fetch_info, symbol)
+                    self._inflight[symbol] = future
+            if submitted:
+                future.add_done_callback(lambda f, s=symbol: self._record(s, f))
+            pending[symbol] = future
+
+        if pending:
+            done, not_done = wait(list(pending.values()), timeout=deadline)
+            if not_done:
+                logger.info(f"代码探测超过截止时间 {deadline}s，{len(not_done)} 个探测在后台继续")
+            for symbol, future in pending.items():
+                if future in done and future.exception() is None:
+                    info = future.result()
+                    if info and info.get("longName"):
+                        resolved[symbol] = {
+                            "longName": info.get("longName", ""),
+                            "exchange": info.get("exchange", "")
+                        }
+
+        return {s: resolved[s] for s in dict.fromkeys(symbols) if resolved.get(s)}
+
+# 进程内共享的探测缓存
+symbol_probe_cache = SymbolProbeCache()
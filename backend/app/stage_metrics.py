@@ -0,0 +1,83 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+from .profiling import record_phase
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0,
+                "p50_ms": round(self.quantile(0.5) * 1000, 1),
+                "p95_ms": round(self.quantile(0.95) * 1000, 1),
+                "max_ms": round(self.max * 1000, 1),
+                "buckets": {
+                    (f"le_{b}" if i < len(self.buckets) else "le_inf"): c
+                    for i, (b, c) in enumerate(zip(list(self.buckets) + [None], self.counts))
+                },
+            }
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_registry_lock = threading.Lock()
+
+def observe_stage(stage: str, seconds: float):
+    """记录一个阶段的耗时（同时计入当前的慢请求采样会话）"""
+    record_phase(stage, seconds)
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.setdefault(stage, LatencyHistogram())
+    histogram.observe(seconds)
+
+@contextmanager
+def stage_timer(stage: str):
+    """统计代码块耗时的上下文管理器"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def stage_snapshot(prefix: str = "") -> Dict[str, Dict[str, object]]:
+    """返回（指定前缀的）各阶段直方图快照"""
+    return {
+        stage: histogram.snapshot()
+        for stage, histogram in sorted(_histograms.items())
+        if stage.startswith(prefix)
+    }
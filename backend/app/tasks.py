@@ -1,19 +1,70 @@
-from celery import Celery
 from .celery_app import celery_app
-from .database import SessionLocal
-from .models import AnalysisTask, Stock, AIAnalysis, StockPrice
+from .database import SessionLocal, engine
+from .models import AIAnalysisLatest, AnalysisTask, Stock
 from .services.stock_service import StockDataService
-from .services.ai_service import AIAnalysisService
-from .services.recommendation_service import RecommendationService
+from .services.analysis_store import AnalysisStore, drop_expired_partitions
+from .services.recommendation_rollup import RecommendationRollupStore
+from .worker_state import worker_state
 from datetime import datetime, timedelta
 from typing import List, Optional
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
+# 批量分析时一次LLM调用包含的股票数，设为1则每只股票单独调用
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "10"))
+# 批量生成推荐时每批的股票数，每批一次评分数据加载、一个写入事务
+RECOMMENDATION_BULK_CHUNK = int(os.getenv("RECOMMENDATION_BULK_CHUNK", "500"))
+
+def _prepare_stock_data(db, stock_service: StockDataService, symbol: str):
+    """获取股票信息和行情并保存，返回 (股票记录, 分析输入数据)"""
+    stock_info = stock_service.get_stock_info(symbol)
+    if not stock_info:
+        return None, None
+    
+    # 获取或创建股票记录
+    stock = db.query(Stock).filter(Stock.symbol == symbol).first()
+    if not stock:
+        stock = Stock(
+            symbol=symbol,
+            name=stock_info["name"],
+            exchange=stock_info["exchange"],
+            sector=stock_info["sector"],
+            industry=stock_info["industry"]
+        )
+        db.add(stock)
+        db.commit()
+        db.refresh(stock)
+    
+    # 获取历史数据并保存
+    historical_data = stock_service.get_historical_data(symbol, "1y")
+    if historical_data is not None:
+        stock_service.save_stock_data(symbol, historical_data)
+    
+    chart_data = stock_service.get_chart_data(symbol)
+    return stock, {
+        "stock_info": stock_info,
+        "indicators": chart_data.get("indicators", {})
+    }
+
+def _save_analyses(db, stock: Stock, comprehensive_analysis: dict, analysis_types: List[str]):
+    """保存综合分析中请求的分析类型（只追加，并更新最新结果指针）"""
+    store = AnalysisStore(db)
+    for analysis_type in analysis_types:
+        if analysis_type in comprehensive_analysis.get("comprehensive_analysis", {}):
+            content = comprehensive_analysis["comprehensive_analysis"][analysis_type]
+            store.save(stock.id, analysis_type, content, commit=False)
+    db.commit()
+
 @celery_app.task(bind=True)
 def analyze_batch_stocks(self, task_id: str, symbols: List[str], analysis_types: List[str], priority: str = "normal"):
-    """批量分析股票任务"""
+    """批量分析股票任务
+    
+    LLM_BATCH_SIZE 大于1时，每批股票的同一种分析合并为一次LLM调用；
+    任务结果的 symbols 为每只股票的状态，llm_stats 记录请求数、token用量和每只股票的耗时，便于和逐只调用对比。
+    """
     db = SessionLocal()
     
     try:
@@ -27,91 +78,97 @@ def analyze_batch_stocks(self, task_id: str, symbols: List[str], analysis_types:
         task.started_at = datetime.now()
         db.commit()
         
-        stock_service = StockDataService()
-        ai_service = AIAnalysisService()
+        stock_service = worker_state.stock_service()
+        ai_service = worker_state.ai_service()
         
         results = {}
         total_symbols = len(symbols)
+        batch_size = max(LLM_BATCH_SIZE, 1)
+        started = time.perf_counter()
+        llm_seconds = 0.0
         
-        for i, symbol in enumerate(symbols):
+        for offset in range(0, total_symbols, batch_size):
+            chunk = symbols[offset:offset + batch_size]
+            
+            # 更新进度
+            task.progress = int((offset / total_symbols) * 100)
+            db.commit()
+            
+            # 先收集本批所有股票的数据
+            prepared = {}
+            for symbol in chunk:
+                try:
+                    stock, analysis_data = _prepare_stock_data(db, stock_service, symbol)
+                    if stock is None:
+                        results[symbol] = {"error": "无法获取股票信息"}
+                        continue
+                    prepared[symbol] = (stock, analysis_data)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"获取股票数据失败 {symbol}: {e}")
+                    results[symbol] = {"error": str(e)}
+            
+            if not prepared:
+                continue
+            
+            # 执行AI分析
+            llm_started = time.perf_counter()
             try:
-                # 更新进度
-                progress = int((i / total_symbols) * 100)
-                task.progress = progress
-                db.commit()
-                
-                # 获取股票数据
-                stock_info = stock_service.get_stock_info(symbol)
-                if not stock_info:
-                    results[symbol] = {"error": "无法获取股票信息"}
-                    continue
-                
-                # 获取或创建股票记录
-                stock = db.query(Stock).filter(Stock.symbol == symbol).first()
-                if not stock:
-                    stock = Stock(
-                        symbol=symbol,
-                        name=stock_info["name"],
-                        exchange=stock_info["exchange"],
-                        sector=stock_info["sector"],
-                        industry=stock_info["industry"]
+                if batch_size > 1:
+                    analyses = ai_service.generate_batch_analysis(
+                        {symbol: data for symbol, (_, data) in prepared.items()}
                     )
-                    db.add(stock)
-                    db.commit()
-                    db.refresh(stock)
-                
-                # 获取历史数据并保存
-                historical_data = stock_service.get_historical_data(symbol, "1y")
-                if historical_data is not None:
-                    stock_service.save_stock_data(symbol, historical_data)
-                
-                # 执行AI分析
-                chart_data = stock_service.get_chart_data(symbol)
-                analysis_data = {
-                    "stock_info": stock_info,
-                    "indicators": chart_data.get("indicators", {})
-                }
-                
-                comprehensive_analysis = ai_service.generate_comprehensive_analysis(symbol, analysis_data)
-                
-                # 保存分析结果
-                for analysis_type in analysis_types:
-                    if analysis_type in comprehensive_analysis.get("comprehensive_analysis", {}):
-                        content = comprehensive_analysis["comprehensive_analysis"][analysis_type]
-                        
-                        # 删除旧的分析结果
-                        db.query(AIAnalysis).filter(
-                            AIAnalysis.stock_id == stock.id,
-                            AIAnalysis.analysis_type == analysis_type
-                        ).delete()
-                        
-                        # 创建新的分析结果
-                        analysis = AIAnalysis(
-                            stock_id=stock.id,
-                            analysis_type=analysis_type,
-                            analysis_content=content,
-                            confidence_score=content.get("confidence", 0.7),
-                            tags=content.get("tags", []),
-                            valid_until=datetime.now() + timedelta(hours=24)
-                        )
-                        db.add(analysis)
-                
-                db.commit()
-                results[symbol] = {"status": "completed", "analyses": len(analysis_types)}
-                
+                else:
+                    analyses = {
+                        symbol: ai_service.generate_comprehensive_analysis(symbol, data)
+                        for symbol, (_, data) in prepared.items()
+                    }
             except Exception as e:
-                logger.error(f"分析股票失败 {symbol}: {e}")
-                results[symbol] = {"error": str(e)}
+                logger.error(f"AI分析失败 {list(prepared)}: {e}")
+                for symbol in prepared:
+                    results[symbol] = {"error": str(e)}
                 continue
+            finally:
+                llm_seconds += time.perf_counter() - llm_started
+            
+            # 保存分析结果
+            for symbol, (stock, _) in prepared.items():
+                try:
+                    _save_analyses(db, stock, analyses.get(symbol, {}), analysis_types)
+                    results[symbol] = {"status": "completed", "analyses": len(analysis_types)}
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"分析股票失败 {symbol}: {e}")
+                    results[symbol] = {"error": str(e)}
+        
+        wall_seconds = time.perf_counter() - started
+        analyzed = max(sum(1 for r in results.values() if "error" not in r), 1)
+        usage = ai_service.usage
+        llm_stats = {
+            "batch_mode": batch_size > 1,
+            "batch_size": batch_size,
+            "requests": usage["requests"],
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["total_tokens"],
+            "rule_based": usage["rule_based"],
+            "reused": usage["reused"],
+            "llm_seconds": round(llm_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "requests_per_symbol": round(usage["requests"] / analyzed, 2),
+            "tokens_per_symbol": round(usage["total_tokens"] / analyzed, 1),
+            "seconds_per_symbol": round(wall_seconds / analyzed, 2)
+        }
         
         # 完成任务
         task.status = "completed"
         task.progress = 100
         task.completed_at = datetime.now()
-        task.result = results
+        # 每只股票的结果放在 symbols 下，统计信息单独存放，不和股票代码混在一起
+        task.result = {"symbols": results, "llm_stats": llm_stats}
         db.commit()
         
-        logger.info(f"批量分析任务完成: {task_id}")
+        logger.info(f"批量分析任务完成: {task_id}, LLM统计: {llm_stats}")
         
     except Exception as e:
         logger.error(f"批量分析任务失败 {task_id}: {e}")
@@ -140,7 +197,7 @@ def scan_market_opportunities(self, task_id: str, sector: Optional[str] = None,
         # 示例股票列表
         market_symbols = ["AAPL", "GOOGL", "MSFT", "AMZN", "TSLA", "META", "NVDA"]
         
-        recommendation_service = RecommendationService()
+        recommendation_service = worker_state.recommendation_service()
         opportunities = []
         
         for i, symbol in enumerate(market_symbols):
@@ -179,13 +236,93 @@ def scan_market_opportunities(self, task_id: str, sector: Optional[str] = None,
     finally:
         db.close()
 
+@celery_app.task(bind=True)
+def regenerate_recommendations(self, task_id: str, symbols: Optional[List[str]] = None, sector: Optional[str] = None,
+                               exchange: Optional[str] = None, analyzed_only: bool = False):
+    """批量重新生成推荐：全部股票或按条件筛选，分批评分并批量写入"""
+    db = SessionLocal()
+    task = None
+    try:
+        task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+        if not task:
+            return
+        
+        task.status = "running"
+        task.started_at = datetime.now()
+        db.commit()
+        started = time.perf_counter()
+        
+        # 只取评分和写入需要的列；整行实体会在每批提交进度后过期，再次访问时逐行重新加载
+        query = db.query(Stock.id, Stock.symbol, Stock.sector)
+        if symbols:
+            query = query.filter(Stock.symbol.in_([symbol.upper() for symbol in symbols]))
+        if sector:
+            query = query.filter(Stock.sector == sector)
+        if exchange:
+            query = query.filter(Stock.exchange == exchange)
+        if analyzed_only:
+            # 只处理最近一天有分析结果的股票
+            analyzed = db.query(AIAnalysisLatest.stock_id).filter(
+                AIAnalysisLatest.analysis_created_at >= datetime.now() - timedelta(days=1)
+            )
+            query = query.filter(Stock.id.in_(analyzed))
+        stocks = query.order_by(Stock.id).all()
+        
+        recommendation_service = worker_state.recommendation_service()
+        saved = 0
+        failed = []
+        distribution = {}
+        for offset in range(0, len(stocks), RECOMMENDATION_BULK_CHUNK):
+            chunk = stocks[offset:offset + RECOMMENDATION_BULK_CHUNK]
+            try:
+                # 窗口内没有行情的股票不再逐只回退查询，动量按中性计
+                scores = recommendation_service.score_stocks(chunk, fallback=False)
+                saved += recommendation_service.save_recommendations(chunk, scores)
+            except Exception as e:
+                logger.error(f"批量生成推荐失败（第 {offset // RECOMMENDATION_BULK_CHUNK + 1} 批）: {e}")
+                failed.extend(stock.symbol for stock in chunk)
+                continue
+            for stock, score_data in zip(chunk, scores):
+                if "error" in score_data:
+                    failed.append(stock.symbol)
+                else:
+                    distribution[score_data["recommendation"]] = distribution.get(score_data["recommendation"], 0) + 1
+            task.progress = int(min(offset + len(chunk), len(stocks)) / len(stocks) * 100)
+            db.commit()
+        
+        elapsed = time.perf_counter() - started
+        task.status = "completed"
+        task.progress = 100
+        task.completed_at = datetime.now()
+        task.result = {
+            "stocks": len(stocks),
+            "saved": saved,
+            "failed": failed[:100],
+            "failed_count": len(failed),
+            "distribution": distribution,
+            "elapsed_seconds": round(elapsed, 2)
+        }
+        db.commit()
+        logger.info(f"批量生成推荐完成: {saved}/{len(stocks)} 只股票，耗时 {elapsed:.1f}s")
+        
+    except Exception as e:
+        logger.error(f"批量生成推荐失败 {task_id}: {e}")
+        if task is not None:
+            db.rollback()
+            task.status = "failed"
+            task.error_message = str(e)
+            db.commit()
+        
+    finally:
+        db.close()
+
 @celery_app.task
 def update_market_data():
     """定时更新市场数据"""
     db = SessionLocal()
     try:
         stocks = db.query(Stock).all()
-        stock_service = StockDataService()
+        stock_service = worker_state.stock_service()
         
         for stock in stocks:
             try:
@@ -195,19 +332,34 @@ def update_market_data():
             except Exception as e:
                 logger.error(f"更新失败 {stock.symbol}: {e}")
                 
+        # 行情已更新，本进程的价格面板在下次使用时重新加载
+        worker_state.price_panel.invalidate()
         logger.info("市场数据更新完成")
     finally:
         db.close()
 
 @celery_app.task
 def cleanup_expired_analysis():
-    """清理过期数据"""
+    """清理过期数据：PostgreSQL上删除过期分区并预建未来分区，其他数据库按行删除"""
+    result = drop_expired_partitions(engine)
+    logger.info(f"清理过期分析: {result}")
+
+@celery_app.task
+def sweep_recommendation_rollups():
+    """从推荐汇总中扣除刚过期的推荐"""
     db = SessionLocal()
     try:
-        expired_count = db.query(AIAnalysis).filter(
-            AIAnalysis.valid_until < datetime.now()
-        ).delete()
-        db.commit()
-        logger.info(f"清理了 {expired_count} 条过期分析")
+        expired = RecommendationRollupStore(db).sweep_expired()
+        if expired:
+            logger.info(f"推荐汇总扣除 {expired} 条过期推荐")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@celery_app.task
+def rebuild_recommendation_rollups():
+    """按推荐表重建推荐汇总，校正行业变更等增量无法覆盖的偏差"""
+    db = SessionLocal()
+    try:
+        RecommendationRollupStore(db).rebuild()
+    finally:
+        db.close()
@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init, worker_process_shutdown
+
+from .database import SessionLocal, engine
+from .redis_client import reset_redis
+from .lazy_imports import warm_up
+from . import metrics
+from . import db_instrumentation
+from . import profiling
+from .services.stock_service import StockDataService
+from .services.ai_service import AIAnalysisService
+from .services.recommendation_service import RecommendationService
+from .services.price_store import PricePanel
+from .services.symbol_extractor import get_symbol_extractor
+
+logger = logging.getLogger(__name__)
+
+# worker 子进程启动时预先创建服务、加载名称映射词典和价格面板
+WORKER_PRELOAD = os.getenv("WORKER_PRELOAD", "true").lower() == "true"
+
+class WorkerState:
+    """Celery worker 子进程内长期复用的服务对象
+
+    服务（及其 OpenAI 客户端、提示词模板、数据库会话对象）每个进程只创建一次，
+    任务结束后只释放会话占用的连接；进程号变化（fork 之后）时全部丢弃重建。
+    服务对象不是线程安全的，假定每个进程同时只执行一个任务（prefork/solo 池）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._services: Dict[str, Any] = {}
+        self.price_panel = PricePanel()
+        self.preloaded_at: Optional[float] = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # 父进程中创建的对象持有父进程的连接，不能在子进程中使用
+            self._services = {}
+            self.price_panel = PricePanel()
+            self.preloaded_at = None
+            self._pid = os.getpid()
+
+    def _get(self, name: str, factory):
+        self._check_pid()
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = factory()
+                    self._services[name] = service
+        return service
+
+    def stock_service(self) -> StockDataService:
+        return self._get("stock", StockDataService)
+
+    def ai_service(self) -> AIAnalysisService:
+        """AI分析服务，调用统计在每次获取时清零，便于按任务汇总"""
+        service = self._get("ai", AIAnalysisService)
+        service.reset_usage()
+        return service
+
+    def recommendation_service(self) -> RecommendationService:
+        service = self._get("recommendation", lambda: RecommendationService(price_panel=self.price_panel))
+        if self.price_panel.stale:
+            self.refresh_price_panel()
+        return service
+
+    def refresh_price_panel(self):
+        session = SessionLocal()
+        try:
+            count = self.price_panel.load(session)
+            logger.info(f"价格面板已加载: {count} 只股票")
+        except Exception as e:
+            logger.error(f"加载价格面板失败: {e}")
+        finally:
+            session.close()
+
+    def preload(self):
+        """创建服务并加载名称映射词典和价格面板"""
+        started = time.perf_counter()
+        warm_up()
+        steps = {
+            "stock_service": self.stock_service,
+            "ai_service": self.ai_service,
+            "recommendation_service": self.recommendation_service,
+            "symbol_extractor": self._load_symbol_extractor,
+        }
+        for name, step in steps.items():
+            try:
+                step()
+            except Exception as e:
+                logger.error(f"预加载 {name} 失败，将在首次使用时重试: {e}")
+        self.release_sessions()
+        self.preloaded_at = time.time()
+        logger.info(f"worker 进程 {os.getpid()} 预加载完成，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def _load_symbol_extractor(self):
+        session = SessionLocal()
+        try:
+            get_symbol_extractor(session)
+        finally:
+            session.close()
+
+    def release_sessions(self):
+        """回滚未提交的事务并归还连接，会话对象保留给下一个任务"""
+        for name, service in list(self._services.items()):
+            close = getattr(service, "close", None)
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"释放 {name} 服务的数据库会话失败: {e}")
+
+    def reset(self):
+        self._services = {}
+        self.price_panel = PricePanel()
+        self.preloaded_at = None
+        self._pid = os.getpid()
+
+worker_state = WorkerState()
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """prefork 子进程启动：丢弃继承自父进程的连接池和客户端，然后预加载"""
+    engine.dispose(close=False)
+    reset_redis()
+    worker_state.reset()
+    if WORKER_PRELOAD:
+        worker_state.preload()
+
+@worker_init.connect
+def init_worker(**kwargs):
+    """worker 主进程启动：开启指标导出端口"""
+    try:
+        metrics.start_worker_exporter()
+    except Exception as e:
+        logger.error(f"启动指标导出端口失败: {e}")
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    metrics.mark_process_dead()
+
+# 正在执行的任务的SQL统计 token 和采样会话，按任务ID记录
+_query_tokens: Dict[str, Any] = {}
+_profiles: Dict[str, Any] = {}
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    metrics.task_started(task_id)
+    _query_tokens[task_id] = db_instrumentation.start_tracking(f"task {getattr(task, 'name', 'unknown')}[{task_id}]")
+    _profiles[task_id] = profiling.start_profile(
+        "task", f"{getattr(task, 'name', 'unknown')}[{task_id}]", profiling.PROFILE_SLOW_TASK_MS
+    )
+
+@task_postrun.connect
+def release_after_task(task_id=None, task=None, state=None, **kwargs):
+    metrics.task_finished(task_id, getattr(task, "name", "unknown"), state)
+    query_stats = db_instrumentation.current_stats()
+    profiling.finish_profile(
+        _profiles.pop(task_id, None),
+        {"state": state, "sql": query_stats.summary() if query_stats else None}
+    )
+    token = _query_tokens.pop(task_id, None)
+    if token is not None:
+        try:
+            db_instrumentation.stop_tracking(token)
+        except ValueError:
+            # token 不属于当前上下文（信号在不同上下文中触发），放弃本次统计
+            pass
+    worker_state.release_sessions()
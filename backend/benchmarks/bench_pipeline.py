@@ -0,0 +1,318 @@
+"""离线端到端基准：分析链路各阶段和主要接口的吞吐
+
+不访问外网，所有外部依赖都换成本地替身：
+- 数据库：默认临时 SQLite，也可以通过 --database-url 指向本地 PostgreSQL；
+- LLM：在本进程内启动 llm_stub，延迟由 --llm-latency 指定；
+- 行情：用合成的日K线（或 --bars-dir 目录下录制的 <代码>.csv）回放 yfinance 的 info/history。
+
+测量项：
+- calculate_technical_indicators、get_chart_data 及其 JSON 编码；
+- save_stock_data 写入行情；
+- generate_stock_score、find_potential_stocks；
+- 一次完整的 analyze_batch_stocks 任务；
+- 主要路由的吞吐（本进程内启动 uvicorn，多线程并发请求）。
+
+结果写成JSON（含版本号和运行环境），指定 --baseline 时与上一次的结果比较 p50，
+变慢超过 --tolerance 的条目会列出并以非零状态退出。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.bench_pipeline --stocks 20
+    python -m benchmarks.bench_pipeline --baseline benchmarks/results/pipeline-<rev>.json
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.common import (
+    RESULTS_DIR, compare_with_baseline, environment, measure, percentile, synthetic_bars, timing_summary, write_results
+)
+
+# history(period) 对应的交易日数
+PERIOD_DAYS = {"5d": 5, "1mo": 21, "3mo": 63, "6mo": 126, "1y": 252, "2y": 504, "5y": 1260}
+
+ANALYSIS_TYPES = ["technical", "fundamental", "sentiment"]
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ReplayTicker:
+    """yfinance.Ticker 的替身，从预先生成或录制的K线中返回 info 和 history"""
+
+    def __init__(self, symbol: str, bars: pd.DataFrame, seed: int):
+        self.symbol = symbol
+        self.bars = bars
+        self.seed = seed
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        close = float(self.bars["Close"].iloc[-1])
+        return {
+            "symbol": self.symbol,
+            "longName": f"Benchmark {self.symbol}",
+            "exchange": "NMS",
+            "sector": ("Technology", "Healthcare", "Financial Services", "Energy")[self.seed % 4],
+            "industry": "Benchmark",
+            "marketCap": int(close * 1e9),
+            "trailingPE": 10 + self.seed % 30,
+            "dividendYield": 0.01 * (self.seed % 4),
+            "beta": 0.8 + 0.1 * (self.seed % 6),
+            "fiftyTwoWeekHigh": float(self.bars["High"].tail(252).max()),
+            "fiftyTwoWeekLow": float(self.bars["Low"].tail(252).min()),
+            "currentPrice": close,
+        }
+
+    def history(self, period: str = "1mo", **kwargs) -> pd.DataFrame:
+        if period == "max":
+            return self.bars.copy()
+        return self.bars.tail(PERIOD_DAYS.get(period, 252)).copy()
+
+class ReplayMarket:
+    """按股票代码回放K线；未知代码的 info 抛错，和 yfinance 查不到代码时的表现一致"""
+
+    def __init__(self, symbols: List[str], years: int, bars_dir: Optional[str] = None):
+        self.frames: Dict[str, pd.DataFrame] = {}
+        for seed, symbol in enumerate(symbols):
+            path = Path(bars_dir) / f"{symbol}.csv" if bars_dir else None
+            if path is not None and path.exists():
+                self.frames[symbol] = pd.read_csv(path, index_col=0, parse_dates=True)
+            else:
+                self.frames[symbol] = synthetic_bars(years * 252, seed)
+
+    def ticker(self, symbol: str, session=None) -> ReplayTicker:
+        if symbol not in self.frames:
+            raise KeyError(f"回放数据中没有 {symbol}")
+        return ReplayTicker(symbol, self.frames[symbol], list(self.frames).index(symbol))
+
+def start_server(app, port: int):
+    """在后台线程中启动 uvicorn，返回 Server 对象"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 15
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"端口 {port} 上的服务启动超时")
+        time.sleep(0.05)
+    return server
+
+def bench_indicators(market: ReplayMarket, stock_service, rounds: int) -> Dict[str, Any]:
+    symbol = next(iter(market.frames))
+    frame = market.ticker(symbol).history("1y")
+    result = {"rows": len(frame)}
+    result["calculate_technical_indicators"] = measure(
+        lambda: stock_service.calculate_technical_indicators(frame.copy()), rounds
+    )
+    chart = stock_service.get_chart_data(symbol, "1y")
+    result["get_chart_data"] = measure(lambda: stock_service.get_chart_data(symbol, "1y"), rounds)
+    result["chart_json_encode"] = measure(lambda: json.dumps(chart, ensure_ascii=False), rounds)
+    result["chart_json_bytes"] = len(json.dumps(chart, ensure_ascii=False).encode("utf-8"))
+    return result
+
+def bench_ingest(market: ReplayMarket, stock_service) -> Dict[str, Any]:
+    """首次写入（含创建股票记录）和重复写入同样的K线"""
+    result = {}
+    for phase in ("initial", "rewrite"):
+        rows, samples = 0, []
+        for symbol, frame in market.frames.items():
+            started = time.perf_counter()
+            if not stock_service.save_stock_data(symbol, frame):
+                raise RuntimeError(f"写入 {symbol} 行情失败")
+            samples.append(time.perf_counter() - started)
+            rows += len(frame)
+        result[phase] = {**timing_summary(samples), "rows": rows, "rows_per_second": int(rows / sum(samples))}
+    return result
+
+def bench_batch_analysis(symbols: List[str]) -> Dict[str, Any]:
+    """同步执行一次完整的 analyze_batch_stocks（含取数、入库、LLM调用和保存分析）"""
+    from app.database import SessionLocal
+    from app.models import AnalysisTask
+    from app.tasks import analyze_batch_stocks
+
+    task_id = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        db.add(AnalysisTask(task_id=task_id, task_type="batch_stocks", symbols=symbols, status="pending"))
+        db.commit()
+        started = time.perf_counter()
+        analyze_batch_stocks.apply(args=[task_id, symbols, ANALYSIS_TYPES])
+        wall = time.perf_counter() - started
+        db.expire_all()
+        task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+        if task.status != "completed":
+            raise RuntimeError(f"批量分析任务失败: {task.error_message}")
+        result = dict(task.result or {})
+        errors = [s for s in symbols if "error" in result.get("symbols", {}).get(s, {})]
+        return {
+            "symbols": len(symbols),
+            "wall_seconds": round(wall, 3),
+            "seconds_per_symbol": round(wall / len(symbols), 3),
+            "errors": len(errors),
+            "llm_stats": result.get("llm_stats", {}),
+        }
+    finally:
+        db.close()
+
+def bench_scoring(symbols: List[str], rounds: int) -> Dict[str, Any]:
+    from app.services.recommendation_service import RecommendationService
+    service = RecommendationService()
+    try:
+        return {
+            "generate_stock_score": measure(lambda: service.generate_stock_score(symbols[0]), rounds),
+            "find_potential_stocks": measure(lambda: service.find_potential_stocks(limit=10), rounds),
+            "candidates": len(service.find_potential_stocks(limit=len(symbols))),
+        }
+    finally:
+        service.close()
+
+def api_routes(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    symbol = symbols[0]
+    return {
+        "GET /stocks/{symbol}": {"method": "GET", "path": f"/api/v1/stocks/{symbol}"},
+        "GET /stocks/{symbol}/chart": {"method": "GET", "path": f"/api/v1/stocks/{symbol}/chart"},
+        "GET /stocks/{symbol}/analysis": {"method": "GET", "path": f"/api/v1/stocks/{symbol}/analysis"},
+        "GET /recommendations/": {"method": "GET", "path": "/api/v1/recommendations/"},
+        "GET /recommendations/potential": {"method": "GET", "path": "/api/v1/recommendations/potential"},
+        "GET /recommendations/{symbol}/score": {"method": "GET", "path": f"/api/v1/recommendations/{symbol}/score"},
+        "GET /tasks/": {"method": "GET", "path": "/api/v1/tasks/"},
+        "POST /analysis/query": {
+            "method": "POST", "path": "/api/v1/analysis/query",
+            "json": {"message": f"{symbol} 最近走势怎么样，适合买入吗？"},
+        },
+    }
+
+def bench_api(base_url: str, routes: Dict[str, Dict[str, Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """每个路由按给定并发发送 requests 个请求，统计吞吐、延迟和错误数"""
+    import httpx
+
+    result = {}
+    with httpx.Client(base_url=base_url, timeout=60,
+                      limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)) as client:
+        for name, route in routes.items():
+            def call(_):
+                started = time.perf_counter()
+                try:
+                    response = client.request(route["method"], route["path"], json=route.get("json"))
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                return time.perf_counter() - started, ok
+
+            call(0)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(call, range(requests)))
+            wall = time.perf_counter() - started
+            samples = [elapsed for elapsed, _ in outcomes]
+            result[name] = {
+                **timing_summary(samples),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+                "requests_per_second": round(requests / wall, 1),
+                "errors": sum(1 for _, ok in outcomes if not ok),
+            }
+    return result
+
+def configure_environment(args):
+    """在导入 app 之前设置数据库、LLM地址等环境变量"""
+    if not args.database_url:
+        args.database_url = f"sqlite:///{tempfile.mkdtemp(prefix='bench_pipeline_')}/bench.db"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["LLM_STUB_LATENCY"] = args.llm_latency
+    os.environ["LLM_STUB_STREAM_CHUNK_DELAY_MS"] = "0"
+    os.environ["LLM_STUB_SEED"] = "42"
+    os.environ["IMPORT_WARMUP_MODULES"] = ""
+    os.environ["AUTO_MIGRATE"] = "false"
+    # 不依赖本地 Redis：指向不可达端口，缓存走本地回退
+    os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:1/0")
+    os.environ.setdefault("WORKER_PRELOAD", "false")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=20, help="参与基准的股票数")
+    parser.add_argument("--years", type=int, default=2, help="每只股票合成的K线年数")
+    parser.add_argument("--bars-dir", help="录制的K线目录，<代码>.csv，缺失的代码使用合成数据")
+    parser.add_argument("--database-url", help="默认使用临时 SQLite")
+    parser.add_argument("--llm-latency", default="fixed:50", help="llm_stub 延迟分布，如 lognormal:1200,0.5")
+    parser.add_argument("--llm-port", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=20, help="单项测量的重复次数")
+    parser.add_argument("--api-requests", type=int, default=200, help="每个路由的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/pipeline-<版本>.json")
+    parser.add_argument("--baseline", help="用于比较的上一次结果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p50 允许变慢的比例")
+    args = parser.parse_args()
+    args.llm_port = args.llm_port or _free_port()
+    configure_environment(args)
+
+    from llm_stub.server import app as llm_app
+    from app.migrate import run_migrations
+    from app.services import stock_service as stock_module
+    from app.worker_state import worker_state
+
+    if not run_migrations():
+        sys.exit("数据库迁移失败")
+
+    symbols = [f"BENCH{i:03d}" for i in range(args.stocks)]
+    market = ReplayMarket(symbols, args.years, args.bars_dir)
+    # 在 yfinance 调用点替换为回放数据，其余链路（重试、指标、入库）保持不变
+    stock_module._ticker = market.ticker
+
+    llm_server = start_server(llm_app, args.llm_port)
+    api_server = None
+    results = {
+        **environment(),
+        "config": {
+            "database": args.database_url.split(":", 1)[0],
+            "stocks": args.stocks,
+            "bars_per_stock": len(next(iter(market.frames.values()))),
+            "llm_latency": args.llm_latency,
+            "rounds": args.rounds,
+            "api_requests": args.api_requests,
+            "concurrency": args.concurrency,
+        },
+        "benchmarks": {},
+    }
+    benchmarks = results["benchmarks"]
+    try:
+        stock_service = worker_state.stock_service()
+        benchmarks["ingest"] = bench_ingest(market, stock_service)
+        benchmarks["indicators"] = bench_indicators(market, stock_service, args.rounds)
+        benchmarks["analyze_batch_stocks"] = bench_batch_analysis(symbols)
+        benchmarks["scoring"] = bench_scoring(symbols, max(args.rounds // 4, 3))
+        if not args.skip_api:
+            from app.main import app as api_app
+            api_port = _free_port()
+            api_server = start_server(api_app, api_port)
+            benchmarks["api"] = bench_api(
+                f"http://127.0.0.1:{api_port}", api_routes(symbols), args.api_requests, args.concurrency
+            )
+    finally:
+        for server in (api_server, llm_server):
+            if server is not None:
+                server.should_exit = True
+
+    regressions = compare_with_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    if args.baseline:
+        results["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "regressions": regressions}
+    write_results(results, args.output or str(RESULTS_DIR / f"pipeline-{results['revision']}.json"))
+    if regressions:
+        sys.exit(f"{len(regressions)} 项基准比基线慢 {args.tolerance:.0%} 以上")
+
+if __name__ == "__main__":
+    main()
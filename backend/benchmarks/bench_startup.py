@@ -0,0 +1,143 @@
+"""启动耗时基准：导入耗时预算 + 首个请求耗时
+
+1. 用 python -X importtime 分别导入 app.main（API）和 app.tasks（Celery worker），
+   统计总导入耗时和最慢的模块，并检查 pandas/numpy/yfinance/openai 等重量级模块没有在导入阶段加载；
+2. 启动 uvicorn 子进程，测量从启动到 /health 返回 200 的时间。
+
+超出预算或重量级模块被提前导入时以非零状态退出，可以放进 CI 防止启动变慢。
+导入阶段不需要数据库；首个请求阶段默认使用临时 SQLite，且关闭后台预热。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.bench_startup --import-budget-ms 2500 --first-request-budget-ms 4000
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# 不允许在导入阶段加载的模块（应在首次使用时延迟导入）
+HEAVY_MODULES = ("pandas", "numpy", "yfinance", "openai", "sklearn", "plotly", "kaleido")
+
+ENTRYPOINTS = {"api": "app.main", "worker": "app.tasks"}
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def _env(database_url: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env["IMPORT_WARMUP_MODULES"] = ""
+    env["AUTO_MIGRATE"] = "false"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BACKEND_DIR), env.get("PYTHONPATH")]))
+    return env
+
+def measure_import(module: str, env: dict, top: int) -> dict:
+    """用 -X importtime 导入模块，返回总耗时、最慢模块和提前加载的重量级模块"""
+    code = (
+        f"import json, sys, {module}; "
+        f"print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))"
+    )
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent)))
+    # 缩进最浅的条目是顶层导入，它们的累计耗时之和即总导入耗时
+    min_indent = min((e[3] for e in entries), default=0)
+    total_us = sum(e[2] for e in entries if e[3] == min_indent)
+    slowest = sorted(entries, key=lambda e: e[2], reverse=True)[:top]
+    return {
+        "module": module,
+        "import_ms": round(total_us / 1000, 1),
+        "process_wall_ms": round(wall_ms, 1),
+        "modules_imported": len(entries),
+        "heavy_modules_loaded": json.loads(proc.stdout.strip().splitlines()[-1]),
+        "slowest": [{"module": n, "cumulative_ms": round(c / 1000, 1), "self_ms": round(s / 1000, 1)}
+                    for n, s, c, _ in slowest],
+    }
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_request(env: dict, timeout: float) -> dict:
+    """启动 uvicorn，测量到 /health 首次返回 200 的时间"""
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn 提前退出:\n{proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return {"first_request_ms": round((time.perf_counter() - started) * 1000, 1)}
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"{timeout}s 内 /health 未就绪")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-budget-ms", type=float, default=2500)
+    parser.add_argument("--first-request-budget-ms", type=float, default=4000)
+    parser.add_argument("--skip-first-request", action="store_true", help="只测导入耗时（未安装 uvicorn 时使用）")
+    parser.add_argument("--database-url", help="默认使用临时 SQLite 文件")
+    parser.add_argument("--top", type=int, default=10, help="输出最慢的模块数")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="结果JSON文件路径")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _env(args.database_url or f"sqlite:///{tmp}/startup.db")
+        results = {"imports": {name: measure_import(module, env, args.top) for name, module in ENTRYPOINTS.items()}}
+        if not args.skip_first_request:
+            results["api"] = measure_first_request(env, args.timeout)
+
+    failures = []
+    for name, result in results["imports"].items():
+        if result["import_ms"] > args.import_budget_ms:
+            failures.append(f"{name} 导入耗时 {result['import_ms']}ms 超出预算 {args.import_budget_ms}ms")
+        if result["heavy_modules_loaded"]:
+            failures.append(f"{name} 导入阶段加载了重量级模块: {', '.join(result['heavy_modules_loaded'])}")
+    if "api" in results and results["api"]["first_request_ms"] > args.first_request_budget_ms:
+        failures.append(f"首个请求耗时 {results['api']['first_request_ms']}ms 超出预算 {args.first_request_budget_ms}ms")
+    results["failures"] = failures
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
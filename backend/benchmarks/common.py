@@ -0,0 +1,107 @@
+"""基准测试共用的合成数据、统计和结果读写"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+def synthetic_bars(days: int, seed: int, end: Optional[date] = None) -> pd.DataFrame:
+    """生成几何布朗运动的日K线"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=end or date.today(), periods=days)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, days)))
+    open_ = close * (1 + rng.normal(0, 0.005, days))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, days)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, days)))
+    volume = rng.integers(1_000_000, 50_000_000, days)
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume}, index=index)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+def timing_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+    }
+
+def measure(func: Callable[[], Any], rounds: int, warmup: int = 1) -> Dict[str, Any]:
+    """预热后重复执行 rounds 次，返回耗时分布"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return timing_summary(samples)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def environment() -> Dict[str, Any]:
+    """记录结果时附带的版本和运行环境，便于跨版本对比时确认条件一致"""
+    return {
+        "revision": git_revision(),
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+def write_results(results: Dict[str, Any], output: Optional[str]):
+    """打印结果JSON，output 不为空时同时写入文件"""
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+def flatten_timings(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """把嵌套结果中的 p50_ms（只跑一次的项取 wall_seconds）展开为 {"路径": 毫秒}，用于和基线比较"""
+    flat: Dict[str, float] = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            if "p50_ms" in value:
+                flat[path] = value["p50_ms"]
+            elif "wall_seconds" in value:
+                flat[path] = value["wall_seconds"] * 1000
+            else:
+                flat.update(flatten_timings(value, path))
+    return flat
+
+def compare_with_baseline(results: Dict[str, Any], baseline_path: str, tolerance: float) -> List[Dict[str, Any]]:
+    """与基线结果比较 p50，返回变慢超过 tolerance（比例）的条目"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = flatten_timings(json.load(f).get("benchmarks", {}))
+    current = flatten_timings(results.get("benchmarks", {}))
+    regressions = []
+    for path, value in current.items():
+        before = baseline.get(path)
+        if before and value > before * (1 + tolerance):
+            regressions.append({"benchmark": path, "baseline_p50_ms": before, "p50_ms": value,
+                                "ratio": round(value / before, 2)})
+    return regressions
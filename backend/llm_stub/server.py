@@ -0,0 +1,361 @@
+"""OpenAI 兼容的本地LLM桩服务
+
+用于在没有外网的情况下压测 AI 分析链路（analyze_batch_stocks、/analysis/query、Celery 流水线）。
+实现 /v1/chat/completions（含 stream=true），按提示词识别分析类型返回固定结构的JSON，
+并按配置注入延迟和错误。
+
+启动: uvicorn llm_stub.server:app --host 0.0.0.0 --port 9000
+然后设置 OPENAI_BASE_URL=http://localhost:9000/v1
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="LLM Stub", version="1.0.0")
+
+# 各延迟分布的参数个数范围（毫秒）：fixed:值、uniform:下限,上限、normal:均值,标准差、lognormal:中位数[,sigma]
+LATENCY_PARAM_COUNTS = {"fixed": (0, 1), "uniform": (2, 2), "normal": (2, 2), "lognormal": (1, 2)}
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """解析 "分布:参数1,参数2" 形式的延迟配置，格式不对时抛出 ValueError"""
+    kind, _, params = spec.partition(":")
+    if kind not in LATENCY_PARAM_COUNTS:
+        raise ValueError(f"不支持的延迟分布: {spec}")
+    values = [float(v) for v in params.split(",") if v.strip()] if params else []
+    low, high = LATENCY_PARAM_COUNTS[kind]
+    if not low <= len(values) <= high:
+        raise ValueError(f"延迟分布 {kind} 需要 {low}~{high} 个参数: {spec}")
+    return kind, values
+
+class StubConfig:
+    """桩服务配置，可通过环境变量或 POST /config 修改"""
+
+    def __init__(self):
+        self.latency = os.getenv("LLM_STUB_LATENCY", "lognormal:1200,0.5")
+        self.chunk_delay_ms = float(os.getenv("LLM_STUB_STREAM_CHUNK_DELAY_MS", "15"))
+        self.chunk_size = int(os.getenv("LLM_STUB_STREAM_CHUNK_SIZE", "8"))
+        self.error_rate = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+        self.error_statuses = [int(s) for s in os.getenv("LLM_STUB_ERROR_STATUSES", "429,500,503").split(",") if s.strip()]
+        self.random = random.Random(os.getenv("LLM_STUB_SEED"))
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样首包延迟（秒）"""
+        kind, values = parse_latency(self.latency)
+        if kind == "fixed":
+            ms = values[0] if values else 0.0
+        elif kind == "uniform":
+            ms = self.random.uniform(values[0], values[1])
+        elif kind == "normal":
+            ms = self.random.gauss(values[0], values[1])
+        elif kind == "lognormal":
+            # 参数为中位数（毫秒）和 sigma
+            ms = values[0] * self.random.lognormvariate(0.0, values[1] if len(values) > 1 else 0.5)
+        return max(ms, 0.0) / 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "chunk_delay_ms": self.chunk_delay_ms,
+            "chunk_size": self.chunk_size,
+            "error_rate": self.error_rate,
+            "error_statuses": self.error_statuses,
+        }
+
+config = StubConfig()
+
+class StubStats:
+    """请求统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.streams = 0
+        self.by_type: Dict[str, int] = {}
+        self.completion_tokens = 0
+
+    def record(self, analysis_type: str, stream: bool, error: bool = False, tokens: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.streams += int(stream)
+            self.errors += int(error)
+            self.by_type[analysis_type] = self.by_type.get(analysis_type, 0) + 1
+            self.completion_tokens += tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "streams": self.streams,
+                "by_type": dict(self.by_type),
+                "completion_tokens": self.completion_tokens,
+            }
+
+stats = StubStats()
+
+def estimate_tokens(text: str) -> int:
+    cjk = sum(1 for c in text if "\u2e80" <= c <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+def detect_analysis_type(prompt: str) -> str:
+    """根据提示词识别请求类型，与 AIAnalysisService 的模板对应"""
+    if "返回一个JSON数组" in prompt:
+        return "batch"
+    markers = [
+        ("技术分析师", "technical"),
+        ("基本面分析师", "fundamental"),
+        ("市场情绪分析师", "sentiment"),
+        ("资深投资顾问", "recommendation"),
+        ("回答用户问题", "query"),
+        ("请比较以下股票", "comparison"),
+    ]
+    for marker, analysis_type in markers:
+        if marker in prompt:
+            return analysis_type
+    return "generic"
+
+def _rng(*parts: Any) -> random.Random:
+    """按股票代码等参数生成确定性的随机数，使同一股票的回答保持一致"""
+    return random.Random(zlib.crc32("|".join(str(p) for p in parts).encode()))
+
+def _field(prompt: str, label: str) -> Optional[str]:
+    match = re.search(rf"{label}:\s*(\S+)", prompt)
+    return match.group(1) if match else None
+
+def _float(value: Any, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def canned_analysis(analysis_type: str, symbol: str, price: float) -> Dict[str, Any]:
+    """每种分析类型的固定结构结果"""
+    rng = _rng(symbol, analysis_type)
+    confidence = round(rng.uniform(0.55, 0.9), 2)
+    if analysis_type == "technical":
+        return {
+            "overall_sentiment": rng.choice(["bullish", "bearish", "neutral"]),
+            "key_levels": {"support": round(price * 0.95, 2), "resistance": round(price * 1.06, 2)},
+            "short_term_outlook": f"{symbol} 短期在支撑位和阻力位之间震荡，关注成交量变化。",
+            "risk_factors": ["市场整体波动", "成交量不足"],
+            "confidence": confidence,
+        }
+    if analysis_type == "fundamental":
+        return {
+            "fundamental_score": rng.randint(40, 90),
+            "investment_thesis": f"{symbol} 基本面稳定，估值处于行业中位水平。",
+            "competitive_advantages": ["品牌优势", "规模效应"],
+            "risk_factors": ["行业竞争加剧", "宏观经济放缓"],
+            "long_term_outlook": "长期前景取决于收入增长能否持续。",
+            "confidence": confidence,
+        }
+    if analysis_type == "sentiment":
+        return {
+            "sentiment_score": round(rng.uniform(-0.6, 0.8), 2),
+            "confidence_level": rng.choice(["low", "medium", "high"]),
+            "key_drivers": ["财报预期", "行业政策"],
+            "potential_catalysts": ["季度财报发布"],
+            "recommendation": "情绪中性偏多，可逢低关注。",
+        }
+    if analysis_type == "recommendation":
+        return {
+            "rating": rng.choice(["strong_buy", "buy", "hold", "sell"]),
+            "target_price_range": {"low": round(price * 0.97, 2), "high": round(price * 1.15, 2)},
+            "time_horizon": rng.choice(["short", "medium", "long"]),
+            "risk_level": rng.choice(["low", "medium", "high"]),
+            "action_plan": "分批建仓，严格执行止损。",
+            "stop_loss": round(price * 0.9, 2),
+            "confidence": confidence,
+        }
+    return {"analysis": f"{symbol} 的分析结果", "confidence": confidence}
+
+def _batch_items(prompt: str) -> Dict[str, Any]:
+    """取出批量提示词中按股票代码给出的数据"""
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data
+    return {}
+
+def build_content(prompt: str) -> Tuple[str, str]:
+    """返回 (请求类型, 回答文本)"""
+    analysis_type = detect_analysis_type(prompt)
+
+    if analysis_type == "batch":
+        titles = {"技术分析": "technical", "基本面分析": "fundamental", "市场情绪分析": "sentiment", "综合投资建议": "recommendation"}
+        batch_type = next((t for title, t in titles.items() if f"分别进行{title}" in prompt), "technical")
+        entries = []
+        for symbol, data in _batch_items(prompt).items():
+            price = _float(data.get("current_price") if isinstance(data, dict) else None, 100.0)
+            entries.append({"symbol": symbol, **canned_analysis(batch_type, symbol, price)})
+        return f"batch_{batch_type}", json.dumps(entries, ensure_ascii=False)
+
+    if analysis_type in ("technical", "fundamental", "sentiment", "recommendation"):
+        symbol = _field(prompt, "股票代码") or "UNKNOWN"
+        price = _float(_field(prompt, "当前价格"), 100.0)
+        return analysis_type, json.dumps(canned_analysis(analysis_type, symbol, price), ensure_ascii=False)
+
+    if analysis_type == "query":
+        symbols = re.findall(r'"([A-Z]{1,5}(?:\.[A-Z]{1,2})?)":\{', prompt)[:3]
+        answer = {
+            "answer": "根据提供的数据，" + ("、".join(symbols) if symbols else "当前市场") + " 整体表现平稳，短期需关注成交量和关键价位的突破情况。",
+            "analysis": "技术指标显示趋势中性，基本面没有明显变化。",
+            "recommendations": [{"symbol": s, "action": "hold", "rationale": "等待趋势确认"} for s in symbols],
+            "chart_suggestions": "建议查看日K线叠加20日均线。",
+            "references": ["技术指标", "近期分析结果"],
+        }
+        return analysis_type, json.dumps(answer, ensure_ascii=False)
+
+    if analysis_type == "comparison":
+        return analysis_type, json.dumps({
+            "analysis": "各股票风险收益特征不同，相关性较高的股票不宜同时重仓。",
+            "ranking": [],
+            "strategy": "按风险偏好分散配置。",
+        }, ensure_ascii=False)
+
+    return analysis_type, json.dumps({"answer": "stub response"}, ensure_ascii=False)
+
+def _error_response(status: int) -> JSONResponse:
+    messages = {429: "Rate limit reached", 500: "Internal server error", 503: "Service unavailable"}
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": messages.get(status, "Stub error"), "type": "stub_error", "code": status}},
+    )
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages: List[Dict[str, Any]] = body.get("messages") or []
+    prompt = "\n".join(str(m.get("content") or "") for m in messages)
+    model = body.get("model", "stub")
+    stream = bool(body.get("stream"))
+
+    analysis_type, content = build_content(prompt)
+    await asyncio.sleep(config.sample_latency())
+
+    if config.error_rate > 0 and config.random.random() < config.error_rate:
+        stats.record(analysis_type, stream, error=True)
+        return _error_response(config.random.choice(config.error_statuses or [500]))
+
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(content)
+    stats.record(analysis_type, stream, tokens=completion_tokens)
+    completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if not stream:
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def event_stream():
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        size = max(config.chunk_size, 1)
+        for start in range(0, len(content), size):
+            yield chunk({"content": content[start:start + size]})
+            if config.chunk_delay_ms:
+                await asyncio.sleep(config.chunk_delay_ms / 1000)
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": os.getenv("OPENAI_MODEL", "gpt-4.1-mini"), "object": "model", "owned_by": "stub"}]}
+
+@app.get("/stats")
+async def get_stats():
+    return {"config": config.to_dict(), "stats": stats.to_dict()}
+
+@app.post("/stats/reset")
+async def reset_stats():
+    stats.reset()
+    return {"status": "ok"}
+
+@app.post("/config")
+async def update_config(request: Request):
+    """运行时修改延迟分布和错误率，便于压测中切换场景"""
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "请求体不是有效的JSON"})
+    if not isinstance(body, dict):
+        return JSONResponse(status_code=400, content={"error": "请求体必须是JSON对象"})
+
+    # 先全部解析校验，全部通过后再写入配置，避免无效值留在配置中
+    updates: Dict[str, Any] = {}
+    try:
+        if "latency" in body:
+            updates["latency"] = str(body["latency"])
+            parse_latency(updates["latency"])
+        if "chunk_delay_ms" in body:
+            updates["chunk_delay_ms"] = float(body["chunk_delay_ms"])
+            if updates["chunk_delay_ms"] < 0:
+                raise ValueError("chunk_delay_ms 不能为负数")
+        if "chunk_size" in body:
+            updates["chunk_size"] = int(body["chunk_size"])
+            if updates["chunk_size"] < 1:
+                raise ValueError("chunk_size 必须大于0")
+        if "error_rate" in body:
+            updates["error_rate"] = float(body["error_rate"])
+            if not 0 <= updates["error_rate"] <= 1:
+                raise ValueError("error_rate 必须在 0~1 之间")
+        if "error_statuses" in body:
+            updates["error_statuses"] = [int(s) for s in body["error_statuses"]]
+            if not updates["error_statuses"] or not all(400 <= s <= 599 for s in updates["error_statuses"]):
+                raise ValueError("error_statuses 必须是非空的 4xx/5xx 状态码列表")
+    except (TypeError, ValueError, IndexError) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    for key, value in updates.items():
+        setattr(config, key, value)
+    return config.to_dict()
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy"}
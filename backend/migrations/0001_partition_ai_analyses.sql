@@ -0,0 +1,49 @@
+-- AI分析结果改为只追加、按天分区的表
+--
+-- 原 ai_analyses 为普通表时重命名为 ai_analyses_legacy，由 app/services/analysis_store.py
+-- 在创建好分区后把保留期内的数据复制过来并删除旧表。
+-- 按天的分区（ai_analyses_pYYYYMMDD）同样由 analysis_store 创建和删除。
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'ai_analyses' AND c.relkind = 'r' AND n.nspname = current_schema()
+    ) THEN
+        ALTER TABLE ai_analyses RENAME TO ai_analyses_legacy;
+        ALTER INDEX IF EXISTS ai_analyses_pkey RENAME TO ai_analyses_legacy_pkey;
+        ALTER INDEX IF EXISTS ix_ai_analyses_id RENAME TO ix_ai_analyses_legacy_id;
+        ALTER INDEX IF EXISTS ix_ai_analyses_analysis_type RENAME TO ix_ai_analyses_legacy_analysis_type;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS ai_analyses (
+    id BIGSERIAL,
+    stock_id INTEGER REFERENCES stocks(id),
+    analysis_type VARCHAR(50),
+    analysis_content JSON,
+    confidence_score NUMERIC(3, 2),
+    tags JSON,
+    prompt_template TEXT,
+    valid_until TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS ix_ai_analyses_stock_type_created
+    ON ai_analyses (stock_id, analysis_type, created_at DESC);
+
+-- 每只股票每种分析最新结果的指针，读取时通过 (analysis_id, analysis_created_at) 定位到分区
+CREATE TABLE IF NOT EXISTS ai_analysis_latest (
+    stock_id INTEGER NOT NULL REFERENCES stocks(id),
+    analysis_type VARCHAR(50) NOT NULL,
+    analysis_id BIGINT NOT NULL,
+    analysis_created_at TIMESTAMP NOT NULL,
+    valid_until TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (stock_id, analysis_type)
+);
+
+CREATE INDEX IF NOT EXISTS ix_ai_analysis_latest_analysis_created_at
+    ON ai_analysis_latest (analysis_created_at);
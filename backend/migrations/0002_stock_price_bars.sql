@@ -0,0 +1,37 @@
+-- 紧凑的日K线表：主键 (stock_id, date)，float8 价格，bigint 成交量，按年分区
+--
+-- create_all 建出的普通表重命名为 stock_price_bars_legacy，由 app/services/price_store.py
+-- 创建年度分区后把数据复制过来，并从旧的 stock_prices 表回填历史数据。
+-- 年度分区（stock_price_bars_yYYYY）同样由 price_store 按需创建。
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'stock_price_bars' AND c.relkind = 'r' AND n.nspname = current_schema()
+    ) THEN
+        ALTER TABLE stock_price_bars RENAME TO stock_price_bars_legacy;
+        ALTER INDEX IF EXISTS stock_price_bars_pkey RENAME TO stock_price_bars_legacy_pkey;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS stock_price_bars (
+    stock_id INTEGER NOT NULL REFERENCES stocks(id),
+    date DATE NOT NULL,
+    open_price DOUBLE PRECISION,
+    high_price DOUBLE PRECISION,
+    low_price DOUBLE PRECISION,
+    close_price DOUBLE PRECISION,
+    adj_close DOUBLE PRECISION,
+    volume BIGINT,
+    PRIMARY KEY (stock_id, date)
+) PARTITION BY RANGE (date);
+
+-- 区间扫描只读收盘价和成交量时可以走仅索引扫描
+CREATE INDEX IF NOT EXISTS ix_stock_price_bars_stock_date_covering
+    ON stock_price_bars (stock_id, date DESC) INCLUDE (close_price, volume);
+
+-- 按日期的全市场扫描（行情更新、清理）使用体积很小的 BRIN 索引
+CREATE INDEX IF NOT EXISTS ix_stock_price_bars_date_brin
+    ON stock_price_bars USING brin (date);
@@ -22,6 +22,7 @@ const AIChat = () => {
   const [messages, setMessages] = useState([]);
   const [inputValue, setInputValue] = useState('');
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   const [sessionId, setSessionId] = useState(null);
   const messagesEndRef = useRef(null);
 
@@ -73,14 +74,131 @@ const AIChat = () => {
     setInputValue('');
     setLoading(true);
 
+    const aiMessageId = (Date.now() + 1).toString();
+
+    try {
+      await streamQuery(userMessage.content, aiMessageId);
+    } catch (streamError) {
+      console.error('流式回答失败:', streamError);
+      if (streamError.received) {
+        message.error('回答中断: ' + streamError.message);
+      } else {
+        // 尚未收到任何内容时回退到非流式接口
+        await sendQueryFallback(userMessage.content, aiMessageId);
+      }
+    } finally {
+      setLoading(false);
+      setStreaming(false);
+    }
+  };
+
+  const parseSSE = (buffer, onEvent) => {
+    // 按空行切分事件，返回尚不完整的剩余部分
+    const parts = buffer.split('\n\n');
+    const rest = parts.pop();
+    parts.forEach(part => {
+      let event = 'message';
+      const dataLines = [];
+      part.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          dataLines.push(line.slice(5).trim());
+        }
+      });
+      if (dataLines.length > 0) {
+        onEvent(event, JSON.parse(dataLines.join('\n')));
+      }
+    });
+    return rest;
+  };
+
+  const streamQuery = async (text, aiMessageId) => {
+    const response = await fetch('/api/v1/analysis/query/stream', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message: text, session_id: sessionId })
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+
+    let received = false;
+    let contextSymbols = [];
+    const upsertAiMessage = (patch) => {
+      received = true;
+      setStreaming(true);
+      setMessages(prev => {
+        if (!prev.some(m => m.id === aiMessageId)) {
+          const base = { id: aiMessageId, type: 'ai', content: '', timestamp: new Date().toISOString(), contextSymbols };
+          return [...prev, { ...base, ...patch(base) }];
+        }
+        return prev.map(m => (m.id === aiMessageId ? { ...m, ...patch(m) } : m));
+      });
+    };
+
+    const handleEvent = (event, data) => {
+      switch (event) {
+        case 'context':
+          contextSymbols = data.context_symbols || [];
+          break;
+        case 'answer':
+          upsertAiMessage(m => ({ content: (m.content || '') + data.value }));
+          break;
+        case 'analysis':
+          upsertAiMessage(() => ({ analysis: data.value }));
+          break;
+        case 'recommendations':
+          upsertAiMessage(() => ({ recommendations: Array.isArray(data.value) ? data.value : [] }));
+          break;
+        case 'chart_suggestions':
+          upsertAiMessage(() => ({ chartData: data.value }));
+          break;
+        case 'references':
+          upsertAiMessage(() => ({ references: data.value }));
+          break;
+        case 'done':
+          upsertAiMessage(m => ({
+            content: data.answer || m.content,
+            analysis: data.response?.analysis,
+            recommendations: data.response?.recommendations,
+            chartData: data.response?.chart_data,
+            references: data.response?.reference_urls,
+            contextSymbols: data.context_symbols
+          }));
+          break;
+        case 'error':
+          throw new Error(data.detail || '未知错误');
+        default:
+          break;
+      }
+    };
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    try {
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer = parseSSE(buffer + decoder.decode(value, { stream: true }), handleEvent);
+      }
+    } catch (error) {
+      error.received = received;
+      throw error;
+    }
+    return received;
+  };
+
+  const sendQueryFallback = async (text, aiMessageId) => {
     try {
       const response = await axios.post('/api/v1/analysis/query', {
-        message: inputValue,
+        message: text,
         session_id: sessionId
       });
 
       const aiMessage = {
-        id: (Date.now() + 1).toString(),
+        id: aiMessageId,
         type: 'ai',
         content: response.data.data.answer,
         timestamp: new Date().toISOString(),
@@ -97,7 +215,7 @@ const AIChat = () => {
       message.error('发送消息失败: ' + (error.response?.data?.detail || error.message));
       
       const errorMessage = {
-        id: (Date.now() + 1).toString(),
+        id: aiMessageId,
         type: 'ai',
         content: '抱歉，我暂时无法回答您的问题。请稍后再试。',
         timestamp: new Date().toISOString(),
@@ -105,8 +223,6 @@ const AIChat = () => {
       };
 
       setMessages(prev => [...prev, errorMessage]);
-    } finally {
-      setLoading(false);
     }
   };
 
@@ -289,7 +405,7 @@ const AIChat = () => {
             renderItem={renderMessage}
             style={{ backgroundColor: 'transparent' }}
           />
-          {loading && (
+          {loading && !streaming && (
             <div style={{ textAlign: 'center', padding: '20px' }}>
               <Spin />
               <Text style={{ marginLeft: 8 }}>AI正在思考中...</Text>
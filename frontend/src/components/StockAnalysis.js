@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Card, 
   Input, 
@@ -51,9 +51,56 @@ const StockAnalysis = () => {
     pageSize: 10,
     total: 0
   });
+  // 每页对应的游标（第 n 页的游标由第 n-1 页返回），按页翻动时走游标分页
+  const mappingCursors = useRef({ pageSize: 10, cursors: {} });
   const [mappingFormVisible, setMappingFormVisible] = useState(false);
   const [editingMapping, setEditingMapping] = useState(null);
   const [mappingForm] = Form.useForm();
+  // 通过 WebSocket 推送的实时报价
+  const [liveQuote, setLiveQuote] = useState(null);
+  const currentSymbol = stockData?.stock_info?.symbol;
+
+  useEffect(() => {
+    if (!currentSymbol) {
+      return undefined;
+    }
+    let socket = null;
+    let retryTimer = null;
+    let retryDelay = 1000;
+    let stopped = false;
+
+    const connect = () => {
+      const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+      socket = new WebSocket(`${protocol}//${window.location.host}/api/v1/quotes/ws`);
+      socket.onopen = () => {
+        retryDelay = 1000;
+        socket.send(JSON.stringify({ action: 'subscribe', symbols: [currentSymbol] }));
+      };
+      socket.onmessage = (event) => {
+        const payload = JSON.parse(event.data);
+        if (payload.type === 'quotes' && payload.data[currentSymbol]) {
+          setLiveQuote(payload.data[currentSymbol]);
+        }
+      };
+      socket.onclose = () => {
+        // 断线后按指数退避重连，最长30秒
+        if (!stopped) {
+          retryTimer = setTimeout(connect, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, 30000);
+        }
+      };
+    };
+
+    setLiveQuote(null);
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (socket) {
+        socket.close();
+      }
+    };
+  }, [currentSymbol]);
 
   const handleSearch = async (symbol) => {
     if (!symbol) {
@@ -158,10 +205,20 @@ const StockAnalysis = () => {
   const loadMappingData = async (page = 1, pageSize = 10) => {
     setMappingLoading(true);
     try {
-      const skip = (page - 1) * pageSize;
-      const response = await axios.get(`/api/v1/stocks/mappings?skip=${skip}&limit=${pageSize}`);
-      const { items, total } = response.data.data;
+      if (mappingCursors.current.pageSize !== pageSize) {
+        mappingCursors.current = { pageSize, cursors: {} };
+      }
+      const cursor = mappingCursors.current.cursors[page];
+      // 有游标时按游标取页；第一页或跳页（没有上一页的游标）时按偏移取
+      const query = cursor
+        ? `cursor=${encodeURIComponent(cursor)}&limit=${pageSize}`
+        : `skip=${(page - 1) * pageSize}&limit=${pageSize}`;
+      const response = await axios.get(`/api/v1/stocks/mappings?${query}`);
+      const { items, total, next_cursor } = response.data.data;
       
+      if (next_cursor) {
+        mappingCursors.current.cursors[page + 1] = next_cursor;
+      }
       setMappingData(items);
       setMappingPagination({
         current: page,
@@ -545,6 +602,47 @@ const StockAnalysis = () => {
             </Row>
           )}
 
+          {stockData && liveQuote && (
+            <Row gutter={16}>
+              <Col span={6}>
+                <Card size="small">
+                  <Statistic
+                    title="最新价"
+                    value={liveQuote.price}
+                    precision={2}
+                  />
+                </Card>
+              </Col>
+              <Col span={6}>
+                <Card size="small">
+                  <Statistic
+                    title="涨跌幅"
+                    value={liveQuote.change_percent}
+                    precision={2}
+                    suffix="%"
+                    valueStyle={{ color: liveQuote.change >= 0 ? '#cf1322' : '#3f8600' }}
+                  />
+                </Card>
+              </Col>
+              <Col span={6}>
+                <Card size="small">
+                  <Statistic
+                    title="成交量"
+                    value={liveQuote.volume}
+                  />
+                </Card>
+              </Col>
+              <Col span={6}>
+                <Card size="small">
+                  <Statistic
+                    title="更新时间"
+                    value={new Date(liveQuote.timestamp).toLocaleTimeString()}
+                  />
+                </Card>
+              </Col>
+            </Row>
+          )}
+
           {stockData && (
             <Space>
               <Button 
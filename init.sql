@@ -1,5 +1,8 @@
 -- 创建数据库表结构
 
+-- 三元组扩展（股票名称模糊搜索）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- 股票基本信息表
 CREATE TABLE IF NOT EXISTS stocks (
     id SERIAL PRIMARY KEY,
@@ -86,6 +89,8 @@ CREATE INDEX IF NOT EXISTS idx_ai_analysis_stock_type ON ai_analysis(stock_id, a
 CREATE INDEX IF NOT EXISTS idx_ai_analysis_tags ON ai_analysis USING GIN(tags);
 CREATE INDEX IF NOT EXISTS idx_tasks_status ON analysis_tasks(status);
 CREATE INDEX IF NOT EXISTS idx_recommendations_score ON stock_recommendations(score DESC);
+CREATE INDEX IF NOT EXISTS ix_stocks_name_trgm ON stocks USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_stocks_symbol_trgm ON stocks USING gin (symbol gin_trgm_ops);
 
 -- 插入一些示例数据
 INSERT INTO stocks (symbol, name, exchange, sector, industry) VALUES